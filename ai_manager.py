@@ -4,59 +4,83 @@ Versión: 7.0 [CONTEXTO CRUZADO + PERSISTENCIA SEGURA]
 Optimización: Acepta 'smart_context' de Capas 1/2, Caché Tolerante a Fallos (Vercel) y Filtro Anti-PDF-Raw
 """
 
-import re
 import time
 import json
 import os
 import requests
-from typing import Optional, List, Dict
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Optional, List, Dict, Iterator, Tuple, Union
 import google.generativeai as genai
 
 from config import (
-    OPENROUTER_API_KEY, GEMINI_API_KEY,
+    OPENROUTER_API_KEY, GEMINI_API_KEY, OPENROUTER_URL,
     OPENROUTER_MODELS, GEMINI_MODELS,
-    AI_MAX_PDF_CONTEXT, AI_MAX_WEB_CONTEXT,
+    AI_MAX_PDF_CONTEXT, AI_MAX_WEB_CONTEXT, AI_PROMPT_TOKEN_BUDGET, MODEL_PROMPT_TOKENS,
+    AI_PROMPT_WEB_SHARE, AI_PROMPT_HISTORY_MESSAGES, AI_MIN_MODEL_TIME,
+    AI_HEALTH_WINDOW, AI_HEALTH_DEFAULT_LATENCY, AI_BREAKER_FAILURES, AI_BREAKER_OPEN_SECONDS,
+    AI_BREAKER_MAX_OPEN_SECONDS,
+    AI_HEDGE_DELAY, AI_HEDGE_MAX_CONCURRENCY, AI_MODEL_POOL_SIZE, LLM_CONNECT_TIMEOUT, LLM_READ_TIMEOUT, LLM_POOL_SIZE,
+    MODEL_QUOTAS, MODEL_QUOTA_POOLS, GEMINI_MIN_INTERVAL, GEMINI_COOLDOWN, MODEL_ERROR_COOLDOWN, AI_QUEUE_MAX_WAIT,
+    AI_CACHE_NEAR_THRESHOLD, AI_CACHE_SQLITE, AI_CACHE_MAX_BYTES, AI_CACHE_STORE_MAX_BYTES, AI_CACHE_TTL,
     CACHE_FOLDER
 )
+from document_index import passage_blocks
+from passage_buffer import PassageBuffer, as_passage_buffer
+from query_analysis import QueryAnalysis, analyze_query
+from knowledge_pack import KnowledgePack, get_knowledge_pack
+from response_cache import ResponseCache
+from response_store import open_response_store
+from singleflight import SingleFlight
+from llm_clients import GeminiClient, OpenRouterClient
+from prompt_builder import BuiltPrompt, PromptSources, build_prompt
+from deadline import Deadline
+from model_health import ModelHealth, USEFUL, USELESS, ERROR
+from model_scheduler import (
+    ModelScheduler, is_rate_limit_error, retry_after_from_error, retry_after_from_headers
+)
 
-# Clasificaciones
-QUERY_CLASSIFICATIONS = {
-    'matrícula': ['matrícula', 'matricula', 'matricularme', 'inscripción', 'proceso', 'pasos'],
-    'traslado': ['traslado', 'trasladar', 'cambiar de instituto'],
-    'reserva': ['reserva', 'reservar'],
-    'reincorporación': ['reincorporación', 'reincorporacion', 'volver'],
-    'cambio_turno': ['cambio de turno', 'turno', 'horario'],
-    'titulación': ['titulación', 'título', 'bachiller', 'titulado'],
-    'costos': ['costo', 'precio', 'pago', 'cuánto', 'tarifa', 'mensualidad'],
-    'fechas': ['fecha', 'plazo', 'cuándo', 'cronograma'],
-    'requisitos': ['requisito', 'documento', 'necesito', 'papeles'],
-    'vacantes': ['vacante', 'cupos', 'disponibilidad'],
-    'carreras': ['carrera', 'programa', 'especialidad', 'arquitectura', 'contabilidad', 'enfermería', 'mecatrónica', 'farmacia'],
-    'certificados': ['certificado', 'constancia', 'récord'],
-    'becas': ['beca', 'becado', 'descuento', 'exoneración'],
-    'saludo': ['hola', 'buenos días', 'buenas tardes', 'saludos'],
-    'despedida': ['gracias', 'adiós', 'chau', 'hasta luego'],
-}
+POOL_QUEUE_POLL = 0.05  # Cada cuánto se revisa si una llamada encolada en el pool ya arrancó (s)
 
 class AIManager:
     """Gestor V7 con Contexto Cruzado y Persistencia Híbrida."""
     
-    OPENROUTER_URL = "https://openrouter.ai/api/v1/chat/completions"
+    OPENROUTER_URL = OPENROUTER_URL
     CACHE_FILE = "cache/ai_response_cache.json"
     
     def __init__(self):
         self.openrouter_key = OPENROUTER_API_KEY
         self.openrouter_models = OPENROUTER_MODELS
         self.gemini_models = GEMINI_MODELS
-        self.gemini_cooldowns: Dict[str, float] = {m: 0 for m in self.gemini_models}
+        # Cuotas RPM/RPD/TPM y pausas por 429 de cada modelo (los modelos sin cuota declarada
+        # quedan limitados a una llamada cada GEMINI_MIN_INTERVAL segundos)
+        self.scheduler = ModelScheduler(MODEL_QUOTAS, MODEL_QUOTA_POOLS,
+                                        default_quota={"rpm": max(1, 60 // GEMINI_MIN_INTERVAL)},
+                                        rate_limit_cooldown=GEMINI_COOLDOWN, error_cooldown=MODEL_ERROR_COOLDOWN)
+        # Llamadas a modelos en paralelo (cadena cubierta). Las perdedoras no se pueden abortar
+        # a mitad de la petición HTTP: terminan en segundo plano y su resultado se descarta,
+        # por eso el pool se dimensiona para varios requests simultáneos (AI_MODEL_POOL_SIZE).
+        self.hedge_delay = AI_HEDGE_DELAY
+        self.hedge_max_concurrency = max(1, AI_HEDGE_MAX_CONCURRENCY)
+        # Orden dinámico de cada cadena: el modelo sano más rápido primero; circuito abierto = se salta
+        self.health = ModelHealth(AI_HEALTH_WINDOW, AI_BREAKER_FAILURES, AI_BREAKER_OPEN_SECONDS,
+                                  AI_BREAKER_MAX_OPEN_SECONDS, default_latency=AI_HEALTH_DEFAULT_LATENCY)
+        # Preguntas idénticas simultáneas (misma versión de contenido + forma canónica): una sola generación
+        self.in_flight = SingleFlight()
+        self._model_pool = ThreadPoolExecutor(max_workers=max(self.hedge_max_concurrency, AI_MODEL_POOL_SIZE),
+                                              thread_name_prefix="ai-model")
         
-        # CACHÉ DE RESPUESTAS (Intentar Carga Persistente)
-        self.response_cache = self._load_cache_from_disk()
-        self.max_cache_size = 1000
+        # CACHÉ DE RESPUESTAS (SQLite WAL, o JSON en memoria si no se puede) + nivel de casi duplicados
+        store = open_response_store(CACHE_FOLDER) if AI_CACHE_SQLITE else None
+        # Con SQLite el JSON solo se lee para sembrar una base vacía (primera ejecución)
+        seed = self._load_cache_from_disk() if store is None or store.count() == 0 else None
+        self.response_cache = ResponseCache(seed, max_bytes=AI_CACHE_MAX_BYTES, ttl=AI_CACHE_TTL,
+                                            near_threshold=AI_CACHE_NEAR_THRESHOLD, store=store,
+                                            store_max_bytes=AI_CACHE_STORE_MAX_BYTES)
         
         print("\n" + "="*50)
         print("[AIManager V7] SISTEMA INICIADO (Contexto Cruzado Activado)")
-        print(f"[AIManager] Respuestas en memoria: {len(self.response_cache)}")
+        backend = "SQLite" if store is not None else "memoria"
+        print(f"[AIManager] Respuestas en cache ({backend}): {len(self.response_cache)}")
         print("="*50 + "\n")
         
         if GEMINI_API_KEY:
@@ -64,6 +88,12 @@ class AIManager:
                 genai.configure(api_key=GEMINI_API_KEY)
             except Exception as e:
                 print(f"[AIManager] Error config Gemini: {e}")
+        
+        # Clientes reutilizables: un handle por modelo Gemini y una sesión keep-alive para OpenRouter
+        self.gemini_client = GeminiClient(temperature=0.4, read_timeout=LLM_READ_TIMEOUT)
+        self.openrouter_client = OpenRouterClient(self.OPENROUTER_URL, self.openrouter_key,
+                                                  connect_timeout=LLM_CONNECT_TIMEOUT, read_timeout=LLM_READ_TIMEOUT,
+                                                  pool_size=LLM_POOL_SIZE)
 
     def _load_cache_from_disk(self) -> Dict[str, str]:
         if os.path.exists(self.CACHE_FILE):
@@ -76,69 +106,70 @@ class AIManager:
         return {}
 
     def _save_cache_to_disk(self):
-        """Intenta guardar en disco. Silencioso si falla (Vercel)."""
+        """Intenta guardar en disco (solo sin SQLite). Silencioso si falla (Vercel)."""
         try:
             os.makedirs(os.path.dirname(self.CACHE_FILE), exist_ok=True)
             with open(self.CACHE_FILE, 'w', encoding='utf-8') as f:
-                json.dump(self.response_cache, f, ensure_ascii=False, indent=2)
+                json.dump(self.response_cache.to_dict(), f, ensure_ascii=False, indent=2)
             # print("[AIManager] 💾 Guardado.") # Comentado para no spammear logs
         except Exception:
             # En Vercel esto fallará a menudo. No importa, el caché vivirá en memoria del container activo.
             pass
 
     def _get_query_hash(self, text: str) -> str:
-        clean = re.sub(r'[^\w\s]', '', text.lower()).strip()
-        clean = re.sub(r'\s+', ' ', clean)
-        return clean
+        return analyze_query(text).cache_key
 
-    def _get_cached_response(self, query: str) -> Optional[str]:
-        key = self._get_query_hash(query)
-        if key in self.response_cache:
+    def _get_cached_response(self, query: str, key: Optional[str] = None, canonical: Optional[str] = None,
+                             version: str = "") -> Optional[str]:
+        key = key or self._get_query_hash(query)
+        response, matched_key = self.response_cache.lookup(key, canonical, version)
+        if response is None:
+            return None
+        if matched_key == key:
             print(f"[AIManager] ⚡ Cache HIT: '{key[:30]}...'")
-            return self.response_cache[key]
-        return None
+        else:
+            print(f"[AIManager] ≈ Cache NEAR-HIT: '{key[:30]}...' -> '{matched_key[:30]}...'")
+        return response
 
-    def _save_to_cache(self, query: str, response: str):
-        key = self._get_query_hash(query)
-        # LRU simple
-        if len(self.response_cache) >= self.max_cache_size:
-            first_key = next(iter(self.response_cache))
-            del self.response_cache[first_key]
-        self.response_cache[key] = response
-        self._save_cache_to_disk()
-
-    # DATOS VERIFICADOS V5 (Docentes Completos)
-    VERIFIED_CONTEXT = {
-        'costos': "INFORMACIÓN OFICIAL DE COSTOS (Fuente: TUPA 2025 VERIFICADA):\n- Matrícula Regular: S/. 200.00\n- Matrícula Extemporánea: S/. 260.00\n- Matrícula por Unidad Didáctica: S/. 50.00\n- Derecho de Examen de Admisión: S/. 200.00\n- Pagos en Banco de la Nación, Cta Cte: 0000289051.",
-        'fechas': "CRONOGRAMA DE ADMISIÓN 2025 OFICIAL:\n- Inscripción Postulantes: 17 de febrero al 12 de abril 2025.\n- Inscripción Exonerados/Traslados: 14 de febrero al 14 de marzo 2025.\n- Examen de Admisión: Domingo 13 de abril 2025.\n- Inicio de Clases: 21 de abril 2025.",
-        'becas': "INFORMACIÓN OFICIAL DE BECAS:\n- Beca de Excelencia: Exoneración del 100% de la matrícula para el primer puesto de cada semestre.\n- Beca Servicio Militar: Descuento del 50% en matrícula para licenciados o personal en servicio activo.",
-        'matrícula': "PROCESO DE MATRÍCULA OFICIAL (TUPA 2025):\n1. REALIZAR PAGO: S/. 200.00 en Banco de la Nación (Cta 0000289051).\n2. CANJEAR VOUCHER: En Tesorería por Recibo de Ingreso.\n3. REGISTRO: En Secretaría Académica validar datos.\n4. FICHA DE MATRÍCULA: Recibir constancia firmada.",
-        'autoridades': "AUTORIDADES VIGENTES 2025:\n- Directora General: Mg. Elsa Mary Castilla Almeyda\n- Jefe de Unidad Académica: Mg. Moisés Vargas Soto\n- Jefe de Administración: Lic. Cardenal Ipurre Contreras\n- Secretario Académico: Ing. Javier Alarcon Mayta",
-        'ubicacion': "UBICACIÓN:\n- Dirección: Av. José Olaya N° 120, San Gabriel, Villa María del Triunfo.\n- Teléfonos: (01) 500 6177 / (01) 570 7726.\n"
-    }
-
-    def _inject_verified_context(self, query_type: str, user_message: str) -> str:
+    def _save_to_cache(self, query: str, response: str, key: Optional[str] = None, canonical: Optional[str] = None,
+                       version: str = ""):
+        key = key or self._get_query_hash(query)
+        self.response_cache.put(key, response, canonical, version)
+        if self.response_cache.store is None:
+            self._save_cache_to_disk()  # Con SQLite la fila ya quedó persistida (UPSERT)
+
+    def get_cache_stats(self) -> Dict:
+        """Contadores del cache de respuestas (hits, casi duplicados, misses, bytes y descartes)."""
+        return dict(self.response_cache.stats(), in_flight=self.in_flight.stats())
+
+    def get_client_stats(self) -> Dict:
+        """Llamadas, latencia media y conexiones abiertas por cliente de proveedor."""
+        return {'gemini': self.gemini_client.stats.to_dict(), 'openrouter': self.openrouter_client.stats.to_dict()}
+
+    def _flight_key(self, analysis: QueryAnalysis, corpus_version: str, conversation_history) -> Optional[tuple]:
+        """Clave de coalescencia; None si la respuesta depende del historial de la conversación."""
+        if conversation_history:
+            return None
+        return (corpus_version, analysis.canonical or analysis.cache_key)
+
+    def _inject_verified_context(self, query_type: str, user_message: str, query_lower: Optional[str] = None,
+                                 pack: Optional[KnowledgePack] = None) -> str:
+        # Datos verificados y docentes por carrera: paquete de conocimiento (knowledge_pack.py)
+        pack = pack or get_knowledge_pack()
         injected_text = ""
         # 1. Inyección por tipo
-        if query_type in self.VERIFIED_CONTEXT:
-            injected_text += f"\n=== INFORMACIÓN OFICIAL VERIFICADA ({query_type.upper()}) ===\n{self.VERIFIED_CONTEXT[query_type]}\n"
+        if query_type in pack.verified_context:
+            injected_text += f"\n=== INFORMACIÓN OFICIAL VERIFICADA ({query_type.upper()}) ===\n{pack.verified_context[query_type]}\n"
         
         # 2. Inyección Carreras (Docentes Completos V5)
-        query_norm = user_message.lower()
-        career_data = {
-            "farmacia": "DOCENTES TÉCNICA EN FARMACIA (8): Yolanda Suarez Diaz (Coord), Carmen Rosa Acco Gavilan, Seberino Alberto Canelo Blas, Miguel Ramiro Huarcaya Fernández, Fiorela Jeanette Ortiz Ortiz, Johao Junior Rodriguez Quishac, Emilia Ramirez Arnao, Shannon Calderon Quispe.",
-            "enfermeria": "DOCENTES ENFERMERÍA TÉCNICA (8): Vicente Egusquiza Pozo (Coord), Fabiola Rodriguez Vega, Diana Noelia Saenz Charaja, Teresa Liliana Montoya Villasante, Leonor Nieto Pocomucha, Lizbeth Fabiola Jara Raraz, Sandra Oré Calderón, Mercedes Fuentes Lazo.",
-            "arquitectura": "DOCENTES ARQUITECTURA (10): Hector Jorge Vidalón Jorge (Coord), Pedro Pachas Barrionuevo, Patricia Janet Benites Yglesias, Carlos Tasayco Yataco, Humberto Pablo Vega Cruz, John Harry Garriazo Castañeda, Christian Federico Flores Vargas, José Ricardo Cortez Camacho, Anthony Francisco Chuan Garcia, Luis Alberto Chacaltana Arnao.",
-            "contabilidad": "DOCENTES CONTABILIDAD (9): Maria Cristina Maguiña Mallma (Coord), Elsa Castilla Almeyda, Teresa Cajo Rojas, Marisela Janet Palacios Castillo, Norma Yolanda Quispe Molina, Fernando Valderrama Castro, Luisa Verónica Sanchez Garcia, Elizabeth Manuela Ore Callirgos, Coralia Vilca Gonzales.",
-            "mecatronica": "DOCENTES MECATRÓNICA (9): Cesar Augusto Curampa de la Cruz (Coord), Moisés Vargas Soto, Luis Agustín Mamani Chipana, Guillermo Carlos Barboza Tello, Jimmy Quispe Llamoca, Felix Hans Rivas Calla, Juan José Montaño Vega, Washington Ramirez Patiño, Juan Carlos Pancora Montes.",
-            "empleabilidad": "DOCENTES EMPLEABILIDAD (10): Nilton Aquiles Michuy Suyo, Richard Mario Celis Calero, Daniel Quispe De La Torre, Juan Leopoldo Ranilla Medina, Wilmer Alarcon Mayta, Daniel Heli Flores Niño, Javier Alarcon Mayta, Lucia Lila Mendoza Huertas, Miguel Valerio Millones Yauri, Marilu Carpio Perez."
-        }
+        query_norm = query_lower if query_lower is not None else user_message.lower()
+        career_data = pack.careers
         
         if query_type == 'carreras' or any(x in query_norm for x in ['docente', 'profesor', 'enseña']):
             for career, data in career_data.items():
                 if career in query_norm:
                     injected_text += f"\n=== DATOS VERIFICADOS ({career.upper()}) ===\n{data}\n"
-            if 'empleabilidad' in query_norm or 'transversal' in query_norm:
+            if ('empleabilidad' in query_norm or 'transversal' in query_norm) and 'empleabilidad' in career_data:
                  injected_text += f"\n=== DATOS VERIFICADOS (EMPLEABILIDAD) ===\n{career_data['empleabilidad']}\n"
                     
         return injected_text
@@ -167,125 +198,394 @@ class AIManager:
         return True
 
     def classify_query(self, message: str) -> str:
-        text = message.lower().strip()
-        replacements = {"á":"a", "é":"e", "í":"i", "ó":"o", "ú":"u", "ñ":"n"}
-        for old, new in replacements.items(): text = text.replace(old, new)
-        for qtype, keywords in QUERY_CLASSIFICATIONS.items():
-            for kw in keywords:
-                if kw in text: return qtype
-        return 'general'
+        # Tipos y palabras clave en keywords.QUERY_CLASSIFICATIONS (autómata compartido)
+        return analyze_query(message).query_class
 
     # -------------------------------------------------------------------------
     # MÉTODO PRINCIPAL V7: Acepta 'smart_context_injection'
     # -------------------------------------------------------------------------
-    def generate_response(self, user_message: str, pdf_context: str, web_context: str = "", 
-                         conversation_history: list = None, smart_context_injection: str = None) -> Optional[str]:
-        """Genera respuesta usando todas las capas + Contexto Inyectado."""
+    def generate_response(self, user_message: str, pdf_context: List[Dict], web_context: Union[str, PassageBuffer] = "", 
+                         conversation_history: list = None, smart_context_injection: str = None,
+                         analysis: Optional[QueryAnalysis] = None, corpus_version: str = "",
+                         deadline: Optional[Deadline] = None) -> Optional[str]:
+        """Genera respuesta usando todas las capas + Contexto Inyectado.
+        
+        pdf_context: pasajes rankeados de GoogleDriveManager.search_in_documents.
+        web_context: PassageBuffer del sitio web (o string); solo se copian los pasajes elegidos.
+        analysis: QueryAnalysis del request (si se omite se calcula aquí).
+        corpus_version: versión del contenido (PDFs + web + conocimiento); el cache solo
+            sirve respuestas generadas con la misma versión.
+        deadline: plazo del request; sin tiempo para otra llamada a un modelo devuelve None.
+        """
+        analysis = analysis or analyze_query(user_message)
+        deadline = deadline or Deadline()
         
         # 0. Cache Hit?
-        cached = self._get_cached_response(user_message)
+        cached = self._get_cached_response(user_message, analysis.cache_key, analysis.canonical, corpus_version)
         if cached: return cached
 
-        query_type = self.classify_query(user_message)
-        
-        # 1. Preparar Contexto Base
-        gemini_context = self._get_relevant_context(user_message, pdf_context, max_chars=AI_MAX_PDF_CONTEXT)
-        
-        # 2. INYECCIÓN CRUZADA (Prioridad Máxima): ¿SmartResponse nos dio algo?
-        if smart_context_injection:
-            print(f"[AIManager] 🔗 Contexto Cruzado Recibido (Capa 1/2): {len(smart_context_injection)} chars")
-            # Lo ponemos UN POCO ANTES de los datos verificados para que la IA entienda que es referencia
-            gemini_context = f"=== CONTEXTO DE BÚSQUEDA PREVIO ===\n{smart_context_injection}\n\n" + gemini_context
+        # 0b. ¿La misma pregunta ya se está generando? Se espera y se comparte ese resultado
+        generate = lambda: self._generate_uncached(user_message, pdf_context, web_context, conversation_history,
+                                                   smart_context_injection, analysis, corpus_version, deadline)
+        key = self._flight_key(analysis, corpus_version, conversation_history)
+        if key is None:
+            return generate()
+        try:
+            response, shared = self.in_flight.do(key, generate, timeout=deadline.timeout())
+        except TimeoutError:
+            print(f"[AIManager] ⏱️ Plazo agotado esperando una generación en vuelo: '{analysis.cache_key[:30]}...'")
+            return None
+        if shared:
+            print(f"[AIManager] 🔗 Respuesta compartida con una generación en vuelo: '{analysis.cache_key[:30]}...'")
+            if response is None:
+                # El líder no obtuvo respuesta: se intenta por cuenta propia
+                return generate()
+        return response
 
-        # 3. INYECCIÓN VERIFICADA (Datos Duros V5)
-        verified_data = self._inject_verified_context(query_type, user_message)
-        if verified_data:
-            gemini_context = verified_data + "\n\n" + gemini_context
-            
-        final_web = self._get_relevant_context(user_message, web_context, max_chars=AI_MAX_WEB_CONTEXT)
+    def _generate_uncached(self, user_message, pdf_context, web_context, conversation_history,
+                           smart_context_injection, analysis: QueryAnalysis, corpus_version: str,
+                           deadline: Deadline) -> Optional[str]:
+        query_type = analysis.query_class
+        sources = self._prepare_context(user_message, pdf_context, web_context, smart_context_injection, analysis)
         
-        # 4. Invocación IA
-        final_response = self._run_model_chain("gemini", user_message, gemini_context, final_web, conversation_history, query_type)
+        # 4. Invocación IA (cada modelo recibe el prompt armado con su presupuesto de tokens)
+        final_response = self._run_model_chain("gemini", user_message, sources, conversation_history, query_type,
+                                               deadline)
         
         if not final_response:
              # Fallback ligero
-             final_response = self._run_model_chain("openrouter", user_message, gemini_context[:8000], final_web, conversation_history, query_type)
+             final_response = self._run_model_chain("openrouter", user_message, sources, conversation_history,
+                                                    query_type, deadline)
 
         # 5. Aprendizaje Automático
         if final_response:
-             self._save_to_cache(user_message, final_response)
+             self._save_to_cache(user_message, final_response, analysis.cache_key, analysis.canonical,
+                                 corpus_version)
              
         return final_response
 
-    def _get_relevant_context(self, query: str, full_context: str, max_chars: int = 40000) -> str:
-        if len(full_context) < max_chars: return full_context
-        query_words = [w.lower() for w in query.split() if len(w) > 3]
-        if not query_words: return full_context[:max_chars]
+    def stream_response(self, user_message: str, pdf_context: List[Dict], web_context: Union[str, PassageBuffer] = "",
+                        conversation_history: list = None, smart_context_injection: str = None,
+                        analysis: Optional[QueryAnalysis] = None, corpus_version: str = "",
+                        deadline: Optional[Deadline] = None) -> Iterator[str]:
+        """Variante de generate_response que entrega la respuesta por fragmentos a medida que el modelo los genera.
+        
+        Un modelo que falla antes de su primer fragmento se reemplaza por el siguiente de la cadena;
+        si falla a mitad de camino la respuesta queda cortada (lo ya enviado no se puede retirar).
+        Solo se cachea la respuesta completa y útil. Una pregunta idéntica que llega mientras
+        otra se genera recibe los mismos fragmentos en vivo en lugar de llamar al modelo.
+        Con el plazo (deadline) casi agotado no se lanza otro modelo; lo ya iniciado no se corta.
+        """
+        analysis = analysis or analyze_query(user_message)
+        deadline = deadline or Deadline()
         
-        chunks = full_context.split('\n\n')
-        scored_chunks = []
-        for chunk in chunks:
-            if len(chunk) < 50: continue
-            score = sum(chunk.lower().count(w) for w in query_words)
-            scored_chunks.append((score, chunk))
-        scored_chunks.sort(key=lambda x: x[0], reverse=True)
+        cached = self._get_cached_response(user_message, analysis.cache_key, analysis.canonical, corpus_version)
+        if cached:
+            yield cached
+            return
+
+        key = self._flight_key(analysis, corpus_version, conversation_history)
+        flight, leader = self.in_flight.join(key) if key is not None else (None, True)
+        if not leader:
+            print(f"[AIManager] 🔗 Stream compartido con una generación en vuelo: '{analysis.cache_key[:30]}...'")
+            produced = False
+            try:
+                for chunk in self.in_flight.follow(flight, timeout=deadline.timeout()):
+                    produced = True
+                    yield chunk
+            except TimeoutError:
+                # Sin fragmentos, quien consume el stream emite la respuesta degradada
+                print(f"[AIManager] ⏱️ Plazo agotado siguiendo una generación compartida "
+                      f"({'respuesta parcial' if produced else 'sin respuesta'})")
+                return
+            if produced:
+                return
+            # El líder no obtuvo respuesta: se intenta por cuenta propia (sin coalescer)
+            flight = None
+
+        query_type = analysis.query_class
+        sources = self._prepare_context(user_message, pdf_context, web_context, smart_context_injection, analysis)
         
-        selected = []
-        cur = 0
-        for sc, ch in scored_chunks:
-            if cur + len(ch) > max_chars: break
-            selected.append(ch)
-            cur += len(ch)
-        return "\n\n...\n\n".join(selected)
-
-    def _run_model_chain(self, provider, user, pdf, web, hist, qtype):
+        parts: List[str] = []
+        complete = False
+        try:
+            for provider in ("gemini", "openrouter"):
+                for chunk, done in self._stream_model_chain(provider, user_message, sources, conversation_history,
+                                                             query_type, deadline):
+                    if chunk:
+                        parts.append(chunk)
+                        if flight is not None: self.in_flight.publish(flight, chunk)
+                        yield chunk
+                    complete = done
+                if parts:
+                    break
+
+            final_response = "".join(parts)
+            if complete and final_response and self._is_useful_response(final_response, query_type):
+                self._save_to_cache(user_message, final_response, analysis.cache_key, analysis.canonical,
+                                    corpus_version)
+        finally:
+            # También si el cliente del líder se desconecta: las seguidoras no quedan esperando
+            if flight is not None:
+                self.in_flight.land(key, flight, "".join(parts) if complete else None)
+
+    def _prepare_context(self, user_message: str, pdf_context: List[Dict], web_context: Union[str, PassageBuffer],
+                         smart_context_injection: Optional[str], analysis: QueryAnalysis) -> PromptSources:
+        """Material del prompt (datos verificados, contexto cruzado, pasajes); el recorte por modelo es de build_prompt."""
+        query_type = analysis.query_class
+        
+        # 1. Preparar Contexto Base (pasajes ya rankeados por BM25, enteros)
+        if isinstance(pdf_context, str):
+            passages = self._relevant_passages(user_message, pdf_context, max_chars=AI_MAX_PDF_CONTEXT,
+                                               query_words=analysis.lower_words)
+        else:
+            passages = passage_blocks(pdf_context or [], max_chars=AI_MAX_PDF_CONTEXT)
+        
+        # 2. INYECCIÓN CRUZADA (Prioridad Máxima): ¿SmartResponse nos dio algo?
+        if smart_context_injection:
+            print(f"[AIManager] 🔗 Contexto Cruzado Recibido (Capa 1/2): {len(smart_context_injection)} chars")
+
+        # 3. INYECCIÓN VERIFICADA (Datos Duros V5): va primero en el prompt y es lo último que se recorta
+        verified_data = self._inject_verified_context(query_type, user_message, analysis.lower, analysis.pack)
+            
+        web_passages = self._relevant_passages(user_message, web_context, max_chars=AI_MAX_WEB_CONTEXT,
+                                               query_words=analysis.lower_words)
+        return PromptSources(verified_data.strip(), smart_context_injection or "", passages, web_passages)
+
+    def _relevant_passages(self, query: str, full_context: Union[str, PassageBuffer], max_chars: int = 40000,
+                           query_words: Optional[List[str]] = None) -> List[str]:
+        """Pasajes enteros por relevancia hasta max_chars (sin palabras clave: en orden del texto)."""
+        buffer = as_passage_buffer(full_context)
+        if buffer is None: return []
+        query_words = [w for w in (query_words if query_words is not None else query.lower().split()) if len(w) > 3]
+        # Texto corto: entran todos los pasajes; si no, se descartan los muy cortos como antes
+        min_chars = 1 if len(buffer.text) < max_chars else 50
+        # Ranking por offsets sobre el buffer: solo se copian los pasajes elegidos
+        return buffer.ranked(query_words, max_chars, min_chars=min_chars)
+
+    def _order_models(self, models, prompts: Dict[str, BuiltPrompt], deadline: Deadline) -> List[str]:
+        """
+        Solo modelos con cuota disponible (o que la recuperan dentro de la espera admitida).
+        Primero por margen de cuota diaria (los de cupo chico o casi agotado al final) y,
+        dentro de cada nivel, del más sano y rápido al más lento.
+        """
+        ready = self.scheduler.order(models, {m: p.tokens for m, p in prompts.items()},
+                                     deadline.timeout(AI_QUEUE_MAX_WAIT))
+        return self.health.order(ready, self.scheduler.budget_tiers(ready))
+
+    def _run_model_chain(self, provider, user, sources: PromptSources, hist, qtype, deadline: Deadline):
+        if not deadline.allows(AI_MIN_MODEL_TIME):
+            print(f"[AIManager] ⏱️ Sin tiempo para la cadena {provider} ({deadline.remaining():.1f}s restantes)")
+            return None
+        models = self.openrouter_models if provider == "openrouter" else self.gemini_models
+        prompts = self._build_prompts(provider, models, user, sources, hist)
+        raw_call = self._call_openrouter if provider == "openrouter" else self._call_gemini
+        models = self._order_models(models, prompts, deadline)
+
+        def call(m):
+            """Respuesta útil del modelo o None; registra latencia y resultado para su puntaje."""
+            if not deadline.allows(AI_MIN_MODEL_TIME) or not self.health.allow(m): return None
+            if not self.scheduler.acquire(m, prompts[m].tokens, deadline.timeout(AI_QUEUE_MAX_WAIT)):
+                self.health.release(m)
+                return None
+            start = time.monotonic()
+            resp = raw_call(m, prompts[m].text, deadline.timeout())
+            useful = bool(resp) and self._is_useful_response(resp, qtype)
+            self.health.record(m, time.monotonic() - start, USEFUL if useful else USELESS if resp else ERROR)
+            return resp if useful else None
+
+        if self.hedge_max_concurrency <= 1:
+            for m in models:
+                if not deadline.allows(AI_MIN_MODEL_TIME): break
+                resp = call(m)
+                if resp: return resp
+            return None
+        return self._race_models(provider, call, models, deadline)
+
+    def _race_models(self, provider, call, models, deadline: Deadline):
+        """
+        Ejecución cubierta: arranca el modelo preferido y suma el siguiente candidato cada vez
+        que pasan hedge_delay segundos sin respuesta útil (o apenas uno falla), con a lo sumo
+        hedge_max_concurrency llamadas en vuelo. `call` devuelve solo respuestas útiles (o None).
+        Gana la primera; las demás se cancelan si aún no empezaron o se ignoran (su latencia
+        igual queda registrada). Al agotarse el plazo se deja de esperar.
+
+        Con el pool ocupado por otros requests una llamada puede quedar en cola: no cuenta como
+        en vuelo ni corre su hedge_delay hasta que un hilo la toma, y mientras tanto no se
+        encolan más candidatos detrás de ella.
+        """
+        queue = list(models)
+        in_flight = {}  # future -> (modelo, [instante en que un hilo la tomó])
+        launch_next = False
+
+        def timed_call(m, started):
+            started.append(time.monotonic())
+            return call(m)
+
+        try:
+            while queue or in_flight:
+                # Sin tiempo para otra llamada completa: solo se espera a las que ya están en vuelo
+                if queue and not deadline.allows(AI_MIN_MODEL_TIME):
+                    queue.clear()
+                    if not in_flight: break
+                starts = [started[0] for _, started in in_flight.values() if started]
+                queued = len(in_flight) - len(starts)
+                can_hedge = bool(queue) and not queued and len(starts) < self.hedge_max_concurrency
+                hedge_in = self.hedge_delay - (time.monotonic() - max(starts)) if starts else 0.0
+                if queue and (not in_flight or (can_hedge and (launch_next or hedge_in <= 0))):
+                    m = queue.pop(0)
+                    started = []
+                    in_flight[self._model_pool.submit(timed_call, m, started)] = (m, started)
+                    launch_next = False
+                    continue
+                # Esperar la próxima respuesta; sin respuesta en hedge_delay se lanza otro candidato.
+                # Si alguna sigue en la cola del pool se vuelve a mirar en breve si ya arrancó.
+                if queued:
+                    wait_for = POOL_QUEUE_POLL
+                else:
+                    wait_for = hedge_in if can_hedge else None
+                done, _ = wait(in_flight, timeout=deadline.timeout(wait_for), return_when=FIRST_COMPLETED)
+                if not done and deadline.expired():
+                    print(f"[AIManager] ⏱️ Plazo agotado esperando a {provider} ({len(in_flight)} en vuelo)")
+                    return None
+                for fut in done:
+                    m, _ = in_flight.pop(fut)
+                    resp = fut.result()
+                    if resp:
+                        if in_flight:
+                            print(f"[AIManager] 🏁 {provider}/{m} ganó la carrera ({len(in_flight)} descartadas)")
+                        return resp
+                    launch_next = True  # Respuesta descartada: el siguiente sale sin esperar hedge_delay
+            return None
+        finally:
+            for fut in in_flight:
+                fut.cancel()
+
+    def _stream_model_chain(self, provider, user, sources: PromptSources, hist, qtype,
+                            deadline: Deadline) -> Iterator[Tuple[str, bool]]:
+        """(fragmento, terminó) del primer modelo de la cadena que logra empezar a responder."""
+        if not deadline.allows(AI_MIN_MODEL_TIME):
+            print(f"[AIManager] ⏱️ Sin tiempo para la cadena {provider} ({deadline.remaining():.1f}s restantes)")
+            return
         models = self.openrouter_models if provider == "openrouter" else self.gemini_models
+        prompts = self._build_prompts(provider, models, user, sources, hist)
+        for m in self._order_models(models, prompts, deadline):
+            if not deadline.allows(AI_MIN_MODEL_TIME): return
+            if not self.health.allow(m): continue
+            if not self.scheduler.acquire(m, prompts[m].tokens, deadline.timeout(AI_QUEUE_MAX_WAIT)):
+                self.health.release(m)
+                continue
+            # El timeout acota la espera del primer fragmento y entre fragmentos, no el stream completo
+            prompt, timeout = prompts[m].text, deadline.timeout()
+            stream = (self._stream_openrouter(m, prompt, timeout) if provider == "openrouter"
+                      else self._stream_gemini(m, prompt, timeout))
+            parts: List[str] = []
+            start = time.monotonic()
+            outcome = None  # Queda en None si el cliente abandona el stream a mitad
+            try:
+                for chunk in stream:
+                    if chunk:
+                        parts.append(chunk)
+                        yield chunk, False
+                if not parts:
+                    outcome = ERROR
+                else:
+                    outcome = USEFUL if self._is_useful_response("".join(parts), qtype) else USELESS
+            except Exception as e:
+                print(f"[AIManager] Stream {provider}/{m} interrumpido: {e}")
+                outcome = ERROR
+            finally:
+                stream.close()
+                if outcome is None:
+                    self.health.release(m)
+                else:
+                    self.health.record(m, time.monotonic() - start, outcome)
+            if parts:
+                # Si falló a mitad, lo enviado no se puede retirar: la respuesta queda cortada
+                if outcome != ERROR:
+                    yield "", True
+                return
+
+    def _prompt_budget(self, model: str) -> int:
+        """Tokens de prompt para `model`: su presupuesto configurado, sin pasar su TPM."""
+        budget = MODEL_PROMPT_TOKENS.get(model, AI_PROMPT_TOKEN_BUDGET)
+        tpm = MODEL_QUOTAS.get(model, {}).get('tpm')
+        return min(budget, tpm) if tpm else budget
+
+    def _build_prompts(self, provider, models, user, sources: PromptSources, hist) -> Dict[str, BuiltPrompt]:
+        """Prompt de cada modelo de la cadena; se arma una vez por presupuesto distinto, no por modelo."""
+        by_budget: Dict[int, BuiltPrompt] = {}
+        prompts = {}
         for m in models:
-            resp = None
-            if provider == "openrouter": resp = self._call_openrouter(m, user, pdf, web, hist)
-            else: 
-                if time.time() < self.gemini_cooldowns.get(m, 0): continue
-                resp = self._call_gemini(m, user, pdf, web, hist)
-            
-            if resp and self._is_useful_response(resp, qtype): return resp
-        return None
+            budget = self._prompt_budget(m)
+            built = by_budget.get(budget)
+            if built is None:
+                built = by_budget[budget] = build_prompt(user, sources, hist, budget, web_share=AI_PROMPT_WEB_SHARE,
+                                                         max_history=AI_PROMPT_HISTORY_MESSAGES)
+                print(f"[AIManager] 🧩 Prompt {provider} ({budget} tokens): {built.summary()}")
+            prompts[m] = built
+        return prompts
 
-    def _build_prompt(self, user, pdf, web, hist):
-        return f"""
-=== ERES ===
-Asistente Virtual IESTP Juan Velasco Alvarado.
-=== FUENTES ===
-{pdf[:25000]}
-=== WEB ===
-{web[:8000]}
-=== HISTORIAL ===
-{hist[-2:] if hist else ""}
-=== PREGUNTA ===
-{user}
-=== INSTRUCCIÓN ===
-Responde de forma ÚTIL, CLARA y AMABLE.
-Si hay "CONTEXTO DE BÚSQUEDA PREVIO", úsalo para explicar el tema.
-Si piden pasos, usa lista numerada.
-NO devuelvas texto crudo del manual ("Página 7..."). REDACTA la respuesta.
-"""
+    def _report_gemini_error(self, model_name, error):
+        if is_rate_limit_error(error):
+            self.scheduler.report_rate_limited(model_name, retry_after_from_error(error))
+        else:
+            self.scheduler.report_error(model_name)
+
+    def _report_openrouter_status(self, model, resp):
+        if resp.status_code == 200:
+            self.scheduler.report_success(model)
+        elif resp.status_code == 429:
+            self.scheduler.report_rate_limited(model, retry_after_from_headers(resp.headers))
+        else:
+            self.scheduler.report_error(model)
 
-    def _call_gemini(self, model_name, user, pdf, web, hist):
+    def _call_gemini(self, model_name, prompt, timeout=None):
         try:
-            model = genai.GenerativeModel(model_name)
-            prompt = self._build_prompt(user, pdf, web, hist)
-            resp = model.generate_content(prompt, generation_config=genai.types.GenerationConfig(temperature=0.4))
-            return resp.text
+            text = self.gemini_client.generate(model_name, prompt, timeout=timeout).text
         except Exception as e:
-            self.gemini_cooldowns[model_name] = time.time() + 20
+            self._report_gemini_error(model_name, e)
             return None
+        self.scheduler.report_success(model_name)
+        return text
+
+    def _stream_gemini(self, model_name, prompt, timeout=None) -> Iterator[str]:
+        try:
+            for chunk in self.gemini_client.generate(model_name, prompt, stream=True, timeout=timeout):
+                yield chunk.text
+        except Exception as e:
+            self._report_gemini_error(model_name, e)
+            raise
+        self.scheduler.report_success(model_name)
+
+    def _stream_openrouter(self, model, prompt, timeout=None) -> Iterator[str]:
+        """Deltas de texto del stream SSE de OpenRouter (formato chat/completions de OpenAI)."""
+        try:
+            resp = self.openrouter_client.chat(model, prompt, stream=True, timeout=timeout)
+        except requests.RequestException:
+            self.scheduler.report_error(model)
+            raise
+        with resp:
+            self._report_openrouter_status(model, resp)
+            if resp.status_code != 200:
+                raise RuntimeError(f"HTTP {resp.status_code}")
+            for line in resp.iter_lines():
+                # Las líneas ": ..." son comentarios keep-alive
+                if not line.startswith(b"data:"): continue
+                payload = line[5:].strip()
+                if payload == b"[DONE]": return
+                choices = json.loads(payload).get('choices') or [{}]
+                text = (choices[0].get('delta') or {}).get('content')
+                if text: yield text
 
-    def _call_openrouter(self, model, user, pdf, web, hist):
+    def _call_openrouter(self, model, prompt, timeout=None):
         try:
-             headers = {"Authorization": f"Bearer {self.openrouter_key}", "Content-Type": "application/json"}
-             data = {"model": model, "messages": [{"role":"user", "content": self._build_prompt(user, pdf, web, hist)}]}
-             resp = requests.post(self.OPENROUTER_URL, headers=headers, json=data, timeout=30)
+             resp = self.openrouter_client.chat(model, prompt, timeout=timeout)
+             self._report_openrouter_status(model, resp)
              if resp.status_code==200: return resp.json()['choices'][0]['message']['content']
-        except: pass
+        except requests.RequestException:
+             self.scheduler.report_error(model)
+        except Exception: pass
         return None
 
 _ai_manager = None
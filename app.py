@@ -10,7 +10,7 @@ import uuid
 import datetime
 import traceback
 import json
-from flask import Flask, request, jsonify, send_from_directory, session
+from flask import Flask, Response, request, jsonify, send_from_directory, session
 from flask_cors import CORS
 from dotenv import load_dotenv
 
@@ -20,13 +20,16 @@ from google.auth.transport import requests as google_requests
 
 # Módulos Internos
 from config import (
-    GOOGLE_CLIENT_ID, ALLOWED_ORIGINS, IS_VERCEL, DEBUG_MODE
+    GOOGLE_CLIENT_ID, ALLOWED_ORIGINS, IS_VERCEL, DEBUG_MODE, AI_REQUEST_DEADLINE
 )
 from storage_manager import HybridStorageManager
 from google_drive import GoogleDriveManager
-from ai_manager import AIManager
+from ai_manager import get_ai_manager as get_shared_ai_manager
 from web_scraper import WebScraper
-from smart_response import get_smart_response
+from smart_response import get_smart_response, stream_smart_response, LazyContext
+from query_analysis import analyze_query
+from knowledge_pack import get_knowledge_pack
+from deadline import Deadline
 
 # Cargar variables de entorno
 load_dotenv()
@@ -67,11 +70,22 @@ def get_drive_manager():
     return get_manager('drive', lambda: GoogleDriveManager())
 
 def get_ai_manager():
-    return get_manager('ai', lambda: AIManager())
+    # La misma instancia que usa smart_response: un solo cache y un solo registro de cuotas por proceso
+    return get_manager('ai', get_shared_ai_manager)
 
 def get_web_scraper():
     return get_manager('scraper', lambda: WebScraper())
 
+def get_corpus_version(drive_manager, web_scraper, pack=None) -> str:
+    """Versión del contenido con el que responde la IA (PDFs + web + conocimiento).
+    Las respuestas cacheadas solo se reusan mientras esta versión no cambie."""
+    pack = pack or get_knowledge_pack()
+    return ":".join((
+        drive_manager.get_corpus_version() if drive_manager else "-",
+        web_scraper.get_content_signature() if web_scraper else "-",
+        f"{pack.revision}.{pack.source_sha[:8]}",
+    ))
+
 # ==============================================================================
 # MIDDLEWARE & HELPERS
 # ==============================================================================
@@ -106,6 +120,22 @@ def get_config():
     """Devuelve configuración pública para el frontend."""
     return jsonify({"google_client_id": GOOGLE_CLIENT_ID})
 
+@app.route('/api/status', methods=['GET'])
+def get_status():
+    """Estado de los corpus (Drive: fresh/stale-serving/refreshing/failed), del paquete de conocimiento, del cache IA, de las cuotas y de la salud (latencia, circuito) por modelo."""
+    drive_manager = get_drive_manager()
+    web_scraper = get_web_scraper()
+    ai_manager = get_ai_manager()
+    return jsonify({
+        "drive": drive_manager.get_refresh_status() if drive_manager else None,
+        "web": web_scraper.get_assembly_stats() if web_scraper else None,
+        "knowledge": get_knowledge_pack().describe(),
+        "ai_cache": ai_manager.get_cache_stats() if ai_manager else None,
+        "models": ai_manager.scheduler.stats() if ai_manager else None,
+        "model_health": ai_manager.health.stats() if ai_manager else None,
+        "llm_clients": ai_manager.get_client_stats() if ai_manager else None
+    })
+
 # ==============================================================================
 # RUTAS DE AUTENTICACIÓN
 # ==============================================================================
@@ -200,20 +230,8 @@ def manage_conversation(cid):
 # RUTAS CORE DEL CHAT
 # ==============================================================================
 
-@app.route('/api/chat', methods=['POST'])
-@safe_execution
-def chat():
-    """Endpoint principal de Chat. Maneja consultas, contexto y registro híbrido."""
-    data = request.json
-    user_message = data.get('message', '').strip()
-    conversation_id = data.get('conversation_id')
-    user_email = data.get('user_email')
-    
-    if not user_message:
-        return jsonify({"success": False, "error": "Mensaje vacío"}), 400
-
-    sheets_manager = get_sheets_manager()
-    
+def open_conversation(sheets_manager, user_message, conversation_id, user_email):
+    """Crea la conversación si hace falta y guarda el mensaje del usuario. Devuelve el conversation_id (o None)."""
     # 1. Gestión de Conversación
     if user_email and not conversation_id:
         # Nueva conversación
@@ -231,24 +249,65 @@ def chat():
                 conversation_id = sheets_manager.create_conversation(user_email, (user_message[:30] + "...") if len(user_message) > 30 else user_message)
                 sheets_manager.add_message(conversation_id, "user", user_message)
             else: conversation_id = None # Anonimo sin conv valida
+    return conversation_id
+
+def record_answer(sheets_manager, conversation_id, user_message, response, query_type):
+    """Guarda la respuesta del bot y la registra. Devuelve (message_id, log_id)."""
+    # 4. Guardar mensaje Bot
+    bot_msg_id = None
+    if conversation_id:
+        bot_msg_id = sheets_manager.add_message(conversation_id, "assistant", response)
+
+    # 5. Registro Híbrido (Supabase 'consultas' + Google Sheets 'últimos 50')
+    #    [CLAVE] Pasamos 'message_id' para vincular log y chat history
+    log_id = sheets_manager.log_consultation(
+        user_query=user_message,
+        bot_response=response,
+        query_type=query_type,
+        status="completado",
+        message_id=bot_msg_id
+    )
+    return bot_msg_id, log_id
+
+@app.route('/api/chat', methods=['POST'])
+@safe_execution
+def chat():
+    """Endpoint principal de Chat. Maneja consultas, contexto y registro híbrido."""
+    # Plazo total de la consulta: al agotarse se responde con la evidencia FAQ/búsqueda (degradada)
+    deadline = Deadline(AI_REQUEST_DEADLINE)
+    data = request.json
+    user_message = data.get('message', '').strip()
+    conversation_id = data.get('conversation_id')
+    user_email = data.get('user_email')
+    
+    if not user_message:
+        return jsonify({"success": False, "error": "Mensaje vacío"}), 400
+
+    sheets_manager = get_sheets_manager()
+    conversation_id = open_conversation(sheets_manager, user_message, conversation_id, user_email)
 
     # 3. Generación de Respuesta (Lógica desacoplada en chatbot_logic.py)
     #    Obtenemos managers frescos para asegurar contexto
     drive_manager = get_drive_manager()
     web_scraper = get_web_scraper()
-    ai_manager = get_ai_manager()
     
-    pdf_context = drive_manager.search_in_documents(user_message) if drive_manager else ""
-    web_context = web_scraper.get_all_website_content() if web_scraper else ""
+    # Normalización, tokens y palabras clave del mensaje: una sola vez por request
+    analysis = analyze_query(user_message)
+    
+    # Contexto diferido: solo se arma si la respuesta no sale del FAQ
+    pdf_context = LazyContext(lambda: drive_manager.search_in_documents(user_message) if drive_manager else [])
+    web_context = LazyContext(lambda: web_scraper.get_website_buffer() if web_scraper else "")
     
-    # Función lambda para fallback de AI
-    fallback_generator = lambda: ai_manager.generate_response(user_message, pdf_context, web_context) if ai_manager else "Error AI"
+    # Versión del contenido para el cache IA: se calcula recién después de armar el contexto
+    corpus_version = LazyContext(lambda: get_corpus_version(drive_manager, web_scraper, analysis.pack))
 
     response, source = get_smart_response(
         user_message=user_message,
         pdf_context=pdf_context,
         web_context=web_context,
-        ai_fallback_func=fallback_generator
+        analysis=analysis,
+        corpus_version=corpus_version,
+        deadline=deadline
     )
 
     if not response:
@@ -256,34 +315,94 @@ def chat():
         query_type = "error"
     else:
         # Determinar tipo query simple
-        query_type = "general"
-        lower_msg = user_message.lower()
-        if "examen" in lower_msg or "admisión" in lower_msg: query_type = "admision"
-        elif "matrícula" in lower_msg or "pago" in lower_msg: query_type = "matricula"
+        query_type = analysis.log_query_type
     
-    # 4. Guardar mensaje Bot
-    bot_msg_id = None
-    if conversation_id:
-        bot_msg_id = sheets_manager.add_message(conversation_id, "assistant", response)
-
-    # 5. Registro Híbrido (Supabase 'consultas' + Google Sheets 'últimos 50')
-    #    [CLAVE] Pasamos 'message_id' para vincular log y chat history
-    log_id = sheets_manager.log_consultation(
-        user_query=user_message,
-        bot_response=response,
-        query_type=query_type,
-        status="completado",
-        message_id=bot_msg_id
-    )
+    bot_msg_id, log_id = record_answer(sheets_manager, conversation_id, user_message, response, query_type)
 
     return jsonify({
         "success": True,
         "response": response,
         "conversation_id": conversation_id,
         "message_id": bot_msg_id,
-        "log_id": log_id
+        "log_id": log_id,
+        "degraded": source == "degraded"
     })
 
+def sse_event(event: str, data: dict) -> str:
+    """Un evento Server-Sent Events con payload JSON (una sola línea)."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/chat/stream', methods=['POST'])
+@safe_execution
+def chat_stream():
+    """
+    Variante de /api/chat que responde con Server-Sent Events:
+      meta  -> {"conversation_id"} tras guardar el mensaje del usuario
+      token -> {"text"} por cada fragmento (FAQ/búsqueda: uno solo; IA: a medida que el modelo genera)
+      done  -> {"message_id", "log_id", "source", "degraded"} tras guardar la respuesta completa
+      error -> {"error"} si la generación falla
+    La respuesta se guarda (add_message + log) al cerrarse el stream, aunque el cliente se desconecte antes.
+    """
+    deadline = Deadline(AI_REQUEST_DEADLINE)
+    data = request.json
+    user_message = data.get('message', '').strip()
+    user_email = data.get('user_email')
+    
+    if not user_message:
+        return jsonify({"success": False, "error": "Mensaje vacío"}), 400
+
+    sheets_manager = get_sheets_manager()
+    drive_manager = get_drive_manager()
+    web_scraper = get_web_scraper()
+    analysis = analyze_query(user_message)
+    pdf_context = LazyContext(lambda: drive_manager.search_in_documents(user_message) if drive_manager else [])
+    web_context = LazyContext(lambda: web_scraper.get_website_buffer() if web_scraper else "")
+    corpus_version = LazyContext(lambda: get_corpus_version(drive_manager, web_scraper, analysis.pack))
+
+    def events():
+        # Primer byte inmediato: guardar el mensaje y rutear (FAQ, búsqueda en PDFs) ocurre con el stream abierto
+        yield ": ok\n\n"
+        try:
+            conversation_id = open_conversation(sheets_manager, user_message, data.get('conversation_id'), user_email)
+        except Exception as e:
+            # El 200 ya salió: se responde igual, sin historial, y el stream termina con done/error
+            print(f"[Chat Stream] Error guardando el mensaje del usuario: {e}")
+            traceback.print_exc()
+            conversation_id = None
+        yield sse_event("meta", {"conversation_id": conversation_id})
+        parts, source, error = [], "error", None
+        try:
+            answer = stream_smart_response(user_message, pdf_context, web_context, analysis=analysis,
+                                           corpus_version=corpus_version, deadline=deadline)
+            source = answer.source
+            for chunk in answer:
+                parts.append(chunk)
+                yield sse_event("token", {"text": chunk})
+            source = answer.source  # "degraded" si la IA no llegó a responder
+        except Exception as e:
+            print(f"[Chat Stream] Error generando respuesta: {e}")
+            traceback.print_exc()
+            error = str(e)
+        finally:
+            # Se ejecuta también si el cliente cerró la conexión (GeneratorExit)
+            response = "".join(parts)
+            query_type = analysis.log_query_type if response else "error"
+            try:
+                bot_msg_id, log_id = record_answer(
+                    sheets_manager, conversation_id, user_message,
+                    response or "Lo siento, no pude procesar tu solicitud en este momento.", query_type)
+            except Exception as e:
+                print(f"[Chat Stream] Error guardando respuesta: {e}")
+                bot_msg_id, log_id = None, None
+        if error and not parts:
+            yield sse_event("error", {"error": error})
+        else:
+            yield sse_event("done", {"message_id": bot_msg_id, "log_id": log_id, "source": source,
+                                     "degraded": source == "degraded"})
+
+    return Response(events(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 # ==============================================================================
 # RUTAS DE GESTIÓN Y SINCRONIZACIÓN (EDITAR, REGENERAR, FEEDBACK)
 # ==============================================================================
@@ -325,6 +444,7 @@ def update_message(message_id):
 @safe_execution
 def regenerate_response():
     """Regenera la última respuesta del bot y actualiza historial + logs."""
+    deadline = Deadline(AI_REQUEST_DEADLINE)
     data = request.json
     conversation_id = data.get('conversation_id')
     
@@ -362,16 +482,18 @@ def regenerate_response():
     # (Reutilizamos lógica de generación - idealmente en función helper pero por contexto...)
     drive_manager = get_drive_manager()
     web_scraper = get_web_scraper()
-    ai_manager = get_ai_manager()
     
-    pdf_context = drive_manager.search_in_documents(user_message) if drive_manager else ""
-    web_context = web_scraper.get_all_website_content() if web_scraper else ""
+    pdf_context = LazyContext(lambda: drive_manager.search_in_documents(user_message) if drive_manager else [])
+    web_context = LazyContext(lambda: web_scraper.get_website_buffer() if web_scraper else "")
+    analysis = analyze_query(user_message)
     
     response, _ = get_smart_response(
         user_message=user_message,
         pdf_context=pdf_context,
         web_context=web_context,
-        ai_fallback_func=lambda: ai_manager.generate_response(user_message, pdf_context, web_context)
+        analysis=analysis,
+        corpus_version=LazyContext(lambda: get_corpus_version(drive_manager, web_scraper, analysis.pack)),
+        deadline=deadline
     )
 
     if response:
@@ -11,6 +11,10 @@ load_dotenv()
 # API Key de OpenRouter
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY", "")
 
+# Endpoint de OpenRouter (chat/completions). Se puede apuntar a un servidor local
+# compatible para pruebas (p. ej. un modelo falso que emite tokens por SSE)
+OPENROUTER_URL = os.getenv("OPENROUTER_URL", "https://openrouter.ai/api/v1/chat/completions")
+
 # API Key de Google Gemini
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY", "")
 
@@ -85,14 +89,86 @@ MAX_TOKENS = 2000  # Aumentado para permitir respuestas más detalladas
 MODEL_TEMPERATURE = 0.7
 
 # Rate Limiting (Ajustado para evitar 429)
-GEMINI_MIN_INTERVAL = 10  # Segundos entre llamadas (reducido gracias a rotación)
-GEMINI_COOLDOWN = 60      # Segundos de espera tras error (reducido)
+GEMINI_MIN_INTERVAL = 10  # Segundos entre llamadas para modelos sin cuota declarada en MODEL_QUOTAS
+GEMINI_COOLDOWN = 60      # Pausa base tras un 429 sin Retry-After (se duplica si el modelo reincide)
+MODEL_ERROR_COOLDOWN = 20 # Pausa tras otros errores del modelo
+
+# Cuotas por modelo (model_scheduler.py): peticiones por minuto/día y tokens por minuto.
+# Son por proceso: con varios workers conviene dejar margen respecto del límite real.
+# 'pool' suma además la cuota compartida de MODEL_QUOTA_POOLS.
+MODEL_QUOTAS = {
+    "gemma-3-27b-it": {"rpm": 30, "rpd": 14400, "tpm": 15000},
+    "gemma-3-12b-it": {"rpm": 30, "rpd": 14400, "tpm": 15000},
+    "gemma-3-4b-it": {"rpm": 30, "rpd": 14400, "tpm": 15000},
+    "gemini-2.5-flash": {"rpm": 10, "rpd": 20, "tpm": 250000},
+    **{model: {"pool": "openrouter-free"} for model in OPENROUTER_MODELS},
+}
+MODEL_QUOTA_POOLS = {
+    "openrouter-free": {"rpm": 20, "rpd": 50},  # 50 RPD en total para la cuenta gratuita
+}
+AI_QUEUE_MAX_WAIT = 2.0  # Segundos que una llamada puede esperar en cola a que se libere cuota
 
 # Límites de Contexto (CRÍTICO PARA EVITAR 429)
 # Free Tier ~15000 tokens/min. Si enviamos 70k chars (~17k tokens), fallará siempre.
+# Estos límites acotan los pasajes candidatos; el recorte final lo hace el armado del
+# prompt (prompt_builder.py) con el presupuesto de tokens de cada modelo.
 AI_MAX_PDF_CONTEXT = 20000  # Reducido de ~40k a 20k chars
 AI_MAX_WEB_CONTEXT = 10000  # Reducido de ~30k a 10k chars
 
+# Presupuesto de tokens (estimados, ~4 chars/token) del prompt por modelo. Se llena por
+# prioridad: datos verificados, contexto cruzado, pasajes (PDF + web) e historial.
+AI_PROMPT_TOKEN_BUDGET = 8000  # Modelos sin entrada en MODEL_PROMPT_TOKENS
+MODEL_PROMPT_TOKENS = {
+    "gemini-2.5-flash": 16000,
+    **{model: 4000 for model in OPENROUTER_MODELS},  # Modelos gratuitos: prompts chicos
+}
+AI_PROMPT_WEB_SHARE = AI_MAX_WEB_CONTEXT / (AI_MAX_PDF_CONTEXT + AI_MAX_WEB_CONTEXT)  # Espacio reservado a la web
+AI_PROMPT_HISTORY_MESSAGES = 4  # Mensajes más recientes del historial que se consideran
+
+# Cache de respuestas IA: además de la clave exacta, sirve consultas casi duplicadas
+# (sin tildes/stopwords, similitud de conjuntos de tokens >= umbral). None = solo clave exacta
+AI_CACHE_NEAR_THRESHOLD = 0.85
+AI_CACHE_SQLITE = True  # Persistir en CACHE_FOLDER/ai_responses.db (WAL, una fila por respuesta) en vez del JSON
+# Retención: LRU por bytes (memoria y disco por separado) + vencimiento por entrada.
+# Las respuestas quedan ligadas a la versión del contenido (PDFs + web + conocimiento).
+AI_CACHE_MAX_BYTES = 8 * 1024 * 1024
+AI_CACHE_STORE_MAX_BYTES = 64 * 1024 * 1024
+AI_CACHE_TTL = 24 * 3600  # segundos
+
+# Clientes de proveedores (llm_clients.py): timeouts de conexión y de lectura (segundos)
+# y conexiones keep-alive que el pool de OpenRouter mantiene abiertas
+LLM_CONNECT_TIMEOUT = 5
+LLM_READ_TIMEOUT = 30
+LLM_POOL_SIZE = 8
+
+# Ejecución cubierta ("hedged") de la cadena de modelos: se lanza el modelo preferido y,
+# si no respondió en AI_HEDGE_DELAY segundos (o falló), el siguiente en paralelo; gana la
+# primera respuesta útil. AI_HEDGE_MAX_CONCURRENCY = 1 vuelve al recorrido secuencial.
+AI_HEDGE_DELAY = 4.0
+AI_HEDGE_MAX_CONCURRENCY = 2
+# Hilos compartidos para las llamadas a modelos: requests de chat simultáneos esperados por
+# el abanico de la carrera, el doble porque las perdedoras siguen ocupando su hilo hasta
+# responder o agotar LLM_READ_TIMEOUT.
+AI_CONCURRENT_REQUESTS = 8
+AI_MODEL_POOL_SIZE = 2 * AI_CONCURRENT_REQUESTS * AI_HEDGE_MAX_CONCURRENCY
+
+# Plazo por request de chat (deadline.py): al acercarse el límite no se lanzan más modelos y se
+# responde con la evidencia FAQ/búsqueda ya encontrada, marcada como degradada.
+AI_REQUEST_DEADLINE = 25.0  # Segundos totales por consulta
+AI_MIN_MODEL_TIME = 3.0     # No se lanza otra llamada a un modelo si queda menos que esto
+
+# Salud por modelo (model_health.py): la cadena se reordena por tiempo esperado hasta una
+# respuesta útil (latencia p50/p95 de las últimas AI_HEALTH_WINDOW llamadas / tasa útil) y
+# se saltan los modelos con el circuito abierto.
+AI_HEALTH_WINDOW = 50
+AI_HEALTH_DEFAULT_LATENCY = 10.0    # Segundos supuestos sin datos: un modelo medido más lento (o que falla) cede el primer lugar
+AI_BREAKER_FAILURES = 3             # Fallas seguidas (error o respuesta inútil) que abren el circuito
+AI_BREAKER_OPEN_SECONDS = 30        # Se duplica cada vez que la llamada de prueba vuelve a fallar
+AI_BREAKER_MAX_OPEN_SECONDS = 10 * 60
+
+# Recuperación de PDFs (índice BM25): pasajes devueltos por search_in_documents
+PDF_SEARCH_TOP_K = 8
+
 # =============================================================================
 # CONFIGURACIÓN DE ARCHIVOS Y CACHE (HÍBRIDO: LOCAL + VERCEL)
 # =============================================================================
@@ -123,6 +199,29 @@ STATIC_CACHE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "
 
 CACHE_REFRESH_INTERVAL = 1800
 
+# Refresco paralelo de PDFs: descargas en hilos + extracción de texto en procesos
+DRIVE_PARALLEL_REFRESH = True
+DRIVE_DOWNLOAD_WORKERS = 4     # Descargas simultáneas desde Drive
+PDF_EXTRACT_PROCESSES = 0      # 0 = usar todos los núcleos (os.cpu_count())
+
+# Stale-while-revalidate: el corpus vencido se sigue sirviendo mientras un worker lo reconstruye
+DRIVE_BACKGROUND_REFRESH = True
+DRIVE_REFRESH_RETRY_INTERVAL = 120  # Segundos antes de reintentar tras un refresco fallido
+
+# Sincronización incremental con la API de cambios de Drive (solo baja lo agregado/modificado)
+DRIVE_INCREMENTAL_SYNC = True
+
+# Cache de páginas de PDFs (SQLite): reutiliza páginas sin cambios al re-extraer
+DRIVE_PAGE_STORE = True
+DRIVE_LAZY_PAGE_TEXT = True    # No mantener el texto de los PDFs en memoria: se lee por página al buscar
+PAGE_CACHE_SIZE = 256          # Páginas leídas recientemente que se conservan en memoria (LRU)
+
+# Paquete de conocimiento (FAQ, mapa universal, contexto verificado, docentes por carrera)
+# data/knowledge.json es la fuente editable; cache/knowledge_pack.json es la versión compilada
+KNOWLEDGE_SOURCE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "knowledge.json")
+KNOWLEDGE_PACK_FILE = os.path.join(STATIC_CACHE_FOLDER, "knowledge_pack.json")
+KNOWLEDGE_RELOAD_INTERVAL = 30  # Segundos entre revisiones de cambios en disco (recarga en caliente)
+
 INSTITUTO_WEB_URL = "https://iestpjva.edu.pe"
 
 INSTITUTO_WEB_PAGES = [
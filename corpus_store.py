@@ -0,0 +1,253 @@
+"""
+Corpus Binario de PDFs - Reemplazo de pdf_cache.json
+=====================================================
+Archivo versionado con el texto de todos los PDFs en un solo blob UTF-8 y una
+tabla de offsets por documento y página.
+
+Formato (pdf_corpus.bin):
+    MAGIC (8 bytes) | versión (uint32) | largo de la tabla (uint32)
+    | tabla JSON comprimida con zlib | blob UTF-8 con los textos
+
+- El blob no se comprime para poder mapearlo en memoria (mmap): abrir el
+  archivo solo descomprime la tabla, no parsea ni duplica el texto.
+- Cada documento es el mismo texto que produce extract_pdf_text
+  ('--- Página N ---' + texto, páginas separadas por una línea en blanco).
+- Se genera en el despliegue (build_static_corpus en google_drive.py) y
+  tras cada refresco en la carpeta de cache dinámico.
+
+Los guardados en caliente escriben una generación nueva (pdf_corpus.<n>.bin)
+en lugar de reemplazar la vigente: esa puede seguir mapeada por el proceso
+(en Windows un archivo mapeado no se puede reemplazar ni borrar). Al abrir
+se usa la generación más reciente de la carpeta (incluido pdf_corpus.bin, el
+nombre fijo del corpus desplegado) y las anteriores se borran cuando ya no
+están en uso.
+"""
+
+import os
+import re
+import mmap
+import json
+import time
+import zlib
+import struct
+from typing import Dict, List, Optional, Tuple
+
+from page_store import PAGE_SEPARATOR, page_marker
+
+CORPUS_MAGIC = b"JVACORP\x00"
+CORPUS_FORMAT_VERSION = 1
+CORPUS_FILENAME = "pdf_corpus.bin"
+
+_GENERATION_RE = re.compile(r'^pdf_corpus(?:\.(\d+))?\.bin$')
+
+_HEADER = struct.Struct("<8sII")
+
+
+def write_corpus(path: str, documents: List[Dict], cached_at: float = 0, sync: Optional[Dict] = None) -> int:
+    """
+    Escribe el corpus de forma atómica (archivo temporal + os.replace).
+
+    Args:
+        documents: [{id, name, modified_time, cached_at, pages: [(número, hash, texto)]}]
+
+    Returns:
+        Tamaño del archivo en bytes
+    """
+    blob = bytearray()
+    table = []
+    separator = PAGE_SEPARATOR.encode('utf-8')
+    for doc in sorted(documents, key=lambda d: d.get('name') or d['id']):
+        doc_start = len(blob)
+        chars = 0
+        pages = []
+        for page, content_hash, text in doc['pages']:
+            if not text:
+                continue
+            if pages:
+                blob += separator
+                chars += len(PAGE_SEPARATOR)
+            marker = page_marker(page)
+            blob += marker.encode('utf-8')
+            chars += len(marker)
+            data = text.encode('utf-8')
+            # [página, inicio, fin (bytes en el blob), offset en caracteres dentro del documento, hash]
+            pages.append([page, len(blob), len(blob) + len(data), chars, content_hash])
+            blob += data
+            chars += len(text)
+        table.append({
+            'id': doc['id'],
+            'name': doc.get('name'),
+            'modified_time': doc.get('modified_time'),
+            'cached_at': doc.get('cached_at', 0),
+            'start': doc_start,
+            'end': len(blob),
+            'chars': chars,
+            'pages': pages,
+        })
+
+    compressed = zlib.compress(json.dumps({
+        'cached_at': cached_at,
+        'sync': sync or {},
+        'documents': table,
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8'))
+
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(_HEADER.pack(CORPUS_MAGIC, CORPUS_FORMAT_VERSION, len(compressed)))
+        f.write(compressed)
+        f.write(blob)
+    os.replace(tmp_path, path)
+    return _HEADER.size + len(compressed) + len(blob)
+
+
+class CorpusFile:
+    """Corpus abierto en modo solo lectura; el texto se decodifica por página o documento al pedirlo."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            magic, version, table_len = _HEADER.unpack(f.read(_HEADER.size))
+            if magic != CORPUS_MAGIC or version != CORPUS_FORMAT_VERSION:
+                raise ValueError(f"formato de corpus no soportado ({magic!r}, v{version})")
+            table = json.loads(zlib.decompress(f.read(table_len)).decode('utf-8'))
+            try:
+                self._buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except (OSError, ValueError):
+                # Archivo vacío de texto o sistema sin mmap: leer el blob una vez
+                f.seek(0)
+                self._buffer = f.read()
+        self._base = _HEADER.size + table_len
+        self.cached_at: float = table.get('cached_at', 0)
+        self.sync: Dict = table.get('sync') or {}
+        self.documents: Dict[str, Dict] = {doc['id']: doc for doc in table.get('documents', [])}
+        self._pages: Dict[str, Dict[int, list]] = {
+            fid: {p[0]: p for p in doc['pages']} for fid, doc in self.documents.items()
+        }
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def close(self):
+        """Libera el mapeo del archivo (solo cuando nadie más lee de este corpus)."""
+        if isinstance(self._buffer, mmap.mmap):
+            self._buffer.close()
+        self._buffer = b""
+
+    def _decode(self, start: int, end: int) -> str:
+        return self._buffer[self._base + start:self._base + end].decode('utf-8')
+
+    def _document(self, file_id: str, modified_time: Optional[str]) -> Optional[Dict]:
+        doc = self.documents.get(file_id)
+        if doc is None or (modified_time is not None and doc.get('modified_time') != modified_time):
+            return None
+        return doc
+
+    def entries(self) -> Dict[str, Dict]:
+        """Metadatos por documento en el formato de pdf_cache (sin texto)."""
+        return {
+            fid: {
+                'modified_time': doc.get('modified_time'),
+                'cached_at': doc.get('cached_at', 0),
+                'name': doc.get('name'),
+                'chars': doc.get('chars', 0),
+            }
+            for fid, doc in self.documents.items()
+        }
+
+    def has_document(self, file_id: str, modified_time: Optional[str] = None) -> bool:
+        return self._document(file_id, modified_time) is not None
+
+    def get_document(self, file_id: str, modified_time: Optional[str] = None) -> Optional[str]:
+        doc = self._document(file_id, modified_time)
+        if doc is None:
+            return None
+        return self._decode(doc['start'], doc['end'])
+
+    def get_page(self, file_id: str, modified_time: Optional[str], page: int) -> Optional[Tuple[int, str]]:
+        """(offset de la página dentro del documento, texto) o None si no existe."""
+        if self._document(file_id, modified_time) is None:
+            return None
+        entry = self._pages[file_id].get(page)
+        if entry is None:
+            return None
+        return entry[3], self._decode(entry[1], entry[2])
+
+    def get_pages(self, file_id: str, modified_time: Optional[str] = None) -> Optional[List[Tuple[int, Optional[str], str]]]:
+        """Páginas [(número, hash, texto)] de un documento."""
+        doc = self._document(file_id, modified_time)
+        if doc is None:
+            return None
+        return [(p[0], p[4], self._decode(p[1], p[2])) for p in doc['pages']]
+
+    def known_hashes(self, file_id: str) -> set:
+        doc = self.documents.get(file_id)
+        return {p[4] for p in doc['pages'] if p[4]} if doc else set()
+
+    def text_by_hash(self, file_id: str, hashes) -> Dict[str, str]:
+        doc = self.documents.get(file_id)
+        if doc is None:
+            return {}
+        wanted = set(hashes)
+        return {p[4]: self._decode(p[1], p[2]) for p in doc['pages'] if p[4] in wanted}
+
+
+def corpus_generations(folder: str) -> List[str]:
+    """Rutas de los corpus de la carpeta, del más viejo al más reciente (fecha de escritura)."""
+    try:
+        names = os.listdir(folder)
+    except OSError:
+        return []
+    generations = []
+    for name in names:
+        m = _GENERATION_RE.match(name)
+        if not m:
+            continue
+        path = os.path.join(folder, name)
+        try:
+            generations.append((os.path.getmtime(path), int(m.group(1) or 0), path))
+        except OSError:
+            continue  # Borrado entre medio por otro proceso
+    return [path for *_, path in sorted(generations)]
+
+
+def latest_corpus_path(folder: str) -> Optional[str]:
+    """Generación más nueva del corpus en la carpeta (None si no hay)."""
+    generations = corpus_generations(folder)
+    return generations[-1] if generations else None
+
+
+def write_corpus_generation(folder: str, documents: List[Dict], cached_at: float = 0,
+                            sync: Optional[Dict] = None) -> Tuple[str, int]:
+    """
+    Escribe el corpus como generación nueva de la carpeta sin tocar la vigente y
+    borra las anteriores; las que siguen mapeadas se borran en un guardado posterior.
+
+    Returns:
+        (ruta de la generación nueva, tamaño en bytes)
+    """
+    path = os.path.join(folder, f"pdf_corpus.{int(time.time() * 1000)}.bin")
+    size = write_corpus(path, documents, cached_at, sync)
+    prune_corpus_generations(folder, path)
+    return path, size
+
+
+def prune_corpus_generations(folder: str, keep: str):
+    """Borra los corpus de la carpeta salvo `keep`; los que siguen mapeados quedan para otra vez."""
+    for path in corpus_generations(folder):
+        if os.path.abspath(path) == os.path.abspath(keep):
+            continue
+        try:
+            os.remove(path)
+        except OSError:
+            pass  # Mapeado por este u otro proceso (Windows)
+
+
+def open_corpus(path: Optional[str]) -> Optional[CorpusFile]:
+    """Abre un corpus binario; None si no existe o no es legible."""
+    if path is None or not os.path.exists(path):
+        return None
+    try:
+        return CorpusFile(path)
+    except Exception as e:
+        print(f"[CorpusStore] Corpus no legible ({path}): {e}")
+        return None
@@ -0,0 +1,49 @@
+"""
+Plazo por Request
+=================
+Con hasta cuatro modelos Gemini y tres de OpenRouter a 30 s cada uno, una
+consulta a /api/chat no tenía un límite de tiempo útil para el usuario.
+
+Cada request crea un Deadline al entrar y lo pasa por get_smart_response y
+AIManager.generate_response: las esperas (cola de cuota, carrera de modelos,
+generaciones compartidas) y los timeouts de los clientes se acotan al tiempo
+restante, y no se lanza otro modelo si ya no alcanza el tiempo mínimo de una
+llamada. Si el plazo se agota, la respuesta sale de la evidencia FAQ/búsqueda
+que ya se tenía (respuesta degradada).
+"""
+
+import time
+from typing import Optional
+
+
+class Deadline:
+    """Tiempo total permitido para un request desde su creación (None = sin límite)."""
+
+    __slots__ = ('budget', 'started_at', 'expires_at')
+
+    def __init__(self, seconds: Optional[float] = None):
+        self.budget = seconds
+        self.started_at = time.monotonic()
+        self.expires_at = self.started_at + seconds if seconds is not None else None
+
+    def remaining(self) -> float:
+        if self.expires_at is None:
+            return float('inf')
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started_at
+
+    def expired(self) -> bool:
+        return self.remaining() <= 0
+
+    def allows(self, seconds: float) -> bool:
+        """¿Quedan al menos `seconds`? (p. ej. el tiempo mínimo de una llamada a un modelo)"""
+        return self.remaining() >= seconds
+
+    def timeout(self, cap: Optional[float] = None) -> Optional[float]:
+        """Timeout para una espera bloqueante: lo que queda, acotado por `cap`; None si no hay ninguno."""
+        remaining = self.remaining()
+        if cap is not None:
+            return min(cap, remaining)
+        return None if remaining == float('inf') else remaining
@@ -0,0 +1,315 @@
+"""
+Índice Invertido BM25 - Corpus de PDFs de Google Drive
+======================================================
+Reemplaza el escaneo completo del corpus (split + lower + count por keyword)
+por un índice invertido con puntuación BM25.
+
+- Los documentos se dividen en pasajes (por página y, si la página es larga,
+  en ventanas cortadas en saltos de línea).
+- El índice guarda solo offsets (doc_id, inicio, fin) sobre el texto de cada
+  documento, no duplica el texto.
+- Se persiste junto al corpus (pdf_index.json) y se invalida con una
+  firma del corpus (ids + modified_time).
+"""
+
+import os
+import re
+import json
+import math
+import heapq
+import hashlib
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+INDEX_FORMAT_VERSION = 2
+
+# Parámetros BM25 estándar
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Pasajes: una página, o ventanas de hasta este tamaño si la página es larga
+PASSAGE_MAX_CHARS = 1500
+
+# Lápidas (pasajes de documentos eliminados) toleradas antes de renumerar el índice,
+# como fracción de los pasajes vivos
+COMPACT_TOMBSTONE_FRACTION = 0.25
+
+PAGE_MARKER_RE = re.compile(r'--- Página (\d+) ---\n')
+TOKEN_RE = re.compile(r'\w+')
+
+STOPWORDS = {
+    "el", "la", "de", "en", "y", "que", "los", "las", "un", "una", "del", "al",
+    "por", "para", "con", "se", "su", "sus", "es", "lo", "como", "mas", "pero",
+    "sin", "sobre", "este", "esta", "estos", "estas", "son", "ser", "le", "les",
+    "quisiera", "me", "explicaras", "cual", "cuales", "hay", "tiene", "donde",
+}
+
+
+def fold_text(text: str) -> str:
+    """Minúsculas + elimina tildes (á->a, ñ->n) para comparar sin acentos."""
+    text = unicodedata.normalize('NFKD', text.lower())
+    return ''.join(c for c in text if not unicodedata.combining(c))
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokens normalizados para indexar/consultar (sin stopwords ni tokens cortos)."""
+    return [t for t in TOKEN_RE.findall(fold_text(text)) if len(t) > 2 and t not in STOPWORDS]
+
+
+def corpus_signature(pdf_cache: Dict[str, Dict]) -> str:
+    """Firma estable del corpus: cambia si se agrega, borra o modifica un PDF."""
+    h = hashlib.sha1()
+    for file_id in sorted(pdf_cache):
+        entry = pdf_cache[file_id]
+        chars = entry['chars'] if 'chars' in entry else len(entry.get('text') or '')
+        h.update(f"{file_id}|{entry.get('modified_time')}|{chars}\n".encode('utf-8'))
+    return h.hexdigest()
+
+
+def split_passages(text: str, max_chars: int = PASSAGE_MAX_CHARS) -> List[Tuple[int, int, int]]:
+    """
+    Divide el texto de un documento en pasajes.
+
+    Returns:
+        Lista de (página, inicio, fin) con offsets sobre `text`.
+    """
+    markers = list(PAGE_MARKER_RE.finditer(text))
+    if not markers:
+        bounds = [(1, 0, len(text))]
+    else:
+        bounds = []
+        for i, m in enumerate(markers):
+            end = markers[i + 1].start() if i + 1 < len(markers) else len(text)
+            bounds.append((int(m.group(1)), m.end(), end))
+
+    passages = []
+    for page, start, end in bounds:
+        while start < end:
+            cut = end
+            if end - start > max_chars:
+                # Cortar en el último salto de línea dentro de la ventana
+                nl = text.rfind('\n', start + max_chars // 2, start + max_chars)
+                cut = nl + 1 if nl != -1 else start + max_chars
+            if text[start:cut].strip():
+                passages.append((page, start, cut))
+            start = cut
+    return passages
+
+
+class BM25Index:
+    """Índice invertido BM25 sobre pasajes de documentos."""
+
+    def __init__(self):
+        self.signature: str = ""
+        # Pasaje i -> [doc_id, nombre, página, inicio, fin]; None si el documento se eliminó
+        self.passages: List[Optional[list]] = []
+        self.passage_lengths: List[int] = []
+        # término -> [[pasaje, tf], ...]
+        self.postings: Dict[str, List[List[int]]] = {}
+        self.avg_length: float = 0.0
+        self.live_passages: int = 0
+
+    def __len__(self) -> int:
+        return self.live_passages
+
+    # ------------------------------------------------------------------
+    # Construcción
+    # ------------------------------------------------------------------
+    @classmethod
+    def build(cls, pdf_cache: Dict[str, Dict]) -> 'BM25Index':
+        """Construye el índice desde el cache de PDFs ({file_id: {text, name, ...}})."""
+        index = cls()
+        index.signature = corpus_signature(pdf_cache)
+
+        # Orden por nombre, igual que la concatenación de all_documents_text
+        ordered = sorted(pdf_cache.items(), key=lambda kv: kv[1].get('name') or kv[0])
+        for file_id, entry in ordered:
+            index._add_passages(file_id, entry.get('name') or file_id, entry.get('text') or '')
+        index._update_stats()
+        return index
+
+    def _add_passages(self, file_id: str, name: str, text: str):
+        for page, start, end in split_passages(text):
+            pid = len(self.passages)
+            tokens = tokenize(text[start:end])
+            self.passages.append([file_id, name, page, start, end])
+            self.passage_lengths.append(len(tokens))
+
+            tf: Dict[str, int] = {}
+            for tok in tokens:
+                tf[tok] = tf.get(tok, 0) + 1
+            for tok, freq in tf.items():
+                self.postings.setdefault(tok, []).append([pid, freq])
+
+    def _update_stats(self):
+        live = [n for p, n in zip(self.passages, self.passage_lengths) if p is not None]
+        self.live_passages = len(live)
+        self.avg_length = (sum(live) / len(live)) if live else 0.0
+
+    # ------------------------------------------------------------------
+    # Actualización incremental (sincronización por cambios de Drive)
+    # ------------------------------------------------------------------
+    def copy(self) -> 'BM25Index':
+        """Copia para modificar sin afectar a lectores del índice vigente."""
+        clone = BM25Index()
+        clone.signature = self.signature
+        clone.passages = list(self.passages)
+        clone.passage_lengths = list(self.passage_lengths)
+        clone.postings = {term: list(plist) for term, plist in self.postings.items()}
+        clone.avg_length = self.avg_length
+        clone.live_passages = self.live_passages
+        return clone
+
+    def add_document(self, file_id: str, name: str, text: str):
+        """Indexa un documento nuevo o modificado (eliminar antes su versión anterior)."""
+        self._add_passages(file_id, name, text)
+        self._update_stats()
+
+    def remove_document(self, file_id: str):
+        """
+        Quita un documento del índice: sus ids de pasaje quedan como lápidas (None)
+        y se purgan de todas las listas de postings (sin depender de su texto).
+        """
+        removed = set()
+        for pid, passage in enumerate(self.passages):
+            if passage is not None and passage[0] == file_id:
+                removed.add(pid)
+                self.passages[pid] = None
+                self.passage_lengths[pid] = 0
+        if not removed:
+            return
+        for term in list(self.postings):
+            plist = self.postings[term]
+            if not any(p[0] in removed for p in plist):
+                continue
+            plist = [p for p in plist if p[0] not in removed]
+            if plist:
+                self.postings[term] = plist
+            else:
+                del self.postings[term]
+        self._update_stats()
+        if len(self.passages) - self.live_passages > COMPACT_TOMBSTONE_FRACTION * self.live_passages:
+            self.compact()
+
+    def compact(self):
+        """Elimina las lápidas: renumera los pasajes vivos y reescribe los postings."""
+        new_ids: Dict[int, int] = {}
+        passages: List[Optional[list]] = []
+        lengths: List[int] = []
+        for pid, passage in enumerate(self.passages):
+            if passage is not None:
+                new_ids[pid] = len(passages)
+                passages.append(passage)
+                lengths.append(self.passage_lengths[pid])
+        self.postings = {term: [[new_ids[pid], tf] for pid, tf in plist if pid in new_ids]
+                         for term, plist in self.postings.items()}
+        self.postings = {term: plist for term, plist in self.postings.items() if plist}
+        self.passages = passages
+        self.passage_lengths = lengths
+        self._update_stats()
+
+    # ------------------------------------------------------------------
+    # Consulta
+    # ------------------------------------------------------------------
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[float, int]]:
+        """
+        Devuelve los top-k pasajes para la consulta.
+
+        Returns:
+            Lista de (score, id_pasaje) ordenada de mayor a menor.
+        """
+        if not self.live_passages:
+            return []
+
+        n = self.live_passages
+        avg = self.avg_length or 1.0
+        scores: Dict[int, float] = {}
+
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            df = len(postings)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            for pid, tf in postings:
+                if self.passages[pid] is None:
+                    continue  # Lápida que quedó en un índice guardado antes de purgar por id
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.passage_lengths[pid] / avg)
+                scores[pid] = scores.get(pid, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+
+        return [(s, pid) for pid, s in heapq.nlargest(top_k, scores.items(), key=lambda x: x[1])]
+
+    def passage_info(self, pid: int) -> Dict:
+        """Metadatos de un pasaje (sin texto)."""
+        file_id, name, page, start, end = self.passages[pid]
+        return {'file_id': file_id, 'document': name, 'page': page, 'start': start, 'end': end}
+
+    # ------------------------------------------------------------------
+    # Persistencia
+    # ------------------------------------------------------------------
+    def save(self, path: str) -> bool:
+        try:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump({
+                    'version': INDEX_FORMAT_VERSION,
+                    'signature': self.signature,
+                    'passages': self.passages,
+                    'passage_lengths': self.passage_lengths,
+                    'postings': self.postings,
+                    'avg_length': self.avg_length,
+                }, f, ensure_ascii=False, separators=(',', ':'))
+            return True
+        except Exception as e:
+            print(f"[DocumentIndex] Error guardando índice: {e}")
+            return False
+
+    @classmethod
+    def load(cls, path: str, expected_signature: Optional[str] = None) -> Optional['BM25Index']:
+        """Carga un índice persistido. Devuelve None si no existe, es de otra versión o está desfasado."""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"[DocumentIndex] Índice no legible ({path}): {e}")
+            return None
+
+        if data.get('version') != INDEX_FORMAT_VERSION:
+            return None
+        if expected_signature is not None and data.get('signature') != expected_signature:
+            return None
+
+        index = cls()
+        index.signature = data.get('signature', '')
+        index.passages = data.get('passages', [])
+        index.passage_lengths = data.get('passage_lengths', [])
+        index.postings = data.get('postings', {})
+        index._update_stats()
+        return index
+
+
+def format_passage(p: Dict) -> str:
+    """Bloque de un pasaje para el prompt (documento + página + texto)."""
+    return f"=== DOCUMENTO: {p['document']} (pág. {p['page']}) ===\n{p['text']}"
+
+
+def passage_blocks(passages: List[Dict], max_chars: int) -> List[str]:
+    """
+    Bloques de los pasajes rankeados, en orden, hasta llenar max_chars.
+    Corta en límites de pasaje: nunca deja un pasaje a medias.
+    """
+    blocks = []
+    used = 0
+    for p in passages:
+        block = format_passage(p)
+        if used + len(block) > max_chars:
+            break
+        blocks.append(block)
+        used += len(block)
+    return blocks
+
+
+def format_passages(passages: List[Dict], max_chars: int) -> str:
+    """Arma el bloque de contexto para la IA a partir de pasajes rankeados (ver passage_blocks)."""
+    return "\n\n".join(passage_blocks(passages, max_chars))
@@ -0,0 +1,115 @@
+"""
+Matcher Difuso de FAQ - Índice de trigramas
+===========================================
+Reemplaza el recorrido de SequenceMatcher contra TODAS las claves del FAQ.
+
+Puntuación (idéntica a la original):
+    score = SequenceMatcher(None, consulta, clave).ratio() (+0.3 si la clave está contenida)
+    gana la primera clave (orden del FAQ) con el mayor score > umbral (0.75)
+
+Candidatos acotados:
+- Claves contenidas en la consulta: una pasada del autómata Aho-Corasick.
+- Resto: solo claves cuyo largo permite superar el umbral; si son más de
+  max_candidates, las que comparten más trigramas con la consulta.
+- Antes de ratio() se descartan candidatos con las cotas baratas de
+  SequenceMatcher (real_quick_ratio / quick_ratio).
+
+Los resultados recientes se guardan en un LRU por consulta normalizada.
+El índice (orden por largo + postings de trigramas) se puede exportar y
+reusar ya calculado (ver knowledge_pack.py).
+"""
+
+from bisect import bisect_left, bisect_right
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, Iterable, List, Optional, Set
+
+from keywords import KeywordAutomaton
+
+FAQ_MATCH_THRESHOLD = 0.75
+FAQ_SUBSTRING_BONUS = 0.3
+
+
+def _trigrams(text: str) -> Set[str]:
+    padded = f"  {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyMatcher:
+    """Índice de claves para búsqueda difusa con la puntuación de match_faq."""
+
+    def __init__(self, keys: Iterable[str], threshold: float = FAQ_MATCH_THRESHOLD,
+                 substring_bonus: float = FAQ_SUBSTRING_BONUS, max_candidates: int = 64,
+                 cache_size: int = 512, index: Optional[Dict] = None):
+        self.keys: List[str] = list(dict.fromkeys(keys))
+        self.threshold = threshold
+        self.substring_bonus = substring_bonus
+        self.max_candidates = max_candidates
+
+        self._order: Dict[str, int] = {key: i for i, key in enumerate(self.keys)}
+        self._contains = KeywordAutomaton(self.keys)
+        if index is not None and len(index.get('by_length', ())) == len(self.keys):
+            self._by_length: List[int] = list(index['by_length'])
+            self._postings: Dict[str, List[int]] = {gram: list(ids) for gram, ids in index['postings'].items()}
+        else:
+            # Claves ordenadas por largo (para filtrar por la cota de largo con bisect)
+            self._by_length = sorted(range(len(self.keys)), key=lambda i: len(self.keys[i]))
+            self._postings = {}
+            for i, key in enumerate(self.keys):
+                for gram in _trigrams(key):
+                    self._postings.setdefault(gram, []).append(i)
+        self._lengths = [len(self.keys[i]) for i in self._by_length]
+
+        self.best = lru_cache(maxsize=cache_size)(self._best)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def export_index(self) -> Dict:
+        """Índice serializable (JSON) para reconstruir el matcher sin recalcularlo."""
+        return {'by_length': list(self._by_length), 'postings': self._postings}
+
+    def _length_pool(self, query: str) -> List[int]:
+        """Claves cuyo largo permite ratio > umbral: 2*min(a, b) / (a + b) > t."""
+        n = len(query)
+        t = self.threshold
+        lo = bisect_right(self._lengths, t * n / (2 - t))
+        hi = bisect_left(self._lengths, n * (2 - t) / t) if t > 0 else len(self._lengths)
+        return self._by_length[lo:hi]
+
+    def _candidates(self, query: str, contained: Set[str]) -> Set[int]:
+        candidates = {self._order[key] for key in contained}
+        pool = self._length_pool(query)
+        if len(pool) <= self.max_candidates:
+            candidates.update(pool)
+            return candidates
+
+        allowed = set(pool)
+        overlap: Dict[int, int] = {}
+        for gram in _trigrams(query):
+            for i in self._postings.get(gram, ()):
+                if i in allowed:
+                    overlap[i] = overlap.get(i, 0) + 1
+        ranked = sorted(overlap, key=lambda i: (-overlap[i], i))
+        candidates.update(ranked[:self.max_candidates])
+        return candidates
+
+    def _best(self, query: str) -> Optional[str]:
+        """Clave con mejor score (> umbral) para la consulta ya normalizada, o None."""
+        contained = set(self._contains.find_all(query))
+        best_key = None
+        best_score = self.threshold
+        for i in sorted(self._candidates(query, contained)):
+            key = self.keys[i]
+            bonus = self.substring_bonus if key in contained else 0.0
+            matcher = SequenceMatcher(None, query, key)
+            # Cotas superiores de ratio(): si no pueden superar al mejor, no se calcula
+            if matcher.real_quick_ratio() + bonus <= best_score:
+                continue
+            if matcher.quick_ratio() + bonus <= best_score:
+                continue
+            score = matcher.ratio() + bonus
+            if score > best_score:
+                best_score = score
+                best_key = key
+        return best_key
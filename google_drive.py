@@ -9,13 +9,22 @@ import os
 import io
 import json
 import time
-from typing import Dict, List, Optional
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from typing import Callable, Dict, List, Optional, Tuple
 from google.auth.transport.requests import Request
 from google.oauth2.credentials import Credentials
 from googleapiclient.discovery import build
 from googleapiclient.http import MediaIoBaseDownload
 from PyPDF2 import PdfReader
 
+from document_index import BM25Index, corpus_signature
+from page_store import assemble_document, split_document_pages, open_page_store
+from corpus_store import (
+    CORPUS_FILENAME, latest_corpus_path, open_corpus, prune_corpus_generations, write_corpus, write_corpus_generation
+)
+
 from config import (
     GOOGLE_CLIENT_ID,
     GOOGLE_CLIENT_SECRET,
@@ -24,7 +33,17 @@ from config import (
     GOOGLE_DRIVE_FOLDER_ID,
     CACHE_FOLDER,
     STATIC_CACHE_FOLDER,
-    CACHE_REFRESH_INTERVAL
+    CACHE_REFRESH_INTERVAL,
+    PDF_SEARCH_TOP_K,
+    DRIVE_PARALLEL_REFRESH,
+    DRIVE_DOWNLOAD_WORKERS,
+    PDF_EXTRACT_PROCESSES,
+    DRIVE_BACKGROUND_REFRESH,
+    DRIVE_REFRESH_RETRY_INTERVAL,
+    DRIVE_INCREMENTAL_SYNC,
+    DRIVE_PAGE_STORE,
+    DRIVE_LAZY_PAGE_TEXT,
+    PAGE_CACHE_SIZE
 )
 
 SCOPES = [
@@ -135,84 +154,400 @@ def is_authenticated() -> bool:
     creds = get_credentials()
     return creds is not None and creds.valid
 
+def _page_content_hash(page) -> Optional[str]:
+    """Hash del stream de contenido de la página: identifica páginas sin cambios entre versiones."""
+    try:
+        contents = page.get_contents()
+        return hashlib.sha1(contents.get_data()).hexdigest() if contents is not None else None
+    except Exception:
+        return None
+
+def extract_pdf_pages(pdf_bytes: bytes, known_hashes: frozenset = frozenset()) -> List[Tuple[int, Optional[str], Optional[str]]]:
+    """
+    Extrae el texto página por página (apto para ProcessPoolExecutor).
+    
+    Args:
+        known_hashes: Hashes de páginas ya extraídas; esas páginas no se vuelven a extraer
+    
+    Returns:
+        [(número, hash, texto)]; texto es None si la página se puede reutilizar del PageStore
+    """
+    reader = PdfReader(io.BytesIO(pdf_bytes))
+    pages = []
+    for page_num, page in enumerate(reader.pages, 1):
+        content_hash = _page_content_hash(page)
+        if content_hash is not None and content_hash in known_hashes:
+            pages.append((page_num, content_hash, None))
+        else:
+            pages.append((page_num, content_hash, page.extract_text() or ''))
+    return pages
+
+def extract_pdf_text(pdf_bytes: bytes) -> str:
+    """Extrae el texto de un PDF con marcadores de página (apto para ProcessPoolExecutor)."""
+    return assemble_document((page_num, text) for page_num, _, text in extract_pdf_pages(pdf_bytes))
+
+# Estados del refresco del corpus (stale-while-revalidate)
+REFRESH_FRESH = 'fresh'                 # Corpus dentro de CACHE_REFRESH_INTERVAL
+REFRESH_STALE_SERVING = 'stale-serving' # Corpus vencido, se sigue sirviendo
+REFRESH_REFRESHING = 'refreshing'       # Worker reconstruyendo; se sirve el corpus actual
+REFRESH_FAILED = 'failed'               # Último refresco falló; se sirve el corpus anterior
+
+class CorpusSnapshot:
+    """
+    Versión inmutable del corpus: texto concatenado, textos por documento e índice.
+    Se reemplaza entera (una sola asignación) para que las búsquedas nunca mezclen
+    offsets del índice nuevo con textos viejos o viceversa.
+    
+    Con texto perezoso (DRIVE_LAZY_PAGE_TEXT) `text` es None y los valores de
+    `documents` son None: el texto se lee del PageStore según `versions`.
+    """
+    __slots__ = ('text', 'documents', 'index', 'cached_at', 'versions')
+    
+    def __init__(self, text: Optional[str] = "", documents: Optional[Dict[str, Optional[str]]] = None,
+                 index: Optional[BM25Index] = None, cached_at: float = 0,
+                 versions: Optional[Dict[str, str]] = None):
+        self.text = text
+        self.documents = documents or {}
+        self.index = index
+        self.cached_at = cached_at
+        self.versions = versions or {}  # {file_id: modified_time} de cada documento
+
 class GoogleDriveManager:
     """Clase para manejar la conexión y lectura de archivos de Google Drive."""
     
-    def __init__(self):
+    def __init__(self, service_factory: Optional[Callable] = None):
+        """
+        Args:
+            service_factory: Opcional. Crea un cliente Drive (real o falso para pruebas)
+                con la interfaz files().list(...).execute() y files().get_media(...).execute().
+                Si se omite, se usa googleapiclient con las credenciales OAuth.
+        """
         self.service = None
-        self.pdf_cache: Dict[str, Dict] = {}  # {file_id: {text, modified_time, cached_at}}
+        self._service_factory = service_factory
+        self._thread_local = threading.local()
+        self.last_refresh_stats: Dict[str, Dict] = {}
+        self.pdf_cache: Dict[str, Dict] = {}  # {file_id: {text, modified_time, cached_at, chars}}
         self.files_list_cache: List[Dict] = []
         self.files_list_cached_at: float = 0
-        self.all_documents_text: str = ""
-        self.all_documents_cached_at: float = 0
+        self._snapshot = CorpusSnapshot()
+        # Sincronización incremental: cursor de cambios + metadatos por archivo del corpus
+        self.sync_state: Dict = {'page_token': None, 'files': {}}
+        
+        # Refresco en segundo plano (un solo worker a la vez)
+        self._refresh_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._refresh_thread: Optional[threading.Thread] = None
+        self._refresh_state = REFRESH_FRESH
+        self._retry_after: float = 0
+        self.last_refresh_at: float = 0
+        self.last_refresh_duration: float = 0
+        self.last_refresh_error: Optional[str] = None
+        
         self._ensure_cache_folder()
+        # Corpus binario abierto (mmap): fuente de texto de los documentos cargados de disco
+        self.corpus_file = None
+        # Texto por página (SQLite): reutiliza páginas sin cambios y permite cargarlas bajo demanda
+        self.page_store = open_page_store(CACHE_FOLDER, PAGE_CACHE_SIZE) if DRIVE_PAGE_STORE else None
+        self.lazy_text = DRIVE_LAZY_PAGE_TEXT and self.page_store is not None
         self._load_cache_from_disk()
+        self._load_or_build_index()
+        self._settle_snapshot()
         
+        self.service = self._build_service()
+        if self.service:
+            print("[Google Drive] Conectado exitosamente")
+    
+    def _build_service(self):
+        """Crea un cliente de Drive (factory inyectada o googleapiclient)."""
+        if self._service_factory:
+            return self._service_factory()
         creds = get_credentials()
         if creds:
-            self.service = build('drive', 'v3', credentials=creds)
-            print("[Google Drive] Conectado exitosamente")
+            return build('drive', 'v3', credentials=creds)
+        return None
+    
+    def _get_thread_service(self):
+        """Cliente por hilo: googleapiclient/httplib2 no es thread-safe."""
+        service = getattr(self._thread_local, 'service', None)
+        if service is None:
+            service = self._build_service()
+            self._thread_local.service = service
+        return service
     
     def _ensure_cache_folder(self):
         """Crea la carpeta de cache si no existe."""
         if not os.path.exists(CACHE_FOLDER):
             os.makedirs(CACHE_FOLDER)
     
+    # Vista de solo lectura del snapshot vigente
+    @property
+    def all_documents_text(self) -> str:
+        return self._snapshot_text(self._snapshot)
+    
+    @property
+    def all_documents_cached_at(self) -> float:
+        return self._snapshot.cached_at
+    
+    @property
+    def index(self) -> Optional[BM25Index]:
+        return self._snapshot.index
+    
+    def get_corpus_version(self) -> str:
+        """Versión corta del corpus de PDFs vigente (cambia si se agrega, borra o modifica un PDF)."""
+        snapshot = self._snapshot
+        if snapshot.index is not None and snapshot.index.signature:
+            return snapshot.index.signature[:16]
+        h = hashlib.sha1()
+        for file_id in sorted(snapshot.versions):
+            h.update(f"{file_id}|{snapshot.versions[file_id]}\n".encode('utf-8'))
+        return h.hexdigest()[:16]
+    
     def _load_cache_from_disk(self):
-        """Carga el cache de PDFs desde disco.
+        """Carga el corpus de PDFs desde disco.
         
         Prioridad:
         1. STATIC_CACHE_FOLDER (cache desplegado con el código - Vercel)
         2. CACHE_FOLDER (cache dinámico - /tmp en Vercel o cache local)
+        
+        En cada carpeta se prefiere el corpus binario (su generación más reciente de
+        pdf_corpus*.bin: se mapea en memoria sin parsear el texto) sobre el
+        pdf_cache.json anterior.
         """
-        # Intentar primero el caché estático (desplegado con el código)
-        static_cache_file = os.path.join(STATIC_CACHE_FOLDER, "pdf_cache.json")
-        dynamic_cache_file = os.path.join(CACHE_FOLDER, "pdf_cache.json")
-        
-        cache_file = None
-        if os.path.exists(static_cache_file):
-            cache_file = static_cache_file
-            print(f"[Google Drive] Usando cache estático: {static_cache_file}")
-        elif os.path.exists(dynamic_cache_file):
-            cache_file = dynamic_cache_file
-            print(f"[Google Drive] Usando cache dinámico: {dynamic_cache_file}")
-        
-        if cache_file:
-            try:
-                with open(cache_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    self.pdf_cache = data.get('pdfs', {})
-                    self.all_documents_text = data.get('all_text', '')
-                    self.all_documents_cached_at = data.get('all_cached_at', 0)
-                print(f"[Google Drive] Cache cargado: {len(self.pdf_cache)} PDFs, texto: {len(self.all_documents_text)} chars")
-            except Exception as e:
-                print(f"[Google Drive] Error cargando cache: {e}")
+        for folder, label in ((STATIC_CACHE_FOLDER, "estático"), (CACHE_FOLDER, "dinámico")):
+            corpus_path = latest_corpus_path(folder)
+            corpus = open_corpus(corpus_path)
+            if corpus is not None:
+                print(f"[Google Drive] Usando corpus {label}: {corpus_path}")
+                self.corpus_file = corpus
+                self.pdf_cache = corpus.entries()
+                self.sync_state = corpus.sync or {'page_token': None, 'files': {}}
+                self._snapshot = CorpusSnapshot(
+                    text=None,
+                    documents={fid: None for fid in self.pdf_cache},
+                    cached_at=corpus.cached_at,
+                    versions={fid: e.get('modified_time') for fid, e in self.pdf_cache.items()}
+                )
+                print(f"[Google Drive] Corpus cargado: {len(corpus)} PDFs, {os.path.getsize(corpus_path)} bytes")
+                return
+            
+            legacy_file = os.path.join(folder, "pdf_cache.json")
+            if os.path.exists(legacy_file):
+                print(f"[Google Drive] Usando cache {label}: {legacy_file}")
+                self._load_legacy_cache(legacy_file)
+                return
+        print("[Google Drive] No se encontró archivo de cache")
+    
+    def _load_legacy_cache(self, cache_file: str):
+        """Carga un pdf_cache.json (formato anterior al corpus binario)."""
+        try:
+            with open(cache_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            self.pdf_cache = data.get('pdfs', {})
+            self.sync_state = data.get('sync') or {'page_token': None, 'files': {}}
+            self._snapshot = CorpusSnapshot(
+                text=None,
+                documents={fid: e.get('text') or '' for fid, e in self.pdf_cache.items()},
+                cached_at=data.get('all_cached_at', 0),
+                versions={fid: e.get('modified_time') for fid, e in self.pdf_cache.items()}
+            )
+            print(f"[Google Drive] Cache cargado: {len(self.pdf_cache)} PDFs")
+        except Exception as e:
+            print(f"[Google Drive] Error cargando cache: {e}")
+    
+    def _settle_snapshot(self):
+        """
+        Deja el snapshot cargado en el modo configurado: con texto perezoso los textos
+        de un pdf_cache.json pasan al PageStore; sin él se materializan en memoria.
+        """
+        snapshot = self._snapshot
+        if self.lazy_text:
+            migrated = 0
+            for file_id, entry in self.pdf_cache.items():
+                text = entry.pop('text', None)
+                if text is None:
+                    continue
+                entry['chars'] = len(text)
+                if not self.page_store.has_document(file_id, entry.get('modified_time')):
+                    self.page_store.save_document(file_id, entry.get('modified_time'), split_document_pages(text))
+                    migrated += 1
+            if migrated:
+                print(f"[Google Drive] {migrated} documentos copiados al cache de páginas")
+            documents = {fid: None for fid in snapshot.documents}
+            text = None
         else:
-            print("[Google Drive] No se encontró archivo de cache")
+            for file_id, entry in self.pdf_cache.items():
+                if entry.get('text') is None:
+                    entry['text'] = self._read_document(file_id, entry.get('modified_time')) or ''
+            documents = {fid: self.pdf_cache[fid]['text'] for fid in snapshot.documents}
+            text = self._join_documents(documents, self.pdf_cache) if documents else ""
+        self._snapshot = CorpusSnapshot(text, documents, snapshot.index, snapshot.cached_at, snapshot.versions)
+    
+    def _read_document(self, file_id: str, modified_time: Optional[str]) -> Optional[str]:
+        """Texto de una versión de un documento desde el corpus binario o el PageStore."""
+        corpus = self.corpus_file
+        if corpus is not None:
+            text = corpus.get_document(file_id, modified_time)
+            if text is not None:
+                return text
+        if self.page_store is not None:
+            return self.page_store.get_document(file_id, modified_time)
+        return None
+    
+    def _read_page(self, file_id: str, modified_time: Optional[str], page: int):
+        """(offset en el documento, texto) de una página desde el corpus binario o el PageStore."""
+        corpus = self.corpus_file
+        if corpus is not None:
+            result = corpus.get_page(file_id, modified_time, page)
+            if result is not None:
+                return result
+        if self.page_store is not None:
+            return self.page_store.get_page(file_id, modified_time, page)
+        return None
+    
+    def _read_pages(self, file_id: str, modified_time: Optional[str]):
+        """Páginas [(número, hash, texto)] de una versión de un documento, si están guardadas."""
+        corpus = self.corpus_file
+        if corpus is not None:
+            pages = corpus.get_pages(file_id, modified_time)
+            if pages is not None:
+                return pages
+        if self.page_store is not None:
+            return self.page_store.get_pages(file_id, modified_time)
+        return None
+    
+    def _cached_text(self, file_id: str) -> Optional[str]:
+        """Texto de la versión cacheada de un PDF (en memoria o desde el PageStore)."""
+        entry = self.pdf_cache.get(file_id)
+        if not entry:
+            return None
+        if entry.get('text') is not None:
+            return entry['text']
+        return self._read_document(file_id, entry.get('modified_time'))
+    
+    def _document_text(self, snapshot: CorpusSnapshot, file_id: str) -> str:
+        """Texto completo de un documento del snapshot (residente o desde el PageStore)."""
+        text = snapshot.documents.get(file_id)
+        if text is None:
+            text = self._read_document(file_id, snapshot.versions.get(file_id))
+        return text or ''
+    
+    def _snapshot_text(self, snapshot: CorpusSnapshot) -> str:
+        """Texto concatenado del corpus; con texto perezoso se arma en cada llamada."""
+        if snapshot.text is not None:
+            return snapshot.text
+        if not snapshot.documents:
+            return ""
+        return self._join_documents({fid: self._document_text(snapshot, fid) for fid in snapshot.documents},
+                                    self.pdf_cache)
     
     def _save_cache_to_disk(self):
-        """Guarda el cache de PDFs en disco."""
-        cache_file = os.path.join(CACHE_FOLDER, "pdf_cache.json")
+        """
+        Guarda el corpus de PDFs en disco como generación nueva y pasa a leer de ella.
+        El archivo anterior puede seguir mapeado (lectores en curso), por eso no se reemplaza.
+        """
         try:
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                json.dump({
-                    'pdfs': self.pdf_cache,
-                    'all_text': self.all_documents_text,
-                    'all_cached_at': self.all_documents_cached_at
-                }, f, ensure_ascii=False)
-            print("[Google Drive] Cache guardado en disco")
+            corpus_path, _ = write_corpus_generation(CACHE_FOLDER, self._corpus_documents(),
+                                                     self._snapshot.cached_at, self.sync_state)
+            self.corpus_file = open_corpus(corpus_path)
+            print(f"[Google Drive] Cache guardado en disco ({os.path.basename(corpus_path)})")
         except Exception as e:
             print(f"[Google Drive] Error guardando cache: {e}")
     
+    def _corpus_documents(self) -> List[Dict]:
+        """Documentos del snapshot vigente con sus páginas, para write_corpus (ver corpus_store.py)."""
+        snapshot = self._snapshot
+        documents = []
+        for file_id, modified_time in snapshot.versions.items():
+            entry = self.pdf_cache.get(file_id) or {}
+            pages = self._read_pages(file_id, modified_time)
+            if pages is None:
+                pages = split_document_pages(self._document_text(snapshot, file_id))
+            documents.append(dict(entry, id=file_id, modified_time=modified_time, pages=pages))
+        return documents
+    
+    def write_corpus(self, path: str) -> int:
+        """
+        Escribe el corpus vigente en formato binario en `path` (nombre fijo, p. ej. el
+        corpus desplegado). Si este manager tiene mapeado ese archivo lo libera antes
+        de reemplazarlo y lo vuelve a abrir; usar solo sin lectores concurrentes.
+        
+        Returns:
+            Tamaño del archivo en bytes
+        """
+        documents = self._corpus_documents()
+        corpus = self.corpus_file
+        if corpus is not None and os.path.abspath(corpus.path) == os.path.abspath(path):
+            self.corpus_file = None
+            corpus.close()
+        size = write_corpus(path, documents, self._snapshot.cached_at, self.sync_state)
+        if corpus is not None and self.corpus_file is None:
+            self.corpus_file = open_corpus(path)
+        return size
+    
+    def _load_or_build_index(self):
+        """Carga el índice BM25 persistido junto al cache o lo reconstruye si está desfasado."""
+        if not self.pdf_cache:
+            return
+        signature = corpus_signature(self.pdf_cache)
+        for folder in (STATIC_CACHE_FOLDER, CACHE_FOLDER):
+            index = BM25Index.load(os.path.join(folder, "pdf_index.json"), expected_signature=signature)
+            if index is not None:
+                self._snapshot.index = index  # Aún no publicado: se ejecuta en __init__
+                print(f"[Google Drive] Índice BM25 cargado: {len(index)} pasajes, {len(index.postings)} términos")
+                return
+        self._snapshot.index = self._build_index(
+            {fid: dict(e, text=self._cached_text(fid) or '') for fid, e in self.pdf_cache.items()})
+    
+    def _build_index(self, corpus: Dict[str, Dict]) -> BM25Index:
+        """Construye el índice BM25 del corpus y lo guarda en disco."""
+        start = time.time()
+        index = BM25Index.build(corpus)
+        index.save(os.path.join(CACHE_FOLDER, "pdf_index.json"))
+        print(f"[Google Drive] Índice BM25 construido: {len(index)} pasajes en {time.time() - start:.2f}s")
+        return index
+    
+    def search_passages(self, query: str, top_k: int = 5) -> List[Dict]:
+        """
+        Recupera los pasajes más relevantes usando el índice BM25.
+        
+        Returns:
+            Lista de {document, page, score, text} ordenada por relevancia
+        """
+        snapshot = self._snapshot
+        if snapshot.index is None:
+            return []
+        results = []
+        for score, pid in snapshot.index.search(query, top_k):
+            info = snapshot.index.passage_info(pid)
+            results.append({
+                'document': info['document'],
+                'page': info['page'],
+                'score': round(score, 3),
+                'text': self._passage_text(snapshot, info).strip()
+            })
+        return results
+    
+    def _passage_text(self, snapshot: CorpusSnapshot, info: Dict) -> str:
+        """Texto de un pasaje: slice del documento residente o de su página cargada bajo demanda."""
+        doc_text = snapshot.documents.get(info['file_id'])
+        if doc_text is not None:
+            return doc_text[info['start']:info['end']]
+        page = self._read_page(info['file_id'], snapshot.versions.get(info['file_id']), info['page'])
+        if page is None:
+            return ''
+        offset, page_text = page
+        return page_text[info['start'] - offset:info['end'] - offset]
+    
     def is_ready(self) -> bool:
         """Verifica si el servicio está listo para usar."""
         return self.service is not None
     
     def reconnect(self):
         """Reconecta con nuevas credenciales."""
-        creds = get_credentials()
-        if creds:
-            self.service = build('drive', 'v3', credentials=creds)
+        service = self._build_service()
+        if service:
+            self.service = service
+            self._thread_local = threading.local()
             print("[Google Drive] Reconectado exitosamente")
             return True
         return False
@@ -293,7 +628,7 @@ class GoogleDriveManager:
             # Si el archivo no ha sido modificado, usar cache
             if modified_time and cached.get('modified_time') == modified_time:
                 # print(f"[Google Drive] Cache válido para: {file_name}")
-                return cached.get('text')
+                return self._cached_text(file_id)
         
         max_retries = 3
         for attempt in range(max_retries):
@@ -306,26 +641,12 @@ class GoogleDriveManager:
                 while not done:
                     status, done = downloader.next_chunk()
                 
-                file_buffer.seek(0)
-                reader = PdfReader(file_buffer)
-                
-                text_parts = []
-                for page_num, page in enumerate(reader.pages):
-                    text = page.extract_text()
-                    if text:
-                        text_parts.append(f"--- Página {page_num + 1} ---\n{text}")
-                
-                full_text = "\n\n".join(text_parts)
+                full_text, reused = self._extract_document(file_id, modified_time, file_buffer.getvalue())
                 
                 # Guardar en cache
-                self.pdf_cache[file_id] = {
-                    'text': full_text,
-                    'modified_time': modified_time,
-                    'cached_at': time.time(),
-                    'name': file_name
-                }
+                self.pdf_cache[file_id] = self._cache_entry(file_name, modified_time, full_text)
                 
-                print(f"[Google Drive] Extraído: {file_name} ({len(full_text)} caracteres)")
+                print(f"[Google Drive] Extraído: {file_name} ({len(full_text)} caracteres, {reused} páginas reutilizadas)")
                 return full_text
                 
             except Exception as e:
@@ -338,32 +659,405 @@ class GoogleDriveManager:
         # Intentar devolver cache antiguo si existe
         if file_id in self.pdf_cache:
             print(f"[Google Drive] Usando cache antiguo para {file_name} debido a error")
-            return self.pdf_cache[file_id].get('text')
+            return self._cached_text(file_id)
         return None
     
-    def get_all_documents_text(self, force_refresh: bool = False) -> str:
+    def _fetch_pdf_bytes(self, file_id: str, file_name: str) -> Optional[bytes]:
+        """Descarga el contenido binario de un PDF (con reintentos) usando el cliente del hilo."""
+        max_retries = 3
+        for attempt in range(max_retries):
+            try:
+                service = self._get_thread_service()
+                if service is None:
+                    return None
+                return service.files().get_media(fileId=file_id).execute()
+            except Exception as e:
+                print(f"[Google Drive] Error al descargar {file_name} (intento {attempt+1}/{max_retries}): {e}")
+                if "401" in str(e) or "invalid_grant" in str(e).lower():
+                    self._thread_local.service = None
+                time.sleep(1)
+        return None
+    
+    def _known_hashes(self, file_id: str) -> frozenset:
+        """Hashes de páginas ya extraídas del archivo (PageStore y corpus binario)."""
+        known = set()
+        if self.page_store is not None:
+            known |= self.page_store.known_hashes(file_id)
+        if self.corpus_file is not None:
+            known |= self.corpus_file.known_hashes(file_id)
+        return frozenset(known)
+    
+    def _extract_document(self, file_id: str, modified_time: Optional[str], pdf_bytes: bytes,
+                          pages: Optional[List] = None) -> Tuple[str, int]:
+        """
+        Completa la extracción por página: reutiliza del PageStore las páginas cuyo
+        hash no cambió y guarda la nueva versión.
+        
+        Args:
+            pages: Resultado de extract_pdf_pages si ya se extrajo (p.ej. en un proceso)
+        
+        Returns:
+            (texto del documento, páginas reutilizadas)
+        """
+        if pages is None:
+            pages = extract_pdf_pages(pdf_bytes, self._known_hashes(file_id))
+        missing = {content_hash for _, content_hash, text in pages if text is None}
+        reused = {}
+        if missing and self.page_store is not None:
+            reused = self.page_store.text_by_hash(file_id, missing)
+        if len(reused) < len(missing) and self.corpus_file is not None:
+            reused.update(self.corpus_file.text_by_hash(file_id, missing - reused.keys()))
+        if len(reused) < len(missing):
+            # Las páginas conocidas se borraron entre medio: extraer todo
+            pages, reused = extract_pdf_pages(pdf_bytes), {}
+        pages = [(n, h, reused[h] if text is None else text) for n, h, text in pages]
+        if self.page_store is None:
+            return assemble_document((n, text) for n, _, text in pages), len(reused)
+        return self.page_store.save_document(file_id, modified_time, pages), len(reused)
+    
+    def _cache_entry(self, name: str, modified_time: Optional[str], text: str) -> Dict:
+        """Entrada de pdf_cache; con texto perezoso el texto vive solo en el PageStore."""
+        entry = {
+            'modified_time': modified_time,
+            'cached_at': time.time(),
+            'name': name,
+            'chars': len(text)
+        }
+        if not self.lazy_text:
+            entry['text'] = text
+        return entry
+    
+    def download_all_parallel(self, files: List[Dict]) -> Dict[str, str]:
+        """
+        Descarga en paralelo (hilos) y extrae texto en paralelo (procesos) los PDFs
+        que no están en cache o cuyo modifiedTime cambió.
+        
+        Deja el detalle por archivo en `self.last_refresh_stats`.
+        
+        Returns:
+            {file_id: texto} para todos los archivos con texto disponible
+        """
+        texts: Dict[str, str] = {}
+        pending = []
+        stats: Dict[str, Dict] = {}
+        for file in files:
+            cached = self.pdf_cache.get(file['id'])
+            if cached and file.get('modifiedTime') and cached.get('modified_time') == file.get('modifiedTime'):
+                texts[file['id']] = self._cached_text(file['id'])
+                stats[file['id']] = {'name': file['name'], 'cached': True}
+            else:
+                pending.append(file)
+        
+        if not pending:
+            self.last_refresh_stats = stats
+            return texts
+        
+        refresh_start = time.time()
+        workers = PDF_EXTRACT_PROCESSES or os.cpu_count() or 1
+        try:
+            process_pool = ProcessPoolExecutor(max_workers=min(workers, len(pending)))
+        except (OSError, NotImplementedError, ImportError) as e:
+            # Entornos sin multiprocessing (p.ej. sin /dev/shm): extraer en los hilos
+            print(f"[Google Drive] Pool de procesos no disponible ({e}), extracción en hilos")
+            process_pool = None
+        
+        def download(file):
+            start = time.time()
+            data = self._fetch_pdf_bytes(file['id'], file['name'])
+            return file, data, time.time() - start
+        
+        try:
+            with ThreadPoolExecutor(max_workers=DRIVE_DOWNLOAD_WORKERS) as thread_pool:
+                extractions = {}
+                for fut in as_completed([thread_pool.submit(download, f) for f in pending]):
+                    file, data, download_s = fut.result()
+                    stats[file['id']] = {'name': file['name'], 'cached': False, 'download_s': round(download_s, 3)}
+                    if data is None:
+                        continue
+                    if process_pool is not None:
+                        known = self._known_hashes(file['id'])
+                        extractions[process_pool.submit(extract_pdf_pages, data, known)] = (file, data, time.time())
+                    else:
+                        start = time.time()
+                        text, reused = self._extract_document(file['id'], file.get('modifiedTime'), data)
+                        self._store_extracted(file, text, texts, stats, time.time() - start, reused)
+                
+                for fut in as_completed(extractions):
+                    file, data, submitted_at = extractions[fut]
+                    try:
+                        pages = fut.result()
+                    except Exception as e:
+                        print(f"[Google Drive] Extracción en proceso falló para {file['name']} ({e}), reintentando en hilo")
+                        pages = None
+                    text, reused = self._extract_document(file['id'], file.get('modifiedTime'), data, pages)
+                    self._store_extracted(file, text, texts, stats, time.time() - submitted_at, reused)
+        finally:
+            if process_pool is not None:
+                process_pool.shutdown(wait=False)
+        
+        # Fallback a cache antiguo para archivos que no se pudieron descargar
+        for file in pending:
+            if file['id'] not in texts and file['id'] in self.pdf_cache:
+                print(f"[Google Drive] Usando cache antiguo para {file['name']} debido a error")
+                texts[file['id']] = self._cached_text(file['id'])
+        
+        for file in pending:
+            st = stats.get(file['id'], {})
+            print(f"[Google Drive] {file['name']}: descarga {st.get('download_s', '-')}s, "
+                  f"extracción {st.get('extract_s', '-')}s, {st.get('chars', 0)} caracteres, "
+                  f"{st.get('reused_pages', 0)} páginas reutilizadas")
+        print(f"[Google Drive] Refresco paralelo: {len(pending)} archivos en {time.time() - refresh_start:.2f}s")
+        
+        self.last_refresh_stats = stats
+        return texts
+    
+    def _store_extracted(self, file: Dict, text: str, texts: Dict[str, str], stats: Dict[str, Dict],
+                         extract_s: float, reused_pages: int = 0):
+        """Registra un PDF recién extraído en pdf_cache y en las estadísticas del refresco."""
+        self.pdf_cache[file['id']] = self._cache_entry(file['name'], file.get('modifiedTime'), text)
+        texts[file['id']] = text
+        stats[file['id']].update({'extract_s': round(extract_s, 3), 'chars': len(text),
+                                  'reused_pages': reused_pages})
+    
+    def get_all_documents_text(self, force_refresh: bool = False, parallel: Optional[bool] = None,
+                               background: Optional[bool] = None) -> str:
         """
         Obtiene el texto de TODOS los PDFs en la carpeta.
         
+        Stale-while-revalidate: si el corpus venció y ya hay uno cargado, se devuelve
+        el actual y un único worker en segundo plano lo reconstruye.
+        
         Args:
-            force_refresh: Si True, descarga todos los PDFs de nuevo
+            force_refresh: Si True, refresca de forma síncrona
+            parallel: Si True, descarga/extrae en paralelo (por defecto DRIVE_PARALLEL_REFRESH)
+            background: Si True, refresca en segundo plano (por defecto DRIVE_BACKGROUND_REFRESH)
         """
-        # Verificar si hay cache válido
-        cache_age = time.time() - self.all_documents_cached_at
-        if not force_refresh and self.all_documents_text and cache_age < CACHE_REFRESH_INTERVAL:
-            print("[Google Drive] Usando cache de todos los documentos")
-            return self.all_documents_text
+        return self._snapshot_text(self._ensure_fresh(force_refresh, parallel, background))
+    
+    def _ensure_fresh(self, force_refresh: bool = False, parallel: Optional[bool] = None,
+                      background: Optional[bool] = None) -> CorpusSnapshot:
+        """Devuelve el snapshot vigente, refrescándolo (o lanzando el worker) si venció."""
+        snapshot = self._snapshot
+        cache_age = time.time() - snapshot.cached_at
+        if not force_refresh and snapshot.documents and cache_age < CACHE_REFRESH_INTERVAL:
+            return snapshot
         
-        files = self.list_pdf_files(force_refresh)
+        if background is None:
+            background = DRIVE_BACKGROUND_REFRESH
+        if not force_refresh and snapshot.documents and background:
+            self._start_background_refresh(parallel)
+            return snapshot
+        
+        # Arranque en frío (sin corpus) o refresco forzado: síncrono
+        try:
+            return self._refresh_corpus(force_refresh, parallel)
+        except Exception as e:
+            print(f"[Google Drive] Error refrescando corpus: {e}")
+            return self._snapshot
+    
+    def _refresh_corpus(self, force_refresh: bool = False, parallel: Optional[bool] = None) -> CorpusSnapshot:
+        """
+        Reconstruye el corpus completo y lo publica de forma atómica.
+        Lanza excepción si Drive no está disponible (el corpus anterior se conserva).
+        """
+        with self._refresh_lock:
+            start = time.time()
+            try:
+                snapshot = self._build_snapshot(force_refresh, parallel)
+            except Exception as e:
+                with self._state_lock:
+                    self._refresh_state = REFRESH_FAILED
+                    self.last_refresh_error = str(e)
+                    self._retry_after = time.time() + DRIVE_REFRESH_RETRY_INTERVAL
+                raise
+            
+            self._snapshot = snapshot  # Swap atómico
+            self._save_cache_to_disk()
+            if self.page_store is not None:
+                # Versiones viejas y archivos eliminados ya no los referencia ningún snapshot nuevo
+                self.page_store.retain(snapshot.versions)
+            with self._state_lock:
+                self._refresh_state = REFRESH_FRESH
+                self.last_refresh_error = None
+                self.last_refresh_at = time.time()
+                self.last_refresh_duration = time.time() - start
+            return snapshot
+    
+    def _build_snapshot(self, force_refresh: bool, parallel: Optional[bool]) -> CorpusSnapshot:
+        """Arma un snapshot nuevo: incremental si hay cursor de cambios, completo si no."""
+        if (DRIVE_INCREMENTAL_SYNC and not force_refresh and self.sync_state.get('page_token')
+                and self._snapshot.index is not None):
+            try:
+                return self._build_incremental_snapshot(parallel)
+            except Exception as e:
+                print(f"[Google Drive] Sincronización incremental falló ({e}), se hace refresco completo")
+        return self._build_full_snapshot(force_refresh, parallel)
+    
+    def _get_start_page_token(self) -> Optional[str]:
+        """Cursor de la API de cambios de Drive (se pide ANTES de listar para no perder cambios)."""
+        if not DRIVE_INCREMENTAL_SYNC or not self.is_ready():
+            return None
+        try:
+            return self.service.changes().getStartPageToken().execute().get('startPageToken')
+        except Exception as e:
+            print(f"[Google Drive] No se pudo obtener cursor de cambios: {e}")
+            return None
+    
+    def _list_changes(self, page_token: str):
+        """
+        Recorre la API de cambios desde el cursor.
+        
+        Returns:
+            (cambios, nuevo_cursor)
+        """
+        if not self.is_ready() and not self.reconnect():
+            raise RuntimeError("Servicio de Drive no disponible")
+        changes = []
+        while True:
+            result = self.service.changes().list(
+                pageToken=page_token,
+                spaces='drive',
+                pageSize=100,
+                fields="nextPageToken, newStartPageToken, "
+                       "changes(fileId, removed, file(id, name, mimeType, modifiedTime, size, parents, trashed))"
+            ).execute()
+            changes.extend(result.get('changes', []))
+            if result.get('nextPageToken'):
+                page_token = result['nextPageToken']
+                continue
+            return changes, result.get('newStartPageToken', page_token)
+    
+    def _is_current(self, file: Dict) -> bool:
+        """¿pdf_cache tiene el texto de la versión listada en Drive? (no, si se usó el cache antiguo)"""
+        entry = self.pdf_cache.get(file['id'])
+        return entry is not None and entry.get('modified_time') == file.get('modifiedTime')
+    
+    def _sync_entry(self, file: Dict) -> Dict:
+        """
+        Metadatos que recuerda el cursor de cambios para un archivo. Si su descarga falló
+        y quedó el cache antiguo, se recuerda la versión cacheada: el próximo cambio del
+        archivo no se confunde con uno ya procesado.
+        """
+        if self._is_current(file) or file['id'] not in self.pdf_cache:
+            return {k: file.get(k) for k in ('name', 'modifiedTime', 'size')}
+        return {'name': file.get('name'), 'modifiedTime': self.pdf_cache[file['id']].get('modified_time'), 'size': None}
+    
+    def _build_incremental_snapshot(self, parallel: Optional[bool]) -> CorpusSnapshot:
+        """
+        Aplica solo los cambios desde el último cursor: descarga archivos agregados o
+        modificados (por modifiedTime/size), quita los eliminados y parchea una copia
+        del índice. Una carpeta sin cambios cuesta una sola llamada de metadatos.
+        """
+        current = self._snapshot
+        changes, new_token = self._list_changes(self.sync_state['page_token'])
+        
+        tracked = dict(self.sync_state.get('files', {}))
+        # Archivos cuya descarga falló en un sync anterior: se reintentan aunque no haya cambios nuevos
+        changed: Dict[str, Dict] = dict(self.sync_state.get('retry') or {})
+        removed = set()
+        for change in changes:
+            file_id = change.get('fileId')
+            file = change.get('file') or {}
+            in_corpus = (not change.get('removed') and not file.get('trashed')
+                         and file.get('mimeType') == 'application/pdf'
+                         and GOOGLE_DRIVE_FOLDER_ID in (file.get('parents') or []))
+            if not in_corpus:
+                changed.pop(file_id, None)
+                if file_id in tracked:
+                    removed.add(file_id)
+                continue
+            removed.discard(file_id)
+            prev = tracked.get(file_id)
+            if (prev and prev.get('modifiedTime') == file.get('modifiedTime')
+                    and prev.get('size') == file.get('size') and prev.get('name') == file.get('name')):
+                continue
+            changed[file_id] = {'id': file_id, 'name': file.get('name'),
+                                'modifiedTime': file.get('modifiedTime'), 'size': file.get('size')}
+        
+        if not changed and not removed:
+            self.sync_state['page_token'] = new_token
+            print("[Google Drive] Sin cambios en la carpeta")
+            return CorpusSnapshot(current.text, current.documents, current.index, time.time(), current.versions)
+        
+        files = list(changed.values())
+        if parallel is None:
+            parallel = DRIVE_PARALLEL_REFRESH
+        if parallel:
+            texts = self.download_all_parallel(files)
+        else:
+            texts = {f['id']: self.download_pdf(f['id'], f['name'], f.get('modifiedTime')) for f in files}
+        
+        # Parchear copias: los lectores del snapshot vigente no ven estados intermedios
+        index = current.index.copy()
+        documents = dict(current.documents)
+        versions = dict(current.versions)
+        for file_id in removed | set(changed):
+            if file_id in documents:
+                index.remove_document(file_id)
+                documents.pop(file_id)
+                versions.pop(file_id, None)
+            tracked.pop(file_id, None)
+        retry = {f['id']: f for f in files if not self._is_current(f)}
+        for file in files:
+            text = texts.get(file['id'])
+            if text:
+                index.add_document(file['id'], file['name'], text)
+                documents[file['id']] = None if self.lazy_text else text
+                # La versión que aportó el texto (la anterior si la descarga falló y quedó el cache)
+                versions[file['id']] = self.pdf_cache[file['id']].get('modified_time')
+                tracked[file['id']] = self._sync_entry(file)
+        for file_id in removed:
+            self.pdf_cache.pop(file_id, None)
+        
+        index.signature = corpus_signature({fid: self.pdf_cache[fid] for fid in documents if fid in self.pdf_cache})
+        index.save(os.path.join(CACHE_FOLDER, "pdf_index.json"))
+        self.sync_state = {'page_token': new_token, 'files': tracked, 'retry': retry}
+        print(f"[Google Drive] Sincronización incremental: {len(files)} agregados/modificados, {len(removed)} eliminados"
+              + (f", {len(retry)} a reintentar" if retry else ""))
+        return CorpusSnapshot(
+            text=None if self.lazy_text else self._join_documents(documents, tracked),
+            documents=documents,
+            index=index,
+            cached_at=time.time(),
+            versions=versions
+        )
+    
+    def _join_documents(self, documents: Dict[str, str], files_meta: Dict[str, Dict]) -> str:
+        """Concatena los documentos en orden por nombre (mismo formato que el refresco completo)."""
+        ordered = sorted(documents, key=lambda fid: (files_meta.get(fid) or {}).get('name') or fid)
+        return "\n\n".join(
+            f"\n{'='*60}\n"
+            f"DOCUMENTO: {(files_meta.get(fid) or {}).get('name') or fid}\n"
+            f"{'='*60}\n"
+            f"{documents[fid]}"
+            for fid in ordered
+        )
+    
+    def _build_full_snapshot(self, force_refresh: bool, parallel: Optional[bool]) -> CorpusSnapshot:
+        """Lista, descarga y extrae los PDFs y arma un snapshot nuevo sin tocar el vigente."""
+        start_token = self._get_start_page_token()
+        files = self.list_pdf_files(force_refresh or start_token is not None)
+        if not files:
+            # Drive no disponible: no reemplazar el corpus actual por uno vacío
+            raise RuntimeError("Sin lista de archivos de Drive")
+        
+        if parallel is None:
+            parallel = DRIVE_PARALLEL_REFRESH
+        parallel_texts = self.download_all_parallel(files) if parallel else {}
         
         all_texts = []
+        corpus: Dict[str, Dict] = {}
         for file in files:
-            text = self.download_pdf(
-                file['id'], 
-                file['name'], 
-                file.get('modifiedTime')
-            )
+            if parallel:
+                text = parallel_texts.get(file['id'])
+            else:
+                text = self.download_pdf(
+                    file['id'], 
+                    file['name'], 
+                    file.get('modifiedTime')
+                )
             if text:
+                corpus[file['id']] = dict(self.pdf_cache[file['id']], text=text)
                 all_texts.append(
                     f"\n{'='*60}\n"
                     f"DOCUMENTO: {file['name']}\n"
@@ -371,38 +1065,115 @@ class GoogleDriveManager:
                     f"{text}"
                 )
         
-        self.all_documents_text = "\n\n".join(all_texts)
-        self.all_documents_cached_at = time.time()
-        self._save_cache_to_disk()
+        # Reindexar solo si el corpus cambió (solo archivos presentes en la carpeta)
+        index = self._snapshot.index
+        if index is None or index.signature != corpus_signature(corpus):
+            index = self._build_index(corpus)
+        
+        files_meta = {f['id']: self._sync_entry(f) for f in files if f['id'] in corpus}
+        retry = {f['id']: f for f in files if not self._is_current(f)}
+        self.sync_state = {'page_token': start_token, 'files': files_meta, 'retry': retry}
         
         print(f"[Google Drive] Total documentos procesados: {len(all_texts)}")
-        return self.all_documents_text
+        return CorpusSnapshot(
+            text=None if self.lazy_text else "\n\n".join(all_texts),
+            documents={fid: None if self.lazy_text else entry['text'] for fid, entry in corpus.items()},
+            index=index,
+            cached_at=time.time(),
+            versions={fid: entry.get('modified_time') for fid, entry in corpus.items()}
+        )
+    
+    def _start_background_refresh(self, parallel: Optional[bool] = None) -> bool:
+        """Lanza el worker de refresco si no hay otro corriendo ni un reintento pendiente."""
+        with self._state_lock:
+            if self._refresh_thread is not None and self._refresh_thread.is_alive():
+                return False
+            if self._refresh_state == REFRESH_FAILED and time.time() < self._retry_after:
+                return False
+            self._refresh_state = REFRESH_REFRESHING
+            self._refresh_thread = threading.Thread(
+                target=self._background_refresh, args=(parallel,),
+                name="drive-corpus-refresh", daemon=True
+            )
+            self._refresh_thread.start()
+        print("[Google Drive] Corpus vencido: sirviendo versión actual y refrescando en segundo plano")
+        return True
+    
+    def _background_refresh(self, parallel: Optional[bool]):
+        try:
+            self._refresh_corpus(parallel=parallel)
+            print("[Google Drive] Refresco en segundo plano completado")
+        except Exception as e:
+            print(f"[Google Drive] Refresco en segundo plano falló: {e}")
+    
+    def get_refresh_status(self) -> Dict:
+        """Estado del corpus para reportar desde la app (fresh, stale-serving, refreshing, failed)."""
+        snapshot = self._snapshot
+        age = time.time() - snapshot.cached_at if snapshot.cached_at else None
+        with self._state_lock:
+            state = self._refresh_state
+            if state == REFRESH_FRESH and (age is None or age >= CACHE_REFRESH_INTERVAL):
+                state = REFRESH_STALE_SERVING
+            return {
+                'state': state,
+                'corpus_age_s': round(age, 1) if age is not None else None,
+                'documents': len(snapshot.documents),
+                'passages': len(snapshot.index) if snapshot.index else 0,
+                'last_refresh_at': self.last_refresh_at or None,
+                'last_refresh_duration_s': round(self.last_refresh_duration, 2),
+                'last_error': self.last_refresh_error,
+            }
     
-    def search_in_documents(self, query: str) -> str:
+    def search_in_documents(self, query: str, top_k: int = PDF_SEARCH_TOP_K) -> List[Dict]:
         """
-        Busca información en TODOS los documentos según la consulta.
-        Ya no depende de un mapeo fijo de palabras clave.
+        Busca los pasajes más relevantes para la consulta en TODOS los documentos.
         
         Args:
             query: Consulta del usuario
+            top_k: Número máximo de pasajes a devolver
             
         Returns:
-            Texto de todos los documentos para que la IA busque
+            Lista acotada de pasajes {document, page, score, text}, de mayor a menor score.
+            Lista vacía si no hay documentos cargados.
         """
-        # Obtener todos los documentos (usa cache si está disponible)
-        all_text = self.get_all_documents_text()
-        
-        if not all_text:
-            return "No se pudieron cargar los documentos. Por favor, intenta más tarde."
-        
-        return all_text
+        # Asegura corpus vigente sin armar el texto concatenado (usa cache si está disponible)
+        self._ensure_fresh()
+        return self.search_passages(query, top_k)
     
-    def refresh_cache(self):
+    def refresh_cache(self, parallel: Optional[bool] = None):
         """Fuerza la actualización del cache de documentos."""
         print("[Google Drive] Refrescando cache de documentos...")
-        self.get_all_documents_text(force_refresh=True)
+        self._refresh_corpus(force_refresh=True, parallel=parallel)
         print("[Google Drive] Cache actualizado")
 
+# ============================================================================
+# CORPUS ESTÁTICO (se genera en el despliegue)
+# ============================================================================
+
+def build_static_corpus(refresh: bool = True) -> str:
+    """
+    Genera STATIC_CACHE_FOLDER/pdf_corpus.bin (y el índice BM25) para desplegar con el código.
+    Si Drive no está disponible, convierte el cache existente (p.ej. un pdf_cache.json).
+    
+    Uso: python -c "from google_drive import build_static_corpus; build_static_corpus()"
+    """
+    manager = GoogleDriveManager()
+    if refresh:
+        try:
+            manager.refresh_cache()
+        except Exception as e:
+            print(f"[Google Drive] No se pudo refrescar desde Drive ({e}), se usa el cache actual")
+    
+    os.makedirs(STATIC_CACHE_FOLDER, exist_ok=True)
+    corpus_path = os.path.join(STATIC_CACHE_FOLDER, CORPUS_FILENAME)
+    size = manager.write_corpus(corpus_path)
+    # Generaciones guardadas en caliente en la misma carpeta (local: cache dinámico = estático)
+    prune_corpus_generations(STATIC_CACHE_FOLDER, corpus_path)
+    if manager.index is not None:
+        manager.index.save(os.path.join(STATIC_CACHE_FOLDER, "pdf_index.json"))
+    print(f"[Google Drive] Corpus estático: {len(manager.pdf_cache)} PDFs, {size / 1024:.1f} KB en {corpus_path}")
+    return corpus_path
+
 # Instancia global (singleton)
 _drive_manager = None
 
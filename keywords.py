@@ -0,0 +1,210 @@
+"""
+Palabras Clave - Autómata Aho-Corasick compartido
+=================================================
+Todas las listas de palabras clave del ruteo (mapa universal, intención
+compleja, clasificación de consultas y tipo de consulta para el log) se
+compilan en un único autómata Aho-Corasick (KeywordScanner). Una sola pasada
+sobre la consulta normalizada encuentra todas las coincidencias, y los
+distintos consumidores leen de ese mismo resultado.
+
+El mapa universal viene del paquete de conocimiento (knowledge_pack.py):
+cada paquete cargado construye su propio KeywordScanner.
+
+Los patrones se normalizan igual que la consulta (normalize_text), así que
+'matrícula' y 'matricula' son la misma palabra clave.
+"""
+
+from collections import deque
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Sequence, Tuple
+
+_ACCENTS = {"á": "a", "é": "e", "í": "i", "ó": "o", "ú": "u"}
+
+
+def fold_accents(text: str) -> str:
+    """Quita tildes de vocales en un texto ya en minúsculas (la ñ se conserva)."""
+    for old, new in _ACCENTS.items():
+        text = text.replace(old, new)
+    return text
+
+
+def normalize_text(text: str) -> str:
+    """Minúsculas sin tildes (la ñ se conserva)."""
+    return fold_accents(text.lower().strip())
+
+
+# ============================================================================
+# LISTAS DE PALABRAS CLAVE
+# ============================================================================
+
+# Filtro para evitar falsos positivos en el mapa universal
+# Ej: "cuanto duran las carreras de farmacia" -> No debe dar docentes
+DURATION_WORDS = ["duracion", "tiempo", "años", "semestres", "malla"]
+
+# Si pide explicación, se saltan las respuestas rápidas y se va a la IA inyectada
+COMPLEX_TRIGGERS = ["explicar", "explica", "detalle", "detallado", "paso", "procedimiento", "como hago", "guia"]
+
+# Clasificaciones (el primer tipo con alguna coincidencia gana)
+QUERY_CLASSIFICATIONS = {
+    'matrícula': ['matrícula', 'matricula', 'matricularme', 'inscripción', 'proceso', 'pasos'],
+    'traslado': ['traslado', 'trasladar', 'cambiar de instituto'],
+    'reserva': ['reserva', 'reservar'],
+    'reincorporación': ['reincorporación', 'reincorporacion', 'volver'],
+    'cambio_turno': ['cambio de turno', 'turno', 'horario'],
+    'titulación': ['titulación', 'título', 'bachiller', 'titulado'],
+    'costos': ['costo', 'precio', 'pago', 'cuánto', 'tarifa', 'mensualidad'],
+    'fechas': ['fecha', 'plazo', 'cuándo', 'cronograma'],
+    'requisitos': ['requisito', 'documento', 'necesito', 'papeles'],
+    'vacantes': ['vacante', 'cupos', 'disponibilidad'],
+    'carreras': ['carrera', 'programa', 'especialidad', 'arquitectura', 'contabilidad', 'enfermería', 'mecatrónica', 'farmacia'],
+    'certificados': ['certificado', 'constancia', 'récord'],
+    'becas': ['beca', 'becado', 'descuento', 'exoneración'],
+    'saludo': ['hola', 'buenos días', 'buenas tardes', 'saludos'],
+    'despedida': ['gracias', 'adiós', 'chau', 'hasta luego'],
+}
+
+# Tipo de consulta para el registro de consultas (app.chat)
+LOG_QUERY_TYPES = {
+    'admision': ['examen', 'admisión'],
+    'matricula': ['matrícula', 'pago'],
+}
+
+
+# ============================================================================
+# AUTÓMATA AHO-CORASICK
+# ============================================================================
+
+class KeywordAutomaton:
+    """Autómata Aho-Corasick: encuentra todas las apariciones de todos los patrones en una pasada."""
+
+    def __init__(self, patterns: Iterable[str]):
+        self.patterns: List[str] = []
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[int, ...]] = [()]
+
+        index: Dict[str, int] = {}
+        for pattern in patterns:
+            if not pattern or pattern in index:
+                continue
+            index[pattern] = len(self.patterns)
+            self.patterns.append(pattern)
+            state = 0
+            for ch in pattern:
+                nxt = self._goto[state].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (index[pattern],)
+
+        # Enlaces de falla por BFS; cada estado hereda las salidas de su enlace
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and ch not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(ch, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, str]]:
+        """(posición final, patrón) de cada aparición, en orden de aparición."""
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self.patterns
+        state = 0
+        for pos, ch in enumerate(text):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for pid in out[state]:
+                yield pos, patterns[pid]
+
+    def find_all(self, text: str) -> FrozenSet[str]:
+        """Conjunto de patrones presentes en el texto."""
+        return frozenset(pattern for _, pattern in self.iter_matches(text))
+
+
+class KeywordHits:
+    """Coincidencias de una consulta, interpretadas para cada consumidor."""
+
+    __slots__ = ('matched', 'universal')
+
+    def __init__(self, matched: FrozenSet[str], universal: Sequence[Tuple[str, str]] = ()):
+        self.matched = matched
+        # Mapa universal (palabra clave, clave FAQ) con el que se escaneó la consulta
+        self.universal = universal
+
+    def __contains__(self, keyword: str) -> bool:
+        return normalize_text(keyword) in self.matched
+
+    def _any(self, keywords: List[str]) -> bool:
+        return any(kw in self.matched for kw in keywords)
+
+    @property
+    def is_complex(self) -> bool:
+        return self._any(_COMPLEX)
+
+    @property
+    def is_duration(self) -> bool:
+        return self._any(_DURATION)
+
+    def universal_targets(self) -> Iterator[str]:
+        """Claves FAQ del mapa universal en orden de prioridad (sin docentes si pregunta duración)."""
+        is_duration = None
+        for keyword, faq_key in self.universal:
+            if keyword not in self.matched:
+                continue
+            if faq_key.startswith("docentes"):
+                if is_duration is None:
+                    is_duration = self.is_duration
+                if is_duration:
+                    continue
+            yield faq_key
+
+    @property
+    def query_class(self) -> str:
+        """Tipo de QUERY_CLASSIFICATIONS (el primero con coincidencia) o 'general'."""
+        for qtype, keywords in _CLASSIFICATIONS:
+            if self._any(keywords):
+                return qtype
+        return 'general'
+
+    @property
+    def log_query_type(self) -> str:
+        """Tipo de consulta para el registro ('admision', 'matricula' o 'general')."""
+        for qtype, keywords in _LOG_TYPES:
+            if self._any(keywords):
+                return qtype
+        return 'general'
+
+
+# Listas normalizadas: se compilan una sola vez al importar
+_DURATION = [normalize_text(w) for w in DURATION_WORDS]
+_COMPLEX = [normalize_text(w) for w in COMPLEX_TRIGGERS]
+# Las variantes con tilde de QUERY_CLASSIFICATIONS nunca coincidieron (la consulta se compara
+# sin tildes); no se compilan para no cambiar la clasificación ('cuánto' atraparía "cuantos años")
+_CLASSIFICATIONS = [(qtype, [w for w in kws if normalize_text(w) == w]) for qtype, kws in QUERY_CLASSIFICATIONS.items()]
+_LOG_TYPES = [(qtype, [normalize_text(w) for w in kws]) for qtype, kws in LOG_QUERY_TYPES.items()]
+
+_ROUTING_PATTERNS = (
+    _DURATION + _COMPLEX
+    + [w for _, kws in _CLASSIFICATIONS for w in kws]
+    + [w for _, kws in _LOG_TYPES for w in kws]
+)
+
+
+class KeywordScanner:
+    """Autómata de ruteo: listas fijas de este módulo + mapa universal del paquete de conocimiento."""
+
+    def __init__(self, universal: Iterable[Tuple[str, str]] = ()):
+        # (palabra clave, clave FAQ) en orden de prioridad
+        self.universal: List[Tuple[str, str]] = [(normalize_text(k), v) for k, v in universal]
+        self.automaton = KeywordAutomaton([k for k, _ in self.universal] + _ROUTING_PATTERNS)
+
+    def scan(self, query_norm: str) -> KeywordHits:
+        """Una pasada del autómata sobre la consulta ya normalizada (normalize_text)."""
+        return KeywordHits(self.automaton.find_all(query_norm), self.universal)
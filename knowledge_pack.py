@@ -0,0 +1,243 @@
+"""
+Paquete de Conocimiento - FAQ, mapa universal y datos verificados
+=================================================================
+Reemplaza los literales de Python (FAQ de smart_response, universal_map,
+AIManager.VERIFIED_CONTEXT y el career_data de _inject_verified_context).
+
+- data/knowledge.json: fuente editable y versionada ('revision'). Cada lista
+  de docentes aparece una sola vez (en 'careers'); las respuestas del FAQ y
+  el contexto verificado se generan desde ahí.
+- cache/knowledge_pack.json: versión compilada en el despliegue, con las
+  claves ya normalizadas, los textos ya armados y el índice del matcher
+  difuso (build_knowledge_pack).
+
+get_knowledge_pack() devuelve el paquete vigente y revisa cada
+KNOWLEDGE_RELOAD_INTERVAL segundos si los archivos cambiaron: la recarga se
+hace en caliente (sin reiniciar workers) y un paquete inválido no reemplaza
+al que está en uso.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+from typing import Dict, List, Optional, Tuple, Union
+
+from config import KNOWLEDGE_SOURCE_FILE, KNOWLEDGE_PACK_FILE, KNOWLEDGE_RELOAD_INTERVAL
+from keywords import KeywordScanner, normalize_text
+from fuzzy_match import FuzzyMatcher
+
+KNOWLEDGE_FORMAT_VERSION = 1
+
+
+# ============================================================================
+# COMPILACIÓN (fuente -> estructuras listas para usar)
+# ============================================================================
+
+def _text(value: Union[str, List[str]]) -> str:
+    """Los textos largos de la fuente se escriben como lista de líneas."""
+    return "\n".join(value) if isinstance(value, list) else value
+
+
+def _faq_teachers(career: Dict) -> str:
+    teachers = career['teachers']
+    lines = [f"• {name} (Coord.)" if name == career.get('coordinator') else f"• {name}" for name in teachers]
+    return f"Plana Docente - {career['program']} ({len(teachers)}):\n\n" + "\n".join(lines)
+
+
+def _verified_teachers(career: Dict) -> str:
+    teachers = career['teachers']
+    names = [f"{name} (Coord)" if name == career.get('coordinator') else name for name in teachers]
+    return f"DOCENTES {career['label']} ({len(teachers)}): " + ", ".join(names) + "."
+
+
+def compile_knowledge(source: Dict, source_sha: str = "") -> Dict:
+    """
+    Compila la fuente a la estructura que carga KnowledgePack.
+
+    Raises:
+        ValueError: formato no soportado, carrera inexistente o claves FAQ repetidas.
+    """
+    if source.get('format') != KNOWLEDGE_FORMAT_VERSION:
+        raise ValueError(f"formato de conocimiento no soportado: {source.get('format')}")
+
+    careers = source.get('careers', {})
+    faq_keys: List[str] = []
+    answers: List[str] = []
+    for key, value in source.get('faq', {}).items():
+        norm = normalize_text(key)
+        if norm in faq_keys:
+            raise ValueError(f"clave FAQ repetida: '{key}'")
+        if isinstance(value, dict):
+            if value.get('career') not in careers:
+                raise ValueError(f"FAQ '{key}' referencia una carrera inexistente: {value.get('career')}")
+            answers.append(_faq_teachers(careers[value['career']]))
+        else:
+            answers.append(_text(value))
+        faq_keys.append(norm)
+
+    known = set(faq_keys)
+    universal = []
+    for keyword, faq_key in source.get('universal_map', {}).items():
+        target = normalize_text(faq_key)
+        if target not in known:
+            print(f"[Knowledge] Mapa universal: '{keyword}' apunta a '{faq_key}', que no está en el FAQ (se omite)")
+            continue
+        universal.append([normalize_text(keyword), target])
+
+    return {
+        'format': KNOWLEDGE_FORMAT_VERSION,
+        'revision': source.get('revision', ''),
+        'source_sha': source_sha,
+        'compiled_at': time.time(),
+        'faq': {'keys': faq_keys, 'answers': answers},
+        'faq_index': FuzzyMatcher(faq_keys).export_index(),
+        'universal_map': universal,
+        'verified_context': {qtype: _text(text) for qtype, text in source.get('verified_context', {}).items()},
+        'careers': [[key, _verified_teachers(career)] for key, career in careers.items()],
+    }
+
+
+# ============================================================================
+# PAQUETE CARGADO
+# ============================================================================
+
+class KnowledgePack:
+    """Estructuras de consulta de una revisión del conocimiento (solo lectura)."""
+
+    __slots__ = ('revision', 'source_sha', 'compiled_at', 'origin', 'faq', 'faq_matcher',
+                 'verified_context', 'careers', 'scanner')
+
+    def __init__(self, compiled: Dict, origin: str = ""):
+        self.revision: str = compiled.get('revision', '')
+        self.source_sha: str = compiled.get('source_sha', '')
+        self.compiled_at: float = compiled.get('compiled_at', 0)
+        self.origin = origin
+        keys = compiled['faq']['keys']
+        # Clave FAQ normalizada -> respuesta (el orden de la fuente define los empates)
+        self.faq: Dict[str, str] = dict(zip(keys, compiled['faq']['answers']))
+        self.faq_matcher = FuzzyMatcher(keys, index=compiled.get('faq_index'))
+        # Tipo de consulta -> información oficial verificada
+        self.verified_context: Dict[str, str] = compiled.get('verified_context', {})
+        # Carrera -> docentes verificados (el orden define el orden de inyección)
+        self.careers: Dict[str, str] = dict(compiled.get('careers', []))
+        self.scanner = KeywordScanner(compiled.get('universal_map', []))
+
+    def describe(self) -> Dict:
+        return {
+            'revision': self.revision,
+            'source_sha': self.source_sha[:12],
+            'origin': self.origin,
+            'faq_entries': len(self.faq),
+            'careers': len(self.careers),
+        }
+
+
+def _file_sha(path: str) -> str:
+    with open(path, 'rb') as f:
+        return hashlib.sha256(f.read()).hexdigest()
+
+
+def load_knowledge_pack(source_path: Optional[str] = None, pack_path: Optional[str] = None) -> KnowledgePack:
+    """
+    Usa el paquete compilado si corresponde a la fuente actual; si falta o
+    quedó desactualizado, compila la fuente en memoria.
+    """
+    source_path = source_path or KNOWLEDGE_SOURCE_FILE
+    pack_path = pack_path or KNOWLEDGE_PACK_FILE
+    source_sha = _file_sha(source_path) if os.path.exists(source_path) else None
+
+    if os.path.exists(pack_path):
+        with open(pack_path, 'r', encoding='utf-8') as f:
+            compiled = json.load(f)
+        if compiled.get('format') == KNOWLEDGE_FORMAT_VERSION and source_sha in (None, compiled.get('source_sha')):
+            return KnowledgePack(compiled, origin="compilado")
+        print("[Knowledge] Paquete compilado desactualizado, se compila desde la fuente")
+
+    if source_sha is None:
+        raise FileNotFoundError(f"No existe la fuente de conocimiento: {source_path}")
+    with open(source_path, 'r', encoding='utf-8') as f:
+        source = json.load(f)
+    return KnowledgePack(compile_knowledge(source, source_sha), origin="fuente")
+
+
+def build_knowledge_pack(source_path: Optional[str] = None, pack_path: Optional[str] = None) -> str:
+    """
+    Compila data/knowledge.json en cache/knowledge_pack.json para desplegar con el código.
+
+    Uso: python -c "from knowledge_pack import build_knowledge_pack; build_knowledge_pack()"
+    """
+    source_path = source_path or KNOWLEDGE_SOURCE_FILE
+    pack_path = pack_path or KNOWLEDGE_PACK_FILE
+    with open(source_path, 'r', encoding='utf-8') as f:
+        source = json.load(f)
+    compiled = compile_knowledge(source, _file_sha(source_path))
+
+    os.makedirs(os.path.dirname(pack_path), exist_ok=True)
+    tmp_path = f"{pack_path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(compiled, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp_path, pack_path)
+    print(f"[Knowledge] Paquete {compiled['revision']} compilado: "
+          f"{len(compiled['faq']['keys'])} FAQ, {len(compiled['careers'])} carreras en {pack_path}")
+    return pack_path
+
+
+# ============================================================================
+# PAQUETE VIGENTE (recarga en caliente)
+# ============================================================================
+
+_pack: Optional[KnowledgePack] = None
+_signature: Optional[Tuple] = None
+_checked_at = 0.0
+_lock = threading.Lock()
+
+
+def _files_signature() -> Tuple:
+    signature = []
+    for path in (KNOWLEDGE_SOURCE_FILE, KNOWLEDGE_PACK_FILE):
+        try:
+            st = os.stat(path)
+            signature.append((st.st_mtime_ns, st.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def get_knowledge_pack() -> KnowledgePack:
+    """Paquete vigente; a lo sumo cada KNOWLEDGE_RELOAD_INTERVAL s revisa si los archivos cambiaron."""
+    global _pack, _signature, _checked_at
+    pack = _pack
+    if pack is not None and time.time() - _checked_at < KNOWLEDGE_RELOAD_INTERVAL:
+        return pack
+
+    with _lock:
+        if _pack is not None and time.time() - _checked_at < KNOWLEDGE_RELOAD_INTERVAL:
+            return _pack
+        _checked_at = time.time()
+        signature = _files_signature()
+        if _pack is not None and signature == _signature:
+            return _pack
+        try:
+            new_pack = load_knowledge_pack()
+        except Exception as e:
+            if _pack is None:
+                raise
+            # No reintentar hasta que los archivos vuelvan a cambiar
+            _signature = signature
+            print(f"[Knowledge] Recarga fallida ({e}), se mantiene la revisión {_pack.revision}")
+            return _pack
+        if _pack is not None:
+            print(f"[Knowledge] Recargado: revisión {_pack.revision} -> {new_pack.revision}")
+        _pack, _signature = new_pack, signature
+        return _pack
+
+
+def reload_knowledge_pack() -> KnowledgePack:
+    """Fuerza la revisión de los archivos en la próxima consulta (y la hace ahora)."""
+    global _checked_at, _signature
+    with _lock:
+        _checked_at = 0.0
+        _signature = None
+    return get_knowledge_pack()
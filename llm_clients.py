@@ -0,0 +1,158 @@
+"""
+Clientes de Proveedores LLM - Handles reutilizables y sesiones HTTP con pool
+===========================================================================
+Antes cada llamada creaba un genai.GenerativeModel nuevo y cada llamada a
+OpenRouter usaba un requests.post suelto (conexión TCP + TLS nueva cada vez).
+
+- GeminiClient: un GenerativeModel por nombre de modelo (creado una vez) y la
+  GenerationConfig compartida; timeout de lectura vía request_options.
+- OpenRouterClient: una requests.Session con pool keep-alive (HTTPAdapter) y
+  encabezados fijos; timeouts de conexión y de lectura por separado.
+
+Ambos llevan contadores por llamada (latencia total, conexiones abiertas)
+para medir el overhead del cliente aparte del tiempo del modelo. Medición
+contra un endpoint local (p. ej. un servidor falso compatible con OpenAI):
+    python -c "from llm_clients import benchmark_overhead; benchmark_overhead('http://127.0.0.1:8765/v1')"
+"""
+
+import time
+import threading
+from typing import Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+import google.generativeai as genai
+
+
+class CallStats:
+    """Contadores de llamadas de un cliente (seguros entre hilos)."""
+
+    __slots__ = ('calls', 'errors', 'total_s', 'connections', '_lock')
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total_s = 0.0
+        self.connections = 0
+        self._lock = threading.Lock()
+
+    def record(self, elapsed: float, error: bool = False, new_connections: int = 0):
+        with self._lock:
+            self.calls += 1
+            self.errors += int(error)
+            self.total_s += elapsed
+            self.connections += new_connections
+
+    def to_dict(self) -> Dict:
+        with self._lock:
+            return {
+                'calls': self.calls,
+                'errors': self.errors,
+                'avg_ms': round(1000 * self.total_s / self.calls, 2) if self.calls else 0.0,
+                'connections_opened': self.connections,
+            }
+
+
+class GeminiClient:
+    """Handles de google.generativeai reutilizados por nombre de modelo."""
+
+    def __init__(self, temperature: float = 0.4, read_timeout: float = 30):
+        self.generation_config = genai.types.GenerationConfig(temperature=temperature)
+        self.request_options = {'timeout': read_timeout}
+        self._models: Dict[str, genai.GenerativeModel] = {}
+        self._lock = threading.Lock()
+        self.stats = CallStats()
+
+    def model(self, name: str) -> 'genai.GenerativeModel':
+        handle = self._models.get(name)
+        if handle is None:
+            with self._lock:
+                handle = self._models.get(name)
+                if handle is None:
+                    handle = self._models[name] = genai.GenerativeModel(name)
+        return handle
+
+    def generate(self, name: str, prompt: str, stream: bool = False, timeout: Optional[float] = None):
+        """Respuesta de generate_content (iterable de fragmentos si stream=True); `timeout` acota la lectura."""
+        options = self.request_options
+        if timeout is not None:
+            options = {'timeout': max(0.1, min(options['timeout'], timeout))}
+        start = time.perf_counter()
+        try:
+            resp = self.model(name).generate_content(prompt, generation_config=self.generation_config,
+                                                     stream=stream, request_options=options)
+        except Exception:
+            self.stats.record(time.perf_counter() - start, error=True)
+            raise
+        self.stats.record(time.perf_counter() - start)
+        return resp
+
+
+class OpenRouterClient:
+    """Sesión HTTP keep-alive para el endpoint chat/completions (formato OpenAI)."""
+
+    def __init__(self, url: str, api_key: str, connect_timeout: float = 5, read_timeout: float = 30,
+                 pool_size: int = 8):
+        self.url = url
+        self.timeout: Tuple[float, float] = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        self.session.headers.update({"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
+        # Un solo host: un pool con tantas conexiones como llamadas simultáneas (cadena cubierta)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._adapter = adapter
+        self.stats = CallStats()
+
+    def _opened_connections(self) -> int:
+        """Conexiones TCP abiertas hasta ahora por el pool (urllib3 las cuenta por host)."""
+        pools = self._adapter.poolmanager.pools
+        return sum(pools[key].num_connections for key in pools.keys())
+
+    def chat(self, model: str, prompt: str, stream: bool = False, timeout: Optional[float] = None) -> requests.Response:
+        """POST chat/completions; con stream=True el cuerpo (SSE) queda sin leer. `timeout` acota la lectura."""
+        payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+        if stream:
+            payload["stream"] = True
+        connect, read = self.timeout
+        if timeout is not None:
+            read = max(0.1, min(read, timeout))
+        opened = self._opened_connections()
+        start = time.perf_counter()
+        try:
+            resp = self.session.post(self.url, json=payload, timeout=(connect, read), stream=stream)
+        except requests.RequestException:
+            self.stats.record(time.perf_counter() - start, error=True,
+                              new_connections=self._opened_connections() - opened)
+            raise
+        self.stats.record(time.perf_counter() - start, error=resp.status_code != 200,
+                          new_connections=self._opened_connections() - opened)
+        return resp
+
+    def close(self):
+        self.session.close()
+
+
+def benchmark_overhead(url: str, calls: int = 50, model: str = "bench", prompt: str = "ping") -> Dict:
+    """
+    Overhead por llamada contra un endpoint local que responde al instante:
+    requests.post suelto (conexión nueva cada vez) vs OpenRouterClient (pool keep-alive).
+    El servidor local debe usar TCP_NODELAY: si no, en conexiones reusadas se mide su
+    Nagle + ACK retardado (~40 ms) en lugar del overhead del cliente.
+    """
+    def measure(post) -> float:
+        start = time.perf_counter()
+        for _ in range(calls):
+            post().close()
+        return 1000 * (time.perf_counter() - start) / calls
+
+    payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
+    bare_ms = measure(lambda: requests.post(url, json=payload, timeout=(5, 30)))
+    client = OpenRouterClient(url, api_key="bench")
+    pooled_ms = measure(lambda: client.chat(model, prompt))
+    client.close()
+    result = {'calls': calls, 'bare_ms': round(bare_ms, 3), 'pooled_ms': round(pooled_ms, 3),
+              'pooled_connections': client.stats.connections}
+    print(f"[LLMClients] Overhead por llamada ({calls} llamadas): requests.post {bare_ms:.2f} ms, "
+          f"sesión con pool {pooled_ms:.2f} ms ({client.stats.connections} conexiones)")
+    return result
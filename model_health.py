@@ -0,0 +1,197 @@
+"""
+Salud por Modelo - Puntaje móvil y circuit breaker
+==================================================
+GEMINI_MODELS y OPENROUTER_MODELS se recorrían en orden fijo; la única
+señal era la pausa tras una excepción (hoy, los cooldowns de
+model_scheduler), que no ve la latencia ni las respuestas descartadas por
+_is_useful_response.
+
+ModelHealth guarda, por modelo, las últimas `window` llamadas (latencia y
+resultado: útil / inútil / error) y calcula:
+- latencia p50 y p95 (de las llamadas que respondieron),
+- tasa de error y tasa de respuestas útiles,
+- un puntaje = tiempo esperado hasta una respuesta útil: latencia mezclando
+  p50 y p95 (`default_latency` si aún no hay datos) dividida por la tasa
+  útil, con un previo optimista de una llamada útil.
+
+order() pone primero al modelo sano más rápido (empates: orden configurado)
+y deja fuera los que tienen el circuito abierto. Con `tiers` (el margen de
+cuota diaria de model_scheduler) el nivel manda y el puntaje solo desempata
+dentro de cada nivel: un modelo rápido con 20 RPD no pasa delante de uno con
+cuota holgada. El circuito se abre tras
+`failure_threshold` fallas seguidas (error o respuesta inútil), se queda
+abierto `open_seconds` (el doble cada vez que la prueba vuelve a fallar,
+hasta `max_open_seconds`) y luego deja pasar una sola llamada de prueba
+(medio abierto): si es útil se cierra, si no se vuelve a abrir.
+
+Las cuentas son por proceso, como las cuotas del planificador.
+"""
+
+import math
+import time
+import threading
+from collections import deque
+from typing import Dict, Iterable, List, Optional
+
+USEFUL = 'useful'
+USELESS = 'useless'
+ERROR = 'error'
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+MIN_USEFUL_RATE = 0.05  # Tope inferior de la tasa útil en el puntaje (evita dividir por ~0)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """Percentil por rango más cercano de una lista ya ordenada (no vacía)."""
+    return sorted_values[max(0, math.ceil(q * len(sorted_values)) - 1)]
+
+
+class _ModelState:
+    """Ventana de llamadas y estado del circuito de un modelo."""
+
+    __slots__ = ('calls', 'failures', 'state', 'opened_until', 'open_for', 'probing')
+
+    def __init__(self, window: int):
+        self.calls = deque(maxlen=window)  # (latencia, resultado)
+        self.failures = 0                  # Fallas seguidas
+        self.state = CLOSED
+        self.opened_until = 0.0
+        self.open_for = 0.0
+        self.probing = False
+
+
+class ModelHealth:
+    """Puntajes y circuit breakers por modelo; seguro entre hilos."""
+
+    def __init__(self, window: int = 50, failure_threshold: int = 3, open_seconds: float = 30,
+                 max_open_seconds: float = 10 * 60, default_latency: float = 5.0, tail_weight: float = 0.3):
+        self.window = window
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.max_open_seconds = max_open_seconds
+        self.default_latency = default_latency
+        self.tail_weight = tail_weight  # Peso del p95 frente al p50 en la latencia del puntaje
+        self._models: Dict[str, _ModelState] = {}
+        self._lock = threading.Lock()
+
+    def _state(self, model: str) -> _ModelState:
+        state = self._models.get(model)
+        if state is None:
+            state = self._models[model] = _ModelState(self.window)
+        return state
+
+    def _refresh(self, state: _ModelState, now: float):
+        """Abierto y vencido -> medio abierto (admite una prueba)."""
+        if state.state == OPEN and now >= state.opened_until:
+            state.state = HALF_OPEN
+            state.probing = False
+
+    # ------------------------------------------------------------------
+    # Métricas
+    # ------------------------------------------------------------------
+    def _metrics(self, state: _ModelState) -> Dict:
+        n = len(state.calls)
+        latencies = sorted(lat for lat, outcome in state.calls if outcome != ERROR)
+        useful = sum(1 for _, outcome in state.calls if outcome == USEFUL)
+        errors = sum(1 for _, outcome in state.calls if outcome == ERROR)
+        p50 = percentile(latencies, 0.5) if latencies else None
+        p95 = percentile(latencies, 0.95) if latencies else None
+        latency = ((1 - self.tail_weight) * p50 + self.tail_weight * p95) if latencies else self.default_latency
+        # Previo optimista: una llamada útil "de regalo" para los modelos con pocos datos
+        useful_rate = (useful + 1) / (n + 1)
+        return {
+            'calls': n,
+            'p50_s': p50,
+            'p95_s': p95,
+            'error_rate': errors / n if n else 0.0,
+            'useful_rate': useful / n if n else None,
+            'score': latency / max(useful_rate, MIN_USEFUL_RATE),
+        }
+
+    def score(self, model: str) -> float:
+        """Tiempo esperado (s) hasta una respuesta útil; menor es mejor."""
+        with self._lock:
+            return self._metrics(self._state(model))['score']
+
+    # ------------------------------------------------------------------
+    # Antes de llamar
+    # ------------------------------------------------------------------
+    def order(self, models: Iterable[str], tiers: Optional[Dict[str, int]] = None) -> List[str]:
+        """
+        Modelos con el circuito cerrado o medio abierto, del mejor puntaje al peor (empates: orden dado).
+        `tiers` (menor primero) tiene prioridad sobre el puntaje.
+        """
+        tiers = tiers or {}
+        ranked = []
+        with self._lock:
+            now = time.time()
+            for i, model in enumerate(models):
+                state = self._state(model)
+                self._refresh(state, now)
+                if state.state == OPEN or (state.state == HALF_OPEN and state.probing):
+                    continue
+                ranked.append((tiers.get(model, 0), self._metrics(state)['score'], i, model))
+        return [model for *_, model in sorted(ranked)]
+
+    def allow(self, model: str) -> bool:
+        """¿Se puede llamar ahora? En medio abierto reserva la única llamada de prueba."""
+        with self._lock:
+            state = self._state(model)
+            self._refresh(state, time.time())
+            if state.state == CLOSED:
+                return True
+            if state.state == HALF_OPEN and not state.probing:
+                state.probing = True
+                return True
+            return False
+
+    # ------------------------------------------------------------------
+    # Después de llamar
+    # ------------------------------------------------------------------
+    def record(self, model: str, latency: float, outcome: str):
+        """Registra una llamada terminada (USEFUL, USELESS o ERROR) y actualiza el circuito."""
+        with self._lock:
+            state = self._state(model)
+            state.calls.append((latency, outcome))
+            if outcome == USEFUL:
+                if state.state != CLOSED:
+                    print(f"[ModelHealth] {model}: circuito cerrado")
+                state.failures = 0
+                state.state = CLOSED
+                state.open_for = 0.0
+                state.probing = False
+                return
+            state.failures += 1
+            if state.state == HALF_OPEN or (state.state == CLOSED and state.failures >= self.failure_threshold):
+                # Reincidencia tras la prueba: el circuito queda abierto el doble de tiempo
+                state.open_for = min(self.max_open_seconds, state.open_for * 2 if state.open_for else self.open_seconds)
+                state.state = OPEN
+                state.opened_until = time.time() + state.open_for
+                state.probing = False
+                print(f"[ModelHealth] {model}: circuito abierto {state.open_for:.0f}s "
+                      f"({state.failures} fallas seguidas)")
+
+    def release(self, model: str):
+        """Devuelve una prueba reservada con allow() que al final no se hizo (sin cuota, sin tiempo)."""
+        with self._lock:
+            state = self._state(model)
+            if state.state == HALF_OPEN:
+                state.probing = False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            result = {}
+            for model, state in self._models.items():
+                self._refresh(state, now)
+                metrics = self._metrics(state)
+                for key in ('p50_s', 'p95_s', 'useful_rate', 'error_rate', 'score'):
+                    if metrics[key] is not None:
+                        metrics[key] = round(metrics[key], 3)
+                metrics['state'] = state.state
+                metrics['open_s'] = round(max(0.0, state.opened_until - now), 1) if state.state == OPEN else 0.0
+                result[model] = metrics
+            return result
@@ -0,0 +1,278 @@
+"""
+Planificador de Cuotas por Modelo - Token buckets RPM / RPD / TPM
+=================================================================
+Reemplaza el cooldown fijo de 20 s tras cualquier excepción:
+
+- Cada modelo tiene buckets de peticiones por minuto (RPM), por día (RPD) y
+  tokens por minuto (TPM); un grupo de modelos puede compartir además la
+  cuota de un pool (p. ej. los modelos gratuitos de OpenRouter: 50 RPD en
+  total para la cuenta).
+- acquire() reserva la capacidad antes de llamar: si falta poco espera (cola
+  acotada por max_wait) y si no alcanza devuelve False sin gastar la llamada
+  en un modelo que la va a rechazar.
+- Un 429 abre un cooldown con el Retry-After del proveedor o, si no lo envía,
+  un backoff exponencial desde `rate_limit_cooldown`; otros errores abren un
+  cooldown corto (`error_cooldown`).
+- order() deja fuera los modelos que no pueden responder ahora y manda al
+  final los que casi agotaron su cuota diaria.
+- budget_tiers() resume el margen diario de cada modelo en un nivel (holgado,
+  cupo chico, casi agotado) para que otros criterios de orden, como la salud
+  de model_health, solo reordenen dentro de un mismo nivel.
+
+Los buckets se rellenan de forma continua (RPD = rpd / 86400 por segundo), y
+las cuentas son por proceso: con varios workers cada uno ve una fracción del
+tráfico, por eso conviene configurar las cuotas con margen.
+"""
+
+import re
+import time
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+DAY_SECONDS = 24 * 3600
+LOW_BUDGET_FRACTION = 0.1  # Menos de 10% del RPD disponible: el modelo pasa al final del orden
+SCARCE_DAILY_REQUESTS = 100  # RPD (propio o del pool) menor a esto: cupo chico, va después de los holgados
+
+BUDGET_AMPLE = 0
+BUDGET_SCARCE = 1
+BUDGET_LOW = 2
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimación barata (~4 caracteres por token), la misma que usan los límites de contexto."""
+    return max(1, len(text) // CHARS_PER_TOKEN)
+
+
+class TokenBucket:
+    """Bucket de capacidad `capacity` que se rellena a `rate` unidades por segundo.
+
+    El saldo puede quedar negativo: representa reservas ya concedidas (cola).
+    """
+
+    __slots__ = ('capacity', 'rate', 'level', 'updated_at')
+
+    def __init__(self, capacity: float, period: float):
+        self.capacity = float(capacity)
+        self.rate = self.capacity / period
+        self.level = self.capacity
+        self.updated_at = time.time()
+
+    def _refill(self, now: float):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def wait_time(self, amount: float, now: float) -> float:
+        """Segundos hasta que haya `amount` disponible (inf si supera la capacidad)."""
+        self._refill(now)
+        amount = min(amount, self.capacity)  # Una petición más grande que el bucket espera a que se llene
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) / self.rate if self.rate > 0 else float('inf')
+
+    def take(self, amount: float):
+        self.level -= min(amount, self.capacity)
+
+    def fraction(self, now: float) -> float:
+        self._refill(now)
+        return max(0.0, self.level) / self.capacity
+
+
+class _Quota:
+    """Buckets RPM/RPD/TPM de un modelo o de un pool compartido."""
+
+    __slots__ = ('rpm', 'rpd', 'tpm')
+
+    def __init__(self, limits: Dict):
+        self.rpm = TokenBucket(limits['rpm'], 60) if limits.get('rpm') else None
+        self.rpd = TokenBucket(limits['rpd'], DAY_SECONDS) if limits.get('rpd') else None
+        self.tpm = TokenBucket(limits['tpm'], 60) if limits.get('tpm') else None
+
+    def wait_time(self, tokens: int, now: float) -> float:
+        waits = [0.0]
+        if self.rpm: waits.append(self.rpm.wait_time(1, now))
+        if self.rpd: waits.append(self.rpd.wait_time(1, now))
+        if self.tpm: waits.append(self.tpm.wait_time(tokens, now))
+        return max(waits)
+
+    def take(self, tokens: int):
+        if self.rpm: self.rpm.take(1)
+        if self.rpd: self.rpd.take(1)
+        if self.tpm: self.tpm.take(tokens)
+
+    def daily_fraction(self, now: float) -> float:
+        return self.rpd.fraction(now) if self.rpd else 1.0
+
+
+class ModelScheduler:
+    """Cuotas y cooldowns por modelo; seguro entre hilos."""
+
+    def __init__(self, quotas: Dict[str, Dict], pools: Optional[Dict[str, Dict]] = None,
+                 default_quota: Optional[Dict] = None, rate_limit_cooldown: float = 60,
+                 error_cooldown: float = 20, max_cooldown: float = 15 * 60):
+        self.rate_limit_cooldown = rate_limit_cooldown
+        self.error_cooldown = error_cooldown
+        self.max_cooldown = max_cooldown
+        self._default_quota = default_quota or {}
+        self._quota_config = quotas
+        self._quotas: Dict[str, _Quota] = {}
+        self._model_pool: Dict[str, Optional[str]] = {}
+        self._pools: Dict[str, _Quota] = {name: _Quota(limits) for name, limits in (pools or {}).items()}
+        self._cooldown_until: Dict[str, float] = {}
+        self._strikes: Dict[str, int] = {}
+        self.counters: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def _quota(self, model: str) -> _Quota:
+        quota = self._quotas.get(model)
+        if quota is None:
+            limits = self._quota_config.get(model, self._default_quota)
+            quota = self._quotas[model] = _Quota(limits)
+            self._model_pool[model] = limits.get('pool') if limits.get('pool') in self._pools else None
+            self.counters[model] = {'calls': 0, 'rejected': 0, 'rate_limited': 0, 'errors': 0}
+        return quota
+
+    def _buckets(self, model: str) -> List[_Quota]:
+        quota = self._quota(model)
+        pool = self._model_pool.get(model)
+        return [quota, self._pools[pool]] if pool else [quota]
+
+    def _wait_time(self, model: str, tokens: int, now: float) -> float:
+        cooldown = max(0.0, self._cooldown_until.get(model, 0) - now)
+        return max([cooldown] + [q.wait_time(tokens, now) for q in self._buckets(model)])
+
+    # ------------------------------------------------------------------
+    # Antes de llamar
+    # ------------------------------------------------------------------
+    def acquire(self, model: str, tokens: int = 1, max_wait: float = 0.0) -> bool:
+        """
+        Reserva una petición (y `tokens` de TPM) para `model`. Si la capacidad llega en
+        menos de `max_wait` segundos, espera; si no, devuelve False sin reservar.
+        """
+        with self._lock:
+            now = time.time()
+            wait = self._wait_time(model, tokens, now)
+            if wait > max_wait:
+                self.counters[model]['rejected'] += 1
+                return False
+            for quota in self._buckets(model):
+                quota.take(tokens)
+            self.counters[model]['calls'] += 1
+        if wait > 0:
+            time.sleep(wait)
+        return True
+
+    def _budget(self, model: str, now: float) -> Tuple[int, float]:
+        """(nivel de margen diario, fracción del RPD disponible) del bucket más ajustado."""
+        buckets = self._buckets(model)
+        budget = min(q.daily_fraction(now) for q in buckets)
+        if budget < LOW_BUDGET_FRACTION:
+            return BUDGET_LOW, budget
+        if any(q.rpd and q.rpd.capacity < SCARCE_DAILY_REQUESTS for q in buckets):
+            return BUDGET_SCARCE, budget
+        return BUDGET_AMPLE, budget
+
+    def budget_tiers(self, models: Iterable[str]) -> Dict[str, int]:
+        """Nivel de margen diario por modelo: BUDGET_AMPLE, BUDGET_SCARCE o BUDGET_LOW."""
+        with self._lock:
+            now = time.time()
+            return {model: self._budget(model, now)[0] for model in models}
+
+    def order(self, models: Iterable[str], tokens: Union[int, Dict[str, int]] = 1,
+              max_wait: float = 0.0) -> List[str]:
+        """
+        Modelos que pueden responder dentro de `max_wait`, en el orden de preferencia dado;
+        los que tienen poco presupuesto diario pasan al final (ordenados por presupuesto).
+        `tokens` puede ser un valor por modelo (prompts armados con presupuestos distintos).
+        """
+        ready: List[Tuple[int, float, int, str]] = []
+        with self._lock:
+            now = time.time()
+            for i, model in enumerate(models):
+                needed = tokens.get(model, 1) if isinstance(tokens, dict) else tokens
+                if self._wait_time(model, needed, now) > max_wait:
+                    continue
+                tier, budget = self._budget(model, now)
+                low = tier == BUDGET_LOW
+                ready.append((1 if low else 0, -budget if low else 0.0, i, model))
+        return [model for *_, model in sorted(ready)]
+
+    # ------------------------------------------------------------------
+    # Después de llamar
+    # ------------------------------------------------------------------
+    def report_success(self, model: str):
+        with self._lock:
+            self._strikes.pop(model, None)
+
+    def report_rate_limited(self, model: str, retry_after: Optional[float] = None):
+        """429: cooldown con el Retry-After recibido o backoff exponencial por reincidencia."""
+        with self._lock:
+            self._quota(model)
+            strikes = self._strikes.get(model, 0) + 1
+            self._strikes[model] = strikes
+            delay = retry_after if retry_after is not None else self.rate_limit_cooldown * 2 ** (strikes - 1)
+            delay = min(delay, self.max_cooldown)
+            self._cooldown_until[model] = max(self._cooldown_until.get(model, 0), time.time() + delay)
+            self.counters[model]['rate_limited'] += 1
+        print(f"[ModelScheduler] {model}: límite del proveedor, pausa de {delay:.0f}s")
+
+    def report_error(self, model: str):
+        with self._lock:
+            self._quota(model)
+            self._cooldown_until[model] = max(self._cooldown_until.get(model, 0), time.time() + self.error_cooldown)
+            self.counters[model]['errors'] += 1
+
+    def stats(self) -> Dict:
+        with self._lock:
+            now = time.time()
+            models = {}
+            for model, quota in self._quotas.items():
+                models[model] = dict(self.counters[model],
+                                     cooldown_s=round(max(0.0, self._cooldown_until.get(model, 0) - now), 1),
+                                     rpd_left=round(quota.daily_fraction(now), 3),
+                                     pool=self._model_pool.get(model))
+            pools = {name: {'rpd_left': round(pool.daily_fraction(now), 3)} for name, pool in self._pools.items()}
+            return {'models': models, 'pools': pools}
+
+
+# ============================================================================
+# SEÑALES DE LÍMITE DE LOS PROVEEDORES
+# ============================================================================
+
+_RETRY_PATTERNS = (
+    re.compile(r"retry_delay\s*\{\s*seconds:\s*(\d+)"),       # Gemini (google.api_core)
+    re.compile(r"retry in\s+([\d.]+)\s*s", re.IGNORECASE),    # "Please retry in 37.2s"
+)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """429 / cuota agotada de google.generativeai (ResourceExhausted) u otro cliente."""
+    text = str(error)
+    return (type(error).__name__ in ('ResourceExhausted', 'TooManyRequests')
+            or '429' in text or 'quota' in text.lower())
+
+
+def retry_after_from_error(error: Exception) -> Optional[float]:
+    text = str(error)
+    for pattern in _RETRY_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return float(match.group(1))
+    return None
+
+
+def retry_after_from_headers(headers) -> Optional[float]:
+    """Retry-After (segundos) o X-RateLimit-Reset (epoch en ms, OpenRouter)."""
+    value = headers.get('Retry-After')
+    if value:
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+    reset = headers.get('X-RateLimit-Reset')
+    if reset:
+        try:
+            return max(0.0, float(reset) / 1000 - time.time())
+        except ValueError:
+            pass
+    return None
@@ -0,0 +1,177 @@
+"""
+Cache de Páginas de PDFs - Extracción por página
+================================================
+Guarda el texto extraído de cada página en SQLite, con clave
+(file_id, modified_time, página) y un hash del contenido de la página.
+
+- Al refrescar un PDF modificado, las páginas cuyo hash no cambió se
+  reutilizan sin volver a llamar a extract_text().
+- La recuperación puede cargar páginas bajo demanda (con un LRU pequeño)
+  en lugar de mantener todo el corpus en memoria.
+"""
+
+import os
+import re
+import sqlite3
+import threading
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+PAGE_SEPARATOR = "\n\n"
+PAGE_SPLIT_RE = re.compile(r'(?:^|\n\n)--- Página (\d+) ---\n')
+
+
+def page_marker(page: int) -> str:
+    return f"--- Página {page} ---\n"
+
+
+def assemble_document(pages: Iterable[Tuple[int, str]]) -> str:
+    """Une páginas [(número, texto)] con el formato histórico '--- Página N ---'."""
+    return PAGE_SEPARATOR.join(f"{page_marker(page)}{text}" for page, text in pages if text)
+
+
+def split_document_pages(text: str) -> List[Tuple[int, Optional[str], str]]:
+    """Inverso de assemble_document: [(número, None, texto)] desde un documento ya extraído."""
+    parts = PAGE_SPLIT_RE.split(text)
+    # parts = [prefijo, n1, texto1, n2, texto2, ...]
+    return [(int(parts[i]), None, parts[i + 1]) for i in range(1, len(parts) - 1, 2)]
+
+
+class PageStore:
+    """Almacén SQLite de texto por página con LRU de páginas leídas."""
+
+    def __init__(self, path: str, max_cached_pages: int = 256):
+        self.path = path
+        self.max_cached_pages = max_cached_pages
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[Tuple[str, str, int], Tuple[int, str]]" = OrderedDict()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS pages (
+                file_id TEXT NOT NULL,
+                modified_time TEXT NOT NULL,
+                page INTEGER NOT NULL,
+                content_hash TEXT,
+                doc_offset INTEGER NOT NULL,
+                text TEXT NOT NULL,
+                PRIMARY KEY (file_id, modified_time, page)
+            );
+            CREATE INDEX IF NOT EXISTS idx_pages_hash ON pages (file_id, content_hash);
+        """)
+        self._conn.commit()
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+    def save_document(self, file_id: str, modified_time: str, pages: List[Tuple[int, Optional[str], str]]) -> str:
+        """
+        Guarda las páginas [(número, hash, texto)] de una versión del documento.
+
+        Returns:
+            Texto completo del documento (mismo formato que extract_pdf_text).
+        """
+        rows = []
+        offset = 0
+        for page, content_hash, text in pages:
+            if not text:
+                continue
+            if rows:
+                offset += len(PAGE_SEPARATOR)
+            offset += len(page_marker(page))
+            rows.append((file_id, modified_time or '', page, content_hash, offset, text))
+            offset += len(text)
+        with self._lock:
+            self._conn.execute("DELETE FROM pages WHERE file_id = ? AND modified_time = ?",
+                               (file_id, modified_time or ''))
+            self._conn.executemany("INSERT INTO pages VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+        return assemble_document((page, text) for page, _, text in pages)
+
+    def retain(self, versions: Dict[str, str]):
+        """Conserva solo las versiones {file_id: modified_time} indicadas; borra el resto."""
+        keep = {(fid, mt or '') for fid, mt in versions.items()}
+        with self._lock:
+            stored = self._conn.execute("SELECT DISTINCT file_id, modified_time FROM pages").fetchall()
+            stale = [row for row in stored if tuple(row) not in keep]
+            if stale:
+                self._conn.executemany("DELETE FROM pages WHERE file_id = ? AND modified_time = ?", stale)
+                self._conn.commit()
+                for key in [k for k in self._lru if (k[0], k[1]) not in keep]:
+                    del self._lru[key]
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+    def known_hashes(self, file_id: str) -> Set[str]:
+        """Hashes de páginas ya extraídas de cualquier versión del documento."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT DISTINCT content_hash FROM pages WHERE file_id = ? AND content_hash IS NOT NULL",
+                (file_id,)).fetchall()
+        return {r[0] for r in rows}
+
+    def text_by_hash(self, file_id: str, hashes: Iterable[str]) -> Dict[str, str]:
+        """Texto ya extraído para páginas con esos hashes."""
+        hashes = list(hashes)
+        if not hashes:
+            return {}
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT content_hash, text FROM pages WHERE file_id = ? AND content_hash IN ({','.join('?' * len(hashes))})",
+                [file_id] + hashes).fetchall()
+        return {h: t for h, t in rows}
+
+    def has_document(self, file_id: str, modified_time: str) -> bool:
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM pages WHERE file_id = ? AND modified_time = ? LIMIT 1",
+                                     (file_id, modified_time or '')).fetchone()
+        return row is not None
+
+    def get_page(self, file_id: str, modified_time: str, page: int) -> Optional[Tuple[int, str]]:
+        """
+        Texto de una página bajo demanda.
+
+        Returns:
+            (offset de la página dentro del documento, texto) o None si no existe.
+        """
+        key = (file_id, modified_time or '', page)
+        with self._lock:
+            if key in self._lru:
+                self._lru.move_to_end(key)
+                return self._lru[key]
+            row = self._conn.execute(
+                "SELECT doc_offset, text FROM pages WHERE file_id = ? AND modified_time = ? AND page = ?",
+                key).fetchone()
+            if row is None:
+                return None
+            self._lru[key] = (row[0], row[1])
+            if len(self._lru) > self.max_cached_pages:
+                self._lru.popitem(last=False)
+            return self._lru[key]
+
+    def get_pages(self, file_id: str, modified_time: str) -> Optional[List[Tuple[int, Optional[str], str]]]:
+        """Páginas [(número, hash, texto)] de una versión del documento."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, content_hash, text FROM pages WHERE file_id = ? AND modified_time = ? ORDER BY page",
+                (file_id, modified_time or '')).fetchall()
+        return [tuple(r) for r in rows] or None
+
+    def get_document(self, file_id: str, modified_time: str) -> Optional[str]:
+        """Texto completo de una versión del documento (sin pasar por el LRU)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT page, text FROM pages WHERE file_id = ? AND modified_time = ? ORDER BY page",
+                (file_id, modified_time or '')).fetchall()
+        if not rows:
+            return None
+        return assemble_document(rows)
+
+
+def open_page_store(folder: str, max_cached_pages: int = 256) -> Optional[PageStore]:
+    """Abre (o crea) el almacén de páginas; None si el entorno no lo permite."""
+    try:
+        return PageStore(os.path.join(folder, "pdf_pages.db"), max_cached_pages)
+    except Exception as e:
+        print(f"[PageStore] No disponible ({e}), se mantiene el texto en memoria")
+        return None
@@ -0,0 +1,126 @@
+"""
+Buffer de Pasajes - Ranking sin copias sobre un solo texto
+===========================================================
+Mantiene el corpus como un único string con:
+- una tabla de offsets de pasajes (mismos cortes que text.split('\\n\\n')),
+- una sombra en minúsculas del mismo largo (para contar sin .lower() por pasaje).
+
+El ranking trabaja solo con offsets; únicamente los pasajes seleccionados
+se copian al armar el contexto final. Se construye una vez por versión del
+contenido (ver WebScraper.get_website_buffer).
+"""
+
+from array import array
+from bisect import bisect_right
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+PASSAGE_SEPARATOR = "\n\n"
+
+
+def _shadow_lower(text: str) -> str:
+    """Minúsculas con el mismo largo que `text` (algunos caracteres, como 'İ', crecen al bajar)."""
+    lower = text.lower()
+    if len(lower) == len(text):
+        return lower
+    return ''.join(c if len(c.lower()) != 1 else c.lower() for c in text)
+
+
+class PassageBuffer:
+    """Texto único + offsets de pasajes + sombra en minúsculas."""
+
+    __slots__ = ('text', 'lower', 'starts', 'ends')
+
+    def __init__(self, text: str, separator: str = PASSAGE_SEPARATOR):
+        self.text = text
+        self.lower = _shadow_lower(text)
+        self.starts = array('l')
+        self.ends = array('l')
+        start = 0
+        while True:
+            cut = text.find(separator, start)
+            if cut == -1:
+                self.starts.append(start)
+                self.ends.append(len(text))
+                break
+            self.starts.append(start)
+            self.ends.append(cut)
+            start = cut + len(separator)
+
+    def __len__(self) -> int:
+        return len(self.starts)
+
+    def passage(self, i: int) -> str:
+        """Copia el texto de un pasaje (solo para los seleccionados)."""
+        return self.text[self.starts[i]:self.ends[i]]
+
+    def scores(self, keywords: Iterable[str]) -> Dict[int, int]:
+        """
+        Ocurrencias de las palabras clave por pasaje (como passage.lower().count(kw)).
+        Recorre solo las coincidencias en la sombra; los pasajes sin coincidencias no aparecen.
+        """
+        counts: Dict[int, int] = {}
+        for kw in keywords:
+            if not kw:
+                continue
+            pos = self.lower.find(kw)
+            while pos != -1:
+                i = bisect_right(self.starts, pos) - 1
+                if pos + len(kw) <= self.ends[i]:
+                    counts[i] = counts.get(i, 0) + 1
+                    pos = self.lower.find(kw, pos + len(kw))
+                else:
+                    # Coincidencia que cruza el separador: seguir desde el próximo pasaje
+                    pos = self.lower.find(kw, self.ends[i])
+        return counts
+
+    def best(self, keywords: Iterable[str]) -> Tuple[int, Optional[int]]:
+        """(score, pasaje) del primer pasaje con más coincidencias; (0, None) si no hay."""
+        counts = self.scores(keywords)
+        best_score, best_i = 0, None
+        for i in sorted(counts):
+            if counts[i] > best_score:
+                best_score, best_i = counts[i], i
+        return best_score, best_i
+
+    def select(self, keywords: Iterable[str], max_chars: int, min_chars: int = 50,
+               joiner: str = "\n\n...\n\n") -> str:
+        """
+        Pasajes por score descendente (empates en orden de aparición) hasta llenar
+        max_chars; se detiene en el primero que no entra. Solo copia los elegidos.
+        """
+        return joiner.join(self.ranked(keywords, max_chars, min_chars))
+
+    def ranked(self, keywords: Iterable[str], max_chars: int, min_chars: int = 50) -> List[str]:
+        """Los pasajes que elegiría select(), por separado y en orden de score."""
+        counts = self.scores(keywords)
+        ranked: List[Tuple[int, int]] = [
+            (counts.get(i, 0), i) for i in range(len(self.starts))
+            if self.ends[i] - self.starts[i] >= min_chars
+        ]
+        ranked.sort(key=lambda x: -x[0])
+
+        selected = []
+        used = 0
+        for _, i in ranked:
+            size = self.ends[i] - self.starts[i]
+            if used + size > max_chars:
+                break
+            selected.append(i)
+            used += size
+        return [self.passage(i) for i in selected]
+
+
+def as_passage_buffer(context: Union[str, PassageBuffer, None]) -> Optional[PassageBuffer]:
+    """Acepta un PassageBuffer ya construido o un string (se indexa en el momento)."""
+    if isinstance(context, PassageBuffer):
+        return context
+    if not context:
+        return None
+    return PassageBuffer(context)
+
+
+def context_text(context: Union[str, PassageBuffer, None]) -> str:
+    """Texto completo de un contexto (string o PassageBuffer) sin copiarlo."""
+    if isinstance(context, PassageBuffer):
+        return context.text
+    return context or ""
@@ -0,0 +1,164 @@
+"""
+Armado de Prompts con Presupuesto de Tokens
+===========================================
+Antes _build_prompt recortaba por caracteres (pdf[:25000], web[:8000]) después
+de que generate_response ya había aplicado AI_MAX_PDF_CONTEXT/AI_MAX_WEB_CONTEXT,
+cortando pasajes a la mitad, incrustaba el historial como repr de una lista y
+mandaba el mismo prompt a todos los modelos de la cadena.
+
+build_prompt() llena el presupuesto de tokens de un modelo por prioridad:
+1. Plantilla fija y pregunta (siempre).
+2. Datos verificados (paquete de conocimiento).
+3. Contexto cruzado de las capas 1/2.
+4. Pasajes rankeados de PDFs y web, enteros (se corta en límite de pasaje);
+   la web tiene reservada una parte del espacio para no quedar desplazada.
+5. Historial de la conversación, del mensaje más reciente al más antiguo.
+
+Las secciones 2 y 3 son texto libre: si no entran completas se cortan en
+límite de línea. Los tokens se estiman como en model_scheduler (~4
+caracteres por token), así que el presupuesto se cuenta en caracteres y el
+prompt armado nunca supera `budget_tokens` salvo que la parte fija ya lo haga.
+"""
+
+from typing import Dict, List, Optional, Sequence
+
+from model_scheduler import CHARS_PER_TOKEN, estimate_tokens
+
+PASSAGE_JOINER = "\n\n"
+WEB_JOINER = "\n\n...\n\n"
+
+PROMPT_TEMPLATE = """
+=== ERES ===
+Asistente Virtual IESTP Juan Velasco Alvarado.
+=== FUENTES ===
+{sources}
+=== WEB ===
+{web}
+=== HISTORIAL ===
+{history}
+=== PREGUNTA ===
+{question}
+=== INSTRUCCIÓN ===
+Responde de forma ÚTIL, CLARA y AMABLE.
+Si hay "CONTEXTO DE BÚSQUEDA PREVIO", úsalo para explicar el tema.
+Si piden pasos, usa lista numerada.
+NO devuelvas texto crudo del manual ("Página 7..."). REDACTA la respuesta.
+"""
+
+_HISTORY_ROLES = {'user': 'Usuario', 'assistant': 'Asistente', 'model': 'Asistente', 'bot': 'Asistente'}
+
+
+class PromptSources:
+    """Material del prompt ya seleccionado para la pregunta, sin recortar al presupuesto."""
+
+    __slots__ = ('verified', 'cross', 'passages', 'web_passages')
+
+    def __init__(self, verified: str = "", cross: str = "", passages: Optional[List[str]] = None,
+                 web_passages: Optional[List[str]] = None):
+        self.verified = verified
+        self.cross = f"=== CONTEXTO DE BÚSQUEDA PREVIO ===\n{cross}" if cross else ""
+        # Bloques de pasajes de PDF y pasajes web, cada lista en orden de relevancia
+        self.passages = passages or []
+        self.web_passages = web_passages or []
+
+
+class BuiltPrompt:
+    """Prompt armado y uso del presupuesto (tokens estimados por sección)."""
+
+    __slots__ = ('text', 'tokens', 'budget', 'sections', 'dropped')
+
+    def __init__(self, text: str, budget: int, sections: Dict[str, int], dropped: int):
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self.budget = budget
+        self.sections = sections
+        self.dropped = dropped  # Pasajes y mensajes del historial que no entraron
+
+    def summary(self) -> str:
+        parts = ", ".join(f"{name} {tokens}" for name, tokens in self.sections.items() if tokens)
+        return f"{self.tokens}/{self.budget} tokens ({parts}; {self.dropped} fuera)"
+
+
+def _fit_text(text: str, room: int) -> str:
+    """El texto entero si cabe en `room` caracteres; si no, sus primeras líneas completas."""
+    if len(text) <= room:
+        return text
+    cut = text.rfind("\n", 0, room + 1)
+    return text[:cut].rstrip() if cut > 0 else ""
+
+
+def _fit_pieces(pieces: Sequence[str], room: int, joiner: str, start: int = 0) -> int:
+    """Cuántos elementos (desde `start`, en orden) caben en `room` caracteres; se detiene en el primero que no entra."""
+    used = 0
+    end = start
+    for piece in pieces[start:]:
+        size = len(piece) + (len(joiner) if end else 0)
+        if used + size > room:
+            break
+        used += size
+        end += 1
+    return end - start
+
+
+def _history_line(item) -> str:
+    if isinstance(item, dict):
+        role = str(item.get('role', ''))
+        label = _HISTORY_ROLES.get(role.lower(), role.capitalize() or 'Mensaje')
+        return f"{label}: {item.get('content') or item.get('text') or ''}".strip()
+    if isinstance(item, (list, tuple)) and len(item) == 2:
+        return f"Usuario: {item[0]}\nAsistente: {item[1]}"
+    return str(item).strip()
+
+
+def build_prompt(question: str, sources: PromptSources, history: Optional[list] = None,
+                 budget_tokens: int = 8000, web_share: float = 0.3, max_history: int = 4) -> BuiltPrompt:
+    """
+    Arma el prompt para un modelo con a lo sumo `budget_tokens` tokens estimados.
+
+    web_share: fracción del espacio de pasajes reservada primero para la web; lo que
+        la web no use pasa a los PDFs y lo que sobre de los PDFs vuelve a la web.
+    max_history: mensajes más recientes del historial que se consideran.
+    """
+    base = PROMPT_TEMPLATE.format(sources="", web="", history="", question=question)
+    room = budget_tokens * CHARS_PER_TOKEN - len(base)
+    sections = {'base': estimate_tokens(base), 'verified': 0, 'cross': 0, 'passages': 0, 'web': 0, 'history': 0}
+
+    source_parts: List[str] = []
+    for name in ('verified', 'cross'):
+        text = _fit_text(getattr(sources, name), max(0, room))
+        if text:
+            cost = len(text) + (len(PASSAGE_JOINER) if source_parts else 0)
+            source_parts.append(text)
+            sections[name] = estimate_tokens(text)
+            room -= cost
+
+    # Pasajes: primero la reserva de la web, luego PDFs, y lo que sobre otra vez para la web
+    pdf, web = sources.passages, sources.web_passages
+    joiner_cost = len(PASSAGE_JOINER) if source_parts else 0
+    n_web = _fit_pieces(web, max(0, int(room * web_share)), WEB_JOINER)
+    web_used = len(WEB_JOINER.join(web[:n_web]))
+    n_pdf = _fit_pieces(pdf, max(0, room - web_used - joiner_cost), PASSAGE_JOINER)
+    pdf_used = len(PASSAGE_JOINER.join(pdf[:n_pdf])) + (joiner_cost if n_pdf else 0)
+    n_web += _fit_pieces(web, max(0, room - pdf_used - web_used), WEB_JOINER, start=n_web)
+    source_parts.extend(pdf[:n_pdf])
+    web_text = WEB_JOINER.join(web[:n_web])
+    room -= pdf_used + len(web_text)
+    sections['passages'] = estimate_tokens(PASSAGE_JOINER.join(pdf[:n_pdf])) if n_pdf else 0
+    sections['web'] = estimate_tokens(web_text) if n_web else 0
+
+    # Historial: del más reciente hacia atrás mientras quepa, luego en orden cronológico
+    recent = [line for line in map(_history_line, (history or [])[-max_history:]) if line]
+    kept: List[str] = []
+    for line in reversed(recent):
+        cost = len(line) + (1 if kept else 0)
+        if cost > room:
+            break
+        kept.append(line)
+        room -= cost
+    history_text = "\n".join(reversed(kept))
+    sections['history'] = estimate_tokens(history_text) if kept else 0
+
+    text = PROMPT_TEMPLATE.format(sources=PASSAGE_JOINER.join(source_parts), web=web_text,
+                                  history=history_text, question=question)
+    dropped = (len(pdf) - n_pdf) + (len(web) - n_web) + (len(recent) - len(kept))
+    return BuiltPrompt(text, budget_tokens, sections, dropped)
@@ -0,0 +1,49 @@
+"""
+Análisis de Consulta - Una sola pasada por mensaje
+==================================================
+Normaliza, tokeniza y escanea las palabras clave del mensaje del usuario una
+única vez por request. El resultado (QueryAnalysis) lo reutilizan el ruteo de
+SmartResponse, AIManager (clasificación, cache, contexto verificado) y el
+registro de consultas en app.py, en lugar de recalcularlo cada uno.
+
+También fija el paquete de conocimiento vigente: todo el request usa la
+misma revisión aunque haya una recarga en caliente a mitad de camino.
+"""
+
+import re
+from typing import List, Optional
+
+from keywords import KeywordHits, fold_accents
+from response_cache import canonical_query
+from knowledge_pack import KnowledgePack, get_knowledge_pack
+
+_PUNCT_RE = re.compile(r'[^\w\s]')
+_SPACES_RE = re.compile(r'\s+')
+
+
+class QueryAnalysis:
+    """Mensaje del usuario ya normalizado, tokenizado y clasificado."""
+
+    __slots__ = ('text', 'lower', 'normalized', 'cache_key', 'canonical', 'words', 'lower_words', 'pack', 'hits',
+                 'is_complex', 'query_class', 'log_query_type')
+
+    def __init__(self, text: str, pack: Optional[KnowledgePack] = None):
+        self.text: str = text
+        self.lower: str = text.lower()
+        # Minúsculas sin tildes (mismo resultado que keywords.normalize_text)
+        self.normalized: str = fold_accents(self.lower.strip())
+        # Clave del cache de respuestas: sin puntuación y con espacios colapsados
+        self.cache_key: str = _SPACES_RE.sub(' ', _PUNCT_RE.sub('', self.lower).strip())
+        # Forma canónica para el nivel de casi duplicados (se deriva de cache_key, igual que al guardar)
+        self.canonical: str = canonical_query(self.cache_key)
+        self.words: List[str] = self.normalized.split()
+        self.lower_words: List[str] = self.lower.split()
+        self.pack: KnowledgePack = pack or get_knowledge_pack()
+        self.hits: KeywordHits = self.pack.scanner.scan(self.normalized)
+        self.is_complex: bool = self.hits.is_complex
+        self.query_class: str = self.hits.query_class
+        self.log_query_type: str = self.hits.log_query_type
+
+
+def analyze_query(text: str, pack: Optional[KnowledgePack] = None) -> QueryAnalysis:
+    return QueryAnalysis(text, pack)
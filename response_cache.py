@@ -0,0 +1,436 @@
+"""
+Cache de Respuestas IA - Nivel exacto + casi duplicados
+======================================================
+Nivel 1: clave exacta (cache_key de QueryAnalysis: minúsculas, sin puntuación).
+Nivel 2: forma canónica de la consulta (sin tildes, sin stopwords, conjunto de
+tokens ordenado) y, si no coincide, similitud entre conjuntos de tokens contra
+un índice invertido de las consultas ya cacheadas.
+
+    "cuanto cuesta la matricula"  ->  "cuanto cuesta matricula"
+    "cuánto cuesta matrícula?"    ->  "cuanto cuesta matricula"   (casi duplicado)
+
+La similitud es |tokens emparejados| / |unión| (Jaccard); dos tokens se
+emparejan si son iguales o, desde 4 letras, si difieren solo por una errata
+(SequenceMatcher >= token_ratio). Con el umbral por defecto (0.85) basta un
+token de contenido distinto en consultas cortas para que NO haya coincidencia.
+near_threshold=None desactiva el nivel 2.
+
+Política de retención:
+- Cada entrada está ligada a la versión del contenido (PDFs + web + paquete de
+  conocimiento): al refrescarse el contenido, las respuestas viejas dejan de
+  coincidir y salen por LRU/TTL.
+- LRU real: un hit renueva la recencia; se descarta la menos usada cuando los
+  textos en memoria superan max_bytes.
+- TTL por entrada (ttl segundos desde que se guardó).
+
+La persistencia es opcional (ResponseStore en response_store.py): con store,
+los textos se leen por clave (la memoria queda como LRU de lectura), el
+índice se arma bajo demanda y el disco tiene su propio presupuesto en bytes.
+"""
+
+import re
+import time
+import heapq
+import threading
+from collections import OrderedDict
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Dict, List, Optional, Sequence, Set, Tuple
+
+from keywords import normalize_text
+from response_store import UNVERSIONED
+
+# Palabras sin contenido (ya sin tildes). Los interrogativos (cuanto, cuando, donde,
+# como, quien) y los verbos de explicación se conservan: cambian la respuesta.
+AI_CACHE_STOPWORDS = frozenset({
+    "el", "la", "los", "las", "lo", "un", "una", "unos", "unas",
+    "de", "del", "al", "a", "en", "y", "e", "o", "u", "que", "por", "para", "con", "sobre", "acerca",
+    "se", "me", "mi", "mis", "te", "tu", "tus", "su", "sus", "le", "les", "nos",
+    "es", "son", "hay", "esta", "este", "esto", "estos", "estas",
+    "hola", "favor", "quisiera", "quiero", "gustaria", "podrias", "puedes", "saber",
+})
+
+_TOKEN_RE = re.compile(r'\w+')
+
+# Mantenimiento del store fuera del camino de cada respuesta: los vencidos se purgan cada
+# STORE_PURGE_INTERVAL segundos y, al pasar el presupuesto, se descarta hasta STORE_TRIM_TARGET
+# del presupuesto (margen para que no haya un descarte por cada escritura)
+STORE_PURGE_INTERVAL = 60.0
+STORE_TRIM_TARGET = 0.9
+# Los hits no escriben en SQLite: los accesos se juntan en memoria y se vuelcan en una sola
+# transacción al llegar a STORE_TOUCH_BATCH o en el mantenimiento (antes de descartar por LRU)
+STORE_TOUCH_BATCH = 64
+
+
+def canonical_query(text: str) -> str:
+    """Forma canónica: sin tildes ni stopwords, tokens únicos ordenados."""
+    tokens = {t for t in _TOKEN_RE.findall(normalize_text(text)) if t not in AI_CACHE_STOPWORDS}
+    return " ".join(sorted(tokens))
+
+
+@lru_cache(maxsize=65536)
+def _is_typo(token: str, other: str, token_ratio: float) -> bool:
+    """Dos tokens distintos de 4+ letras que difieren solo por una errata (memoizado por par)."""
+    matcher = SequenceMatcher(None, token, other)
+    return matcher.real_quick_ratio() >= token_ratio and matcher.ratio() >= token_ratio
+
+
+def token_set_similarity(a: Sequence[str], b: Sequence[str], token_ratio: float = 0.85,
+                         minimum: float = 0.0) -> float:
+    """
+    Jaccard entre conjuntos de tokens, emparejando erratas (tokens de 4+ letras).
+    Devuelve 0.0 sin comparar erratas si ni emparejándolas todas se llega a `minimum`.
+    """
+    if not a or not b:
+        return 0.0
+    pending = set(b)
+    matched = 0
+    fuzzy = []
+    for token in a:
+        if token in pending:
+            pending.discard(token)
+            matched += 1
+        elif len(token) >= 4:
+            fuzzy.append(token)
+    best_case = matched + min(len(fuzzy), len(pending))
+    if best_case / (len(a) + len(b) - best_case) < minimum:
+        return 0.0
+    for token in fuzzy:
+        for other in pending:
+            if len(other) >= 4 and _is_typo(token, other, token_ratio):
+                pending.discard(other)
+                matched += 1
+                break
+    return matched / (len(a) + len(b) - matched)
+
+
+def _entry_size(key: str, response: str) -> int:
+    return len(key.encode('utf-8')) + len(response.encode('utf-8'))
+
+
+class _Entry:
+    __slots__ = ('response', 'size', 'expires_at')
+
+    def __init__(self, response: str, size: int, expires_at: float):
+        self.response = response
+        self.size = size
+        self.expires_at = expires_at
+
+
+class ResponseCache:
+    """Respuestas IA por (versión de contenido, clave exacta), con búsqueda de casi duplicados.
+
+    Con `store` (ResponseStore) las respuestas persisten fila a fila en SQLite y se
+    leen bajo demanda; sin él todo vive en memoria.
+    """
+
+    def __init__(self, entries: Optional[Dict[str, str]] = None, max_bytes: int = 8 * 1024 * 1024,
+                 ttl: float = 24 * 3600, near_threshold: Optional[float] = 0.85, token_ratio: float = 0.85,
+                 max_candidates: int = 32, store=None, store_max_bytes: int = 64 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.near_threshold = near_threshold
+        self.token_ratio = token_ratio
+        self.max_candidates = max_candidates
+        self.store = store
+        self.store_max_bytes = store_max_bytes
+
+        # (versión, clave) -> texto; orden = recencia (el primero es el menos usado)
+        self._bodies: "OrderedDict[Tuple[str, str], _Entry]" = OrderedDict()
+        self._bytes = 0
+        self._canonical_of: Dict[Tuple[str, str], str] = {}               # (versión, clave) -> forma canónica
+        self._keys_by_form: Dict[Tuple[str, str], List[str]] = {}          # (versión, forma) -> claves (última = más reciente)
+        self._postings: Dict[str, Set[Tuple[str, str]]] = {}               # token -> (versión, forma) que lo contienen
+        self._sizes: Dict[Tuple[str, str], int] = {}                       # (versión, forma) -> cantidad de tokens
+        self._last_rowid = 0                                               # última fila del store ya indexada
+        self._adopted = False
+        self._next_purge = 0.0
+        self._touched: Dict[Tuple[str, str], float] = {}                  # accesos aún no volcados al store
+        self._touch_hits = 0                                               # hits desde el último volcado
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        # Respuestas importadas (JSON): sin versión hasta que llega la primera versión real
+        expires_at = time.time() + ttl
+        if store is not None:
+            if entries and store.count() == 0:
+                store.put_many((UNVERSIONED, key, canonical_query(key), response, _entry_size(key, response), expires_at)
+                               for key, response in entries.items())
+        else:
+            for key, response in (entries or {}).items():
+                self._cache_body((UNVERSIONED, key), response, expires_at)
+                self._index_add((UNVERSIONED, key), canonical_query(key))
+
+    def __len__(self) -> int:
+        if self.store is not None:
+            return self.store.count()
+        return len(self._bodies)
+
+    # ------------------------------------------------------------------
+    # Textos en memoria (LRU por bytes)
+    # ------------------------------------------------------------------
+    def _cache_body(self, vkey: Tuple[str, str], response: str, expires_at: float):
+        """Guarda/renueva un texto y descarta los menos usados sobre max_bytes (llamar con el lock)."""
+        old = self._bodies.pop(vkey, None)
+        if old is not None:
+            self._bytes -= old.size
+        entry = _Entry(response, _entry_size(vkey[1], response), expires_at)
+        self._bodies[vkey] = entry
+        self._bytes += entry.size
+        while self._bytes > self.max_bytes and self._bodies:
+            victim, _ = next(iter(self._bodies.items()))
+            self._drop_body(victim)
+            self.evictions += 1
+            if self.store is None:
+                # Sin store el texto en memoria es la única copia
+                self._index_remove(victim)
+
+    def _drop_body(self, vkey: Tuple[str, str]):
+        entry = self._bodies.pop(vkey, None)
+        if entry is not None:
+            self._bytes -= entry.size
+
+    def _body(self, vkey: Tuple[str, str]) -> Optional[str]:
+        """Texto vigente (memoria o store); los vencidos se borran y cuentan como ausentes."""
+        now = time.time()
+        with self._lock:
+            entry = self._bodies.get(vkey)
+            if entry is not None:
+                if entry.expires_at > now:
+                    self._bodies.move_to_end(vkey)
+                    return entry.response
+                self._index_remove(vkey)
+                self.expirations += 1
+        if self.store is None:
+            return None
+        row = self.store.get(*vkey)
+        if row is None:
+            return None
+        response, expires_at = row
+        if expires_at <= now:
+            self.store.delete([vkey])
+            with self._lock:
+                self._index_remove(vkey)
+                self.expirations += 1
+            return None
+        with self._lock:
+            self._cache_body(vkey, response, expires_at)
+        return response
+
+    # ------------------------------------------------------------------
+    # Índice
+    # ------------------------------------------------------------------
+    def _index_add(self, vkey: Tuple[str, str], canonical: str):
+        if vkey in self._canonical_of:
+            return
+        self._canonical_of[vkey] = canonical
+        form = (vkey[0], canonical)
+        keys = self._keys_by_form.setdefault(form, [])
+        keys.append(vkey[1])
+        if len(keys) == 1:
+            tokens = canonical.split()
+            self._sizes[form] = len(tokens)
+            for token in tokens:
+                self._postings.setdefault(token, set()).add(form)
+
+    def _index_remove(self, vkey: Tuple[str, str]):
+        self._drop_body(vkey)
+        canonical = self._canonical_of.pop(vkey, None)
+        if canonical is None:
+            return
+        form = (vkey[0], canonical)
+        keys = self._keys_by_form.get(form, [])
+        if vkey[1] in keys:
+            keys.remove(vkey[1])
+        if not keys:
+            self._keys_by_form.pop(form, None)
+            self._sizes.pop(form, None)
+            for token in canonical.split():
+                forms = self._postings.get(token)
+                if forms is not None:
+                    forms.discard(form)
+                    if not forms:
+                        del self._postings[token]
+
+    def _sync_index(self):
+        """Agrega al índice las filas nuevas del store (propias o de otros workers)."""
+        if self.store is None:
+            return
+        rows = self.store.index_since(self._last_rowid)
+        if not rows:
+            return
+        with self._lock:
+            for rowid, version, key, canonical in rows:
+                self._index_add((version, key), canonical)
+                self._last_rowid = max(self._last_rowid, rowid)
+
+    def _adopt(self, version: str):
+        """Liga las respuestas importadas sin versión a la primera versión de contenido vista."""
+        if self._adopted or version == UNVERSIONED:
+            return
+        self._adopted = True
+        if self.store is not None:
+            if self.store.adopt(version):
+                # Las filas cambiaron de versión: el índice se relee completo
+                with self._lock:
+                    for vkey in [k for k in self._canonical_of if k[0] == UNVERSIONED]:
+                        self._index_remove(vkey)
+                    self._last_rowid = 0
+            return
+        with self._lock:
+            for vkey in [k for k in self._canonical_of if k[0] == UNVERSIONED]:
+                entry = self._bodies.get(vkey)
+                canonical = self._canonical_of[vkey]
+                self._index_remove(vkey)
+                if entry is not None and (version, vkey[1]) not in self._canonical_of:
+                    self._cache_body((version, vkey[1]), entry.response, entry.expires_at)
+                    self._index_add((version, vkey[1]), canonical)
+
+    def _find_near(self, version: str, canonical: str) -> Optional[str]:
+        """Clave cacheada (de la misma versión) más parecida (>= near_threshold) o None."""
+        if (version, canonical) in self._keys_by_form:
+            return self._keys_by_form[(version, canonical)][-1]
+        tokens = canonical.split()
+        if not tokens:
+            return None
+
+        shared: Dict[Tuple[str, str], int] = {}
+        for token in tokens:
+            for form in self._postings.get(token, ()):
+                if form[0] == version:
+                    shared[form] = shared.get(form, 0) + 1
+        n = len(tokens)
+        sizes = self._sizes
+        # Cota: Jaccard <= min(|A|, |B|) / max(|A|, |B|)
+        ranked = heapq.nlargest(
+            self.max_candidates,
+            (form for form in shared
+             if min(n, sizes[form]) >= self.near_threshold * max(n, sizes[form])),
+            key=shared.__getitem__)
+
+        best_form, best_score = None, self.near_threshold
+        for form in ranked:
+            score = token_set_similarity(tokens, form[1].split(), self.token_ratio, best_score)
+            if score >= best_score:
+                best_form, best_score = form, score
+                if score == 1.0:
+                    break
+        return self._keys_by_form[best_form][-1] if best_form is not None else None
+
+    # ------------------------------------------------------------------
+    # API
+    # ------------------------------------------------------------------
+    def _count(self, counter: str):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _touch(self, vkey: Tuple[str, str]):
+        if self.store is None:
+            return
+        with self._lock:
+            self._touched[vkey] = time.time()
+            self._touch_hits += 1
+            full = self._touch_hits >= STORE_TOUCH_BATCH
+        if full:
+            self._flush_touches()
+
+    def _flush_touches(self):
+        """Vuelca al store los accesos juntados por _touch()."""
+        with self._lock:
+            touched, self._touched = self._touched, {}
+            self._touch_hits = 0
+        self.store.touch_many((at, version, key) for (version, key), at in touched.items())
+
+    def lookup(self, key: str, canonical: Optional[str] = None,
+               version: str = UNVERSIONED) -> Tuple[Optional[str], Optional[str]]:
+        """
+        Returns:
+            (respuesta, clave cacheada que coincidió) — la clave difiere de `key` en un casi duplicado.
+        """
+        self._adopt(version)
+        response = self._body((version, key))
+        if response is not None:
+            self._count('hits')
+            self._touch((version, key))
+            return response, key
+
+        if self.near_threshold is not None:
+            self._sync_index()
+            with self._lock:
+                near_key = self._find_near(version, canonical if canonical is not None else canonical_query(key))
+            if near_key is not None:
+                response = self._body((version, near_key))
+                if response is not None:
+                    self._count('near_hits')
+                    self._touch((version, near_key))
+                    return response, near_key
+                # Vencida o borrada por otro worker
+                with self._lock:
+                    self._index_remove((version, near_key))
+
+        self._count('misses')
+        return None, None
+
+    def put(self, key: str, response: str, canonical: Optional[str] = None, version: str = UNVERSIONED):
+        self._adopt(version)
+        canonical = canonical if canonical is not None else canonical_query(key)
+        expires_at = time.time() + self.ttl
+        vkey = (version, key)
+        if self.store is not None:
+            self.store.put(version, key, canonical, response, _entry_size(key, response), expires_at)
+            removed = self._maintain_store()
+            with self._lock:
+                for stale in removed:
+                    self._index_remove(stale)
+            self._sync_index()
+        with self._lock:
+            self._cache_body(vkey, response, expires_at)
+            if self.store is None:
+                self._index_add(vkey, canonical)
+
+    def _maintain_store(self) -> List[Tuple[str, str]]:
+        """Purga periódica de vencidos y descarte LRU solo si el total (contador O(1)) pasó el presupuesto."""
+        expired: List[Tuple[str, str]] = []
+        evicted: List[Tuple[str, str]] = []
+        now = time.time()
+        self._flush_touches()
+        if now >= self._next_purge:
+            self._next_purge = now + STORE_PURGE_INTERVAL
+            expired = self.store.purge_expired(now)
+        if self.store.total_bytes() > self.store_max_bytes:
+            evicted = self.store.trim(int(self.store_max_bytes * STORE_TRIM_TARGET))
+        with self._lock:
+            self.expirations += len(expired)
+            self.evictions += len(evicted)
+        return expired + evicted
+
+    def to_dict(self) -> Dict[str, str]:
+        if self.store is not None:
+            return self.store.to_dict()
+        with self._lock:
+            return {key: entry.response for (_, key), entry in self._bodies.items()}
+
+    def stats(self) -> Dict:
+        entries = len(self)
+        store_bytes = self.store.total_bytes() if self.store is not None else None
+        with self._lock:
+            lookups = self.hits + self.near_hits + self.misses
+            return {
+                'entries': entries,
+                'backend': 'sqlite' if self.store is not None else 'memory',
+                'memory_bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'store_bytes': store_bytes,
+                'ttl_s': self.ttl,
+                'hits': self.hits,
+                'near_hits': self.near_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'hit_rate': round((self.hits + self.near_hits) / lookups, 3) if lookups else 0.0,
+            }
@@ -0,0 +1,211 @@
+"""
+Almacén Persistente de Respuestas IA - SQLite en modo WAL
+=========================================================
+Reemplaza la reescritura completa de ai_response_cache.json en cada respuesta:
+
+- Cada respuesta nueva es un UPSERT de una sola fila.
+- Modo WAL: varios workers leen mientras otro escribe; las escrituras
+  concurrentes esperan (busy_timeout) en lugar de fallar.
+- Nada se carga al iniciar: las respuestas se leen por clave y el índice de
+  formas canónicas (sin los textos) se lee la primera vez que se necesita y
+  luego solo las filas nuevas (rowid creciente).
+
+Cada fila está ligada a la versión del contenido (PDFs + web + conocimiento)
+con la que se generó, vence en `expires_at` y registra su último acceso para
+descartar primero las menos usadas cuando se supera el presupuesto en bytes.
+
+El total de bytes se lleva en `responses_meta` con triggers (misma transacción
+que cada escritura), así que consultarlo no recorre la tabla; el vencimiento y
+el descarte LRU recorren índices (`expires_at`, `(accessed_at, size)`) sin leer
+el texto de las respuestas.
+"""
+
+import os
+import time
+import sqlite3
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+RESPONSE_STORE_FILENAME = "ai_responses.db"
+
+TRIM_DELETE_BATCH = 500  # rowids por DELETE ... IN (...) (bajo el límite de parámetros de SQLite viejos)
+
+# Versión asignada a las respuestas importadas del JSON (se adoptan con la primera versión real)
+UNVERSIONED = ""
+
+
+class ResponseStore:
+    """Tabla `responses` ((versión, clave) -> forma canónica + respuesta) con una conexión por hilo."""
+
+    def __init__(self, path: str, busy_timeout: float = 5.0):
+        self.path = path
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute("PRAGMA journal_mode=WAL")
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(responses)")}
+        if columns and 'version' not in columns:
+            # Esquema sin versión/TTL: respuestas no ligadas a ningún corpus, se descartan
+            print("[ResponseStore] Esquema anterior sin versión de contenido, se recrea la tabla")
+            conn.execute("DROP TABLE responses")
+            conn.execute("DROP TABLE IF EXISTS responses_meta")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS responses (
+                version TEXT NOT NULL,
+                key TEXT NOT NULL,
+                canonical TEXT NOT NULL,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL,
+                expires_at REAL NOT NULL,
+                PRIMARY KEY (version, key)
+            );
+            DROP INDEX IF EXISTS idx_responses_accessed;
+            -- Cubre el recorrido LRU de trim() (rowid va implícito en el índice)
+            CREATE INDEX IF NOT EXISTS idx_responses_lru ON responses (accessed_at, size);
+            CREATE INDEX IF NOT EXISTS idx_responses_expires ON responses (expires_at);
+
+            CREATE TABLE IF NOT EXISTS responses_meta (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+            CREATE TRIGGER IF NOT EXISTS responses_bytes_insert AFTER INSERT ON responses BEGIN
+                UPDATE responses_meta SET value = value + new.size WHERE name = 'bytes';
+            END;
+            CREATE TRIGGER IF NOT EXISTS responses_bytes_delete AFTER DELETE ON responses BEGIN
+                UPDATE responses_meta SET value = value - old.size WHERE name = 'bytes';
+            END;
+            CREATE TRIGGER IF NOT EXISTS responses_bytes_update AFTER UPDATE OF size ON responses BEGIN
+                UPDATE responses_meta SET value = value + new.size - old.size WHERE name = 'bytes';
+            END;
+        """)
+        # Total inicial (una sola vez por base): las escrituras posteriores lo mantienen los triggers
+        with conn:
+            conn.execute("INSERT OR IGNORE INTO responses_meta "
+                         "SELECT 'bytes', COALESCE(SUM(size), 0) FROM responses")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout)
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    # ------------------------------------------------------------------
+    # Escritura
+    # ------------------------------------------------------------------
+    def put(self, version: str, key: str, canonical: str, response: str, size: int, expires_at: float):
+        """UPSERT de una fila (la clave conserva su rowid si ya existía)."""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.execute(
+                "INSERT INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(version, key) DO UPDATE SET response = excluded.response, size = excluded.size, "
+                "accessed_at = excluded.accessed_at, expires_at = excluded.expires_at",
+                (version, key, canonical, response, size, now, now, expires_at))
+
+    def put_many(self, rows: Iterable[Tuple[str, str, str, str, int, float]]):
+        """Carga inicial [(versión, clave, forma canónica, respuesta, bytes, vence)] en una sola transacción."""
+        now = time.time()
+        conn = self._conn()
+        with conn:
+            conn.executemany("INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                             [(v, k, c, r, size, now, now, exp) for v, k, c, r, size, exp in rows])
+
+    def touch_many(self, accesses: Iterable[Tuple[float, str, str]]):
+        """Registra accesos [(instante, versión, clave)] en una sola transacción (recencia para el LRU)."""
+        accesses = list(accesses)
+        if not accesses:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("UPDATE responses SET accessed_at = MAX(accessed_at, ?) WHERE version = ? AND key = ?",
+                             accesses)
+
+    def delete(self, items: Iterable[Tuple[str, str]]):
+        items = list(items)
+        if not items:
+            return
+        conn = self._conn()
+        with conn:
+            conn.executemany("DELETE FROM responses WHERE version = ? AND key = ?", items)
+
+    def adopt(self, version: str) -> int:
+        """Liga a `version` las filas importadas sin versión. Devuelve cuántas se adoptaron."""
+        conn = self._conn()
+        with conn:
+            adopted = conn.execute("UPDATE OR IGNORE responses SET version = ? WHERE version = ?",
+                                   (version, UNVERSIONED)).rowcount
+            conn.execute("DELETE FROM responses WHERE version = ?", (UNVERSIONED,))
+        return adopted
+
+    def purge_expired(self, now: Optional[float] = None) -> List[Tuple[str, str]]:
+        """Borra las filas vencidas (vía índice de expires_at); devuelve sus (versión, clave)."""
+        now = now if now is not None else time.time()
+        conn = self._conn()
+        with conn:
+            expired = conn.execute("SELECT rowid, version, key FROM responses WHERE expires_at <= ?",
+                                   (now,)).fetchall()
+            if expired:
+                conn.executemany("DELETE FROM responses WHERE rowid = ?", [(row[0],) for row in expired])
+        return [(version, key) for _, version, key in expired]
+
+    def trim(self, max_bytes: int) -> List[Tuple[str, str]]:
+        """Descarta las filas con acceso más antiguo hasta quedar dentro de `max_bytes`."""
+        conn = self._conn()
+        with conn:
+            total = self._total(conn)
+            if total <= max_bytes:
+                return []
+            victims = []
+            # En orden LRU por el índice (accessed_at, size); version/key se leen de la fila, no el texto
+            for rowid, version, key, size in conn.execute(
+                    "SELECT rowid, version, key, size FROM responses ORDER BY accessed_at"):
+                if total <= max_bytes:
+                    break
+                victims.append((rowid, version, key))
+                total -= size
+            # Sin DELETE ... RETURNING (SQLite >= 3.35): se borra por rowid en tandas
+            for i in range(0, len(victims), TRIM_DELETE_BATCH):
+                batch = [rowid for rowid, _, _ in victims[i:i + TRIM_DELETE_BATCH]]
+                conn.execute(f"DELETE FROM responses WHERE rowid IN ({','.join('?' * len(batch))})", batch)
+        return [(version, key) for _, version, key in victims]
+
+    # ------------------------------------------------------------------
+    # Lectura
+    # ------------------------------------------------------------------
+    def count(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    @staticmethod
+    def _total(conn: sqlite3.Connection) -> int:
+        row = conn.execute("SELECT value FROM responses_meta WHERE name = 'bytes'").fetchone()
+        return row[0] if row else 0
+
+    def total_bytes(self) -> int:
+        """Bytes almacenados (contador mantenido por triggers, O(1))."""
+        return self._total(self._conn())
+
+    def get(self, version: str, key: str) -> Optional[Tuple[str, float]]:
+        """(respuesta, vence) o None."""
+        row = self._conn().execute("SELECT response, expires_at FROM responses WHERE version = ? AND key = ?",
+                                   (version, key)).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def index_since(self, rowid: int) -> List[Tuple[int, str, str, str]]:
+        """Filas [(rowid, versión, clave, forma canónica)] agregadas después de `rowid` (sin el texto)."""
+        return self._conn().execute(
+            "SELECT rowid, version, key, canonical FROM responses WHERE rowid > ? ORDER BY rowid", (rowid,)).fetchall()
+
+    def to_dict(self) -> Dict[str, str]:
+        return dict(self._conn().execute("SELECT key, response FROM responses ORDER BY accessed_at").fetchall())
+
+
+def open_response_store(folder: str) -> Optional[ResponseStore]:
+    """Abre (o crea) el almacén de respuestas; None si el entorno no lo permite."""
+    try:
+        os.makedirs(folder, exist_ok=True)
+        return ResponseStore(os.path.join(folder, RESPONSE_STORE_FILENAME))
+    except Exception as e:
+        print(f"[ResponseStore] No disponible ({e}), el cache de respuestas queda en memoria")
+        return None
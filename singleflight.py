@@ -0,0 +1,131 @@
+"""
+Coalescencia de Peticiones en Vuelo (singleflight)
+==================================================
+Cuando muchos estudiantes hacen la misma pregunta a la vez (un anuncio, una
+fecha límite), todos fallan el cache antes de que la primera respuesta llegue
+a guardarse y cada uno dispara su propia llamada al modelo.
+
+SingleFlight agrupa las llamadas por clave: la primera (líder) ejecuta la
+generación y las que llegan mientras está en vuelo (seguidoras) esperan y
+reciben el mismo resultado. Si el líder transmite por fragmentos (SSE), las
+seguidoras pueden recibirlos en vivo con follow(). La clave se libera al
+terminar el líder, así que no retiene resultados: eso es trabajo del cache
+de respuestas.
+"""
+
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+
+class Flight:
+    """Una generación en curso: fragmentos publicados y resultado (o excepción) final."""
+
+    __slots__ = ('cond', 'chunks', 'finished', 'result', 'error', 'followers')
+
+    def __init__(self):
+        self.cond = threading.Condition()
+        self.chunks: List[str] = []
+        self.finished = False
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """Registro de generaciones en vuelo por clave; seguro entre hilos."""
+
+    def __init__(self):
+        self._flights: Dict[Hashable, Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.shared = 0
+
+    def join(self, key: Hashable) -> Tuple[Flight, bool]:
+        """(vuelo, es_líder). El líder debe llamar a land() siempre, incluso si falla."""
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.shared += 1
+                return flight, False
+            flight = self._flights[key] = Flight()
+            self.leaders += 1
+            return flight, True
+
+    @staticmethod
+    def publish(flight: Flight, chunk: str):
+        """El líder comparte un fragmento ya generado."""
+        with flight.cond:
+            flight.chunks.append(chunk)
+            flight.cond.notify_all()
+
+    def land(self, key: Hashable, flight: Flight, result: Any = None, error: Optional[BaseException] = None):
+        """Publica el resultado del líder y libera la clave."""
+        with self._lock:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        with flight.cond:
+            flight.result = result
+            flight.error = error
+            flight.finished = True
+            flight.cond.notify_all()
+
+    @staticmethod
+    def wait(flight: Flight, timeout: Optional[float] = None) -> Any:
+        """
+        Resultado del líder (re-lanza su excepción).
+
+        Raises:
+            TimeoutError: el líder no terminó dentro de `timeout`.
+        """
+        with flight.cond:
+            if not flight.cond.wait_for(lambda: flight.finished, timeout):
+                raise TimeoutError("la generación compartida no terminó a tiempo")
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    @staticmethod
+    def follow(flight: Flight, timeout: Optional[float] = None) -> Iterator[str]:
+        """
+        Fragmentos del líder a medida que los publica (los ya publicados primero).
+        Si el líder no transmitía, al terminar entrega su resultado como un solo fragmento.
+
+        Raises:
+            TimeoutError: el líder no terminó dentro de `timeout` (contado desde la primera
+                espera); los fragmentos ya entregados quedan entregados.
+        """
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+        sent = 0
+        while True:
+            with flight.cond:
+                remaining = max(0.0, expires_at - time.monotonic()) if expires_at is not None else None
+                if not flight.cond.wait_for(lambda: flight.finished or len(flight.chunks) > sent, remaining):
+                    raise TimeoutError("la generación compartida no terminó a tiempo")
+                pending = flight.chunks[sent:]
+                finished = flight.finished
+            for chunk in pending:
+                yield chunk
+            sent += len(pending)
+            if finished:
+                if sent == 0 and flight.error is None and flight.result:
+                    yield flight.result
+                return
+
+    def do(self, key: Hashable, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """Ejecuta fn() una sola vez por clave en vuelo. Devuelve (resultado, compartido)."""
+        flight, leader = self.join(key)
+        if not leader:
+            return self.wait(flight, timeout), True
+        try:
+            result = fn()
+        except BaseException as e:
+            self.land(key, flight, error=e)
+            raise
+        self.land(key, flight, result)
+        return result, False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {'in_flight': len(self._flights), 'leaders': self.leaders, 'shared': self.shared}
@@ -6,282 +6,155 @@ mientras se mantiene la capacidad V7 de explicar procesos complejos con IA.
 """
 
 import time
-from difflib import SequenceMatcher
 from functools import lru_cache
 from ai_manager import get_ai_manager
+from passage_buffer import as_passage_buffer
+from keywords import normalize_text
+from query_analysis import analyze_query
+from knowledge_pack import get_knowledge_pack
+from deadline import Deadline
+from config import AI_MIN_MODEL_TIME
 
 # ============================================================================
 # 1. BASE DE CONOCIMIENTO (FAQ)
 # ============================================================================
-
-FAQ = {
-    # Proceso de Matrícula (Redactado)
-    "proceso matricula": ("Manual de Proceso de Matrícula (Paso a Paso):\n\n"
-                          "1. REALIZAR PAGO: S/. 200.00 en Banco de la Nación (Cta. 0000289051) o Agentes Multired.\n"
-                          "2. CANJEAR VOUCHER: Acercarse a Tesorería del Instituto para canjear el voucher por el Recibo de Ingreso.\n"
-                          "3. REGISTRO ACADÉMICO: Ir a Secretaría Académica con el Recibo y DNI para validar datos.\n"
-                          "4. FICHA DE MATRÍCULA: Recibir y firmar la Ficha de Matrícula generada por el sistema.\n"
-                          "5. CONFIRMACIÓN: Se te entregará tu constancia de matriculado y horario de clases."),
-
-    "cuanto cuesta matricula": ("Costos de Matrícula 2025 (Fuente TUPA):\n\n"
-                                "• Matrícula Regular: S/. 200.00\n"
-                                "• Matrícula Extemporánea: S/. 260.00\n"
-                                "• Matrícula por Unidad Didáctica: S/. 50.00\n"
-                                "• Banco: Banco de la Nación (Cta. 0000289051)"),
-    
-    "cuando examen admision": ("Cronograma de Admisión 2025:\n\n"
-                               "• Inscripción Ordinaria: 17 Febrero - 12 Abril 2025\n"
-                               "• Examen de Admisión: 13 Abril 2025\n"
-                               "• Publicación Resultados: 19 Marzo 2025 (Exonerados) / 13 Abril (Ordinario)\n"
-                               "• Inicio de Clases: Abril 2025"),
-    
-    "requisitos admision": ("Requisitos de Admisión:\n\n"
-                            "1. Partida de Nacimiento (original o copia legalizada)\n"
-                            "2. Certificado de Estudios Secundaria (original)\n"
-                            "3. Copia de DNI\n"
-                            "4. Voucher de pago por derecho de inscripción (S/. 200.00)\n"
-                            "5. Carpeta de postulante (adquirir en Tesorería)"),
-
-    # --- INSTITUCIONAL ---
-    "mision vision": ("Misión y Visión Institucional:\n\n"
-                      "🏆 VISIÓN (al 2026): Ser una institución licenciada y acreditada, líder en formación técnica con valores e innovación.\n\n"
-                      "🎯 MISIÓN: Formar profesionales técnicos competentes, éticos y comprometidos con el medio ambiente y el mercado laboral."),
-    
-    "valores institucionales": ("Valores del IESTP JVA:\n\n"
-                                "🤝 Solidaridad\n🏫 Identidad\n👥 Trabajo en equipo\n⏰ Puntualidad\n🙏 Respeto\n⚖️ Justicia\n💎 Honestidad"),
-
-    "quienes autoridades": ("Autoridades (Plana Directiva):\n\n"
-                            "• Dir. General: Mg. Elsa Mary Castilla Almeyda\n"
-                            "• J. Unidad Académica: Mg. Moises Vargas Soto\n"
-                            "• J. Administración: Lic. Cardenal Ipurre Contreras\n"
-                            "• Secretario Académico: Ing. Javier Alarcon Mayta\n"
-                            "• J. Bienestar: Patricia Janet Benites Yglesias"),
-
-    "donde esta instituto": ("Ubicación Sede Principal:\n\n"
-                             "📍 Av. José Olaya N° 120, San Gabriel - Villa María del Triunfo, Lima\n"
-                             "📞 (01) 500 6177\n"
-                             "✉️ secretaria.academica@iestpjva.edu.pe\n"
-                             "Horarios: Diurno (8am-1pm) y Nocturno (5:30pm-10pm)"),
-
-    # --- CARRERAS Y DOCENTES (LISTAS COMPLETAS VALIDAS) ---
-    "carreras disponibles": ("Programas de Estudios (3 años / Título a Nombre de la Nación):\n\n"
-                             "1. Arquitectura de Plataformas y Servicios TI\n"
-                             "2. Contabilidad\n"
-                             "3. Enfermería Técnica\n"
-                             "4. Mecatrónica Automotriz\n"
-                             "5. Técnica en Farmacia"),
-
-    "docentes arquitectura": ("Plana Docente - Arquitectura de Plataformas y TI (10):\n\n"
-                              "• Hector Jorge Vidalón Jorge (Coord.)\n"
-                              "• Pedro Pachas Barrionuevo\n"
-                              "• Patricia Janet Benites Yglesias\n"
-                              "• Carlos Tasayco Yataco\n"
-                              "• Humberto Pablo Vega Cruz\n"
-                              "• John Harry Garriazo Castañeda\n"
-                              "• Christian Federico Flores Vargas\n"
-                              "• José Ricardo Cortez Camacho\n"
-                              "• Anthony Francisco Chuan Garcia\n"
-                              "• Luis Alberto Chacaltana Arnao"),
-
-    "docentes contabilidad": ("Plana Docente - Contabilidad (9):\n\n"
-                              "• Maria Cristina Maguiña Mallma (Coord.)\n"
-                              "• Elsa Castilla Almeyda\n"
-                              "• Teresa Cajo Rojas\n"
-                              "• Marisela Janet Palacios Castillo\n"
-                              "• Norma Yolanda Quispe Molina\n"
-                              "• Fernando Valderrama Castro\n"
-                              "• Luisa Verónica Sanchez Garcia\n"
-                              "• Elizabeth Manuela Ore Callirgos\n"
-                              "• Coralia Vilca Gonzales"),
-
-    "docentes enfermeria": ("Plana Docente - Enfermería Técnica (8):\n\n"
-                            "• Vicente Egusquiza Pozo (Coord.)\n"
-                            "• Fabiola Rodriguez Vega\n"
-                            "• Diana Noelia Saenz Charaja\n"
-                            "• Teresa Liliana Montoya Villasante\n"
-                            "• Leonor Nieto Pocomucha\n"
-                            "• Lizbeth Fabiola Jara Raraz\n"
-                            "• Sandra Oré Calderón\n"
-                            "• Mercedes Fuentes Lazo"),
-
-    "docentes mecatronica": ("Plana Docente - Mecatrónica Automotriz (9):\n\n"
-                             "• Cesar Augusto Curampa de la Cruz (Coord.)\n"
-                             "• Moisés Vargas Soto\n"
-                             "• Luis Agustín Mamani Chipana\n"
-                             "• Guillermo Carlos Barboza Tello\n"
-                             "• Jimmy Quispe Llamoca\n"
-                             "• Felix Hans Rivas Calla\n"
-                             "• Juan José Montaño Vega\n"
-                             "• Washington Ramirez Patiño\n"
-                             "• Juan Carlos Pancora Montes"),
-
-    "docentes farmacia": ("Plana Docente - Técnica en Farmacia (8):\n\n"
-                          "• Yolanda Suarez Diaz (Coord.)\n"
-                          "• Carmen Rosa Acco Gavilan\n"
-                          "• Seberino Alberto Canelo Blas\n"
-                          "• Miguel Ramiro Huarcaya Fernández\n"
-                          "• Fiorela Jeanette Ortiz Ortiz\n"
-                          "• Johao Junior Rodriguez Quishac\n"
-                          "• Emilia Ramirez Arnao\n"
-                          "• Shannon Calderon Quispe"),
-
-    "docentes empleabilidad": ("Plana Docente - Empleabilidad y Transversales (10):\n\n"
-                               "• Nilton Aquiles Michuy Suyo\n"
-                               "• Richard Mario Celis Calero\n"
-                               "• Daniel Quispe De La Torre\n"
-                               "• Juan Leopoldo Ranilla Medina\n"
-                               "• Wilmer Alarcon Mayta\n"
-                               "• Daniel Heli Flores Niño\n"
-                               "• Javier Alarcon Mayta\n"
-                               "• Lucia Lila Mendoza Huertas\n"
-                               "• Miguel Valerio Millones Yauri\n"
-                               "• Marilu Carpio Perez"),
-
-    # --- SERVICIOS Y BECAS ---
-    "becas disponibles": ("Becas y Beneficios:\n\n"
-                          "🥇 100% Dscto Matrícula: Primeros puestos de cada ciclo.\n"
-                          "🎖️ 50% Dscto Matrícula: Servicio Militar Acuartelado.\n"
-                          "📋 Requisitos: Constancia de notas o carnet de FF.AA."),
-
-    "servicios estudiantes": ("Servicios Complementarios:\n\n"
-                              "• Biblioteca Virtual (24/7)\n"
-                              "• Tópico de Salud\n"
-                              "• Servicio Piscopedagógico\n"
-                              "• Bolsa de Trabajo\n"
-                              "• Intranet del Estudiante"),
-                              
-    "libro reclamaciones": ("Libro de Reclamaciones Virtual:\n"
-                            "Disponible para registrar quejas o reclamos sobre servicios.\n"
-                            "Acceso: https://iestpjva.edu.pe/trasparencia/reclamos")
-}
-
+# El FAQ, el mapa universal y su índice difuso vienen del paquete de conocimiento
+# (data/knowledge.json, compilado en cache/knowledge_pack.json; ver knowledge_pack.py).
 
 STOPWORDS = {"el", "la", "de", "en", "y", "que", "los", "las", "un", "una", "quisiera", "me", "explicaras"}
 
-def normalize_text(text):
-    text = text.lower().strip()
-    for old, new in {"á":"a", "é":"e", "í":"i", "ó":"o", "ú":"u"}.items(): text = text.replace(old, new)
-    return text
+NO_INFO_RESPONSE = "Lo siento, no tengo información precisa sobre eso en este momento."
 
 # ============================================================================
 # LOGICA DE MAPEO UNIVERSAL (RESTAURADO PARA V7.1)
 # ============================================================================
-def check_universal_map(query_norm):
-    """Mapea palabras clave a respuestas FAQ fijas."""
-    universal_map = {
-        # Procesos
-        "matricula": "proceso matricula",
-        "matricularme": "proceso matricula",
-        "inscripcion": "requisitos admision",
-        "postular": "requisitos admision",
-        
-        # Docentes
-        "farmacia": "docentes farmacia",
-        "enfermeria": "docentes enfermeria",
-        "computacion": "docentes arquitectura",
-        "arquitectura": "docentes arquitectura",
-        "contabilidad": "docentes contabilidad",
-        "mecatronica": "docentes mecatronica",
-        "empleabilidad": "docentes empleabilidad",
-        
-        # Dinero
-        "costo": "cuanto cuesta matricula",
-        "pago": "cuanto cuesta matricula",
-        "mensualidad": "cuanto cuesta matricula",
-        
-        # Otros
-        "director": "quienes autoridades",
-        "beca": "becas disponibles",
-        "ubicacion": "donde esta instituto"
-    }
-
-    # Revisar si hay coincidencia de palabra clave
-    for keyword, faq_key in universal_map.items():
-        if keyword in query_norm:
-            # Filtro para evitar falsos positivos
-            # Ej: "cuanto duran las carreras de farmacia" -> No debe dar docentes
-            is_duration_query = any(w in query_norm for w in ["duracion", "tiempo", "años", "semestres", "malla"])
-            if faq_key.startswith("docentes") and is_duration_query:
-                continue
-                
-            if faq_key in FAQ:
-                return FAQ[faq_key]
+def check_universal_map(query_norm, hits=None, pack=None):
+    """Mapea palabras clave a respuestas FAQ fijas (universal_map del paquete de conocimiento)."""
+    pack = pack or get_knowledge_pack()
+    if hits is None:
+        hits = pack.scanner.scan(query_norm)
+    # El filtro de duración ("cuanto duran las carreras de farmacia" -> no docentes) lo aplica hits
+    for faq_key in hits.universal_targets():
+        if faq_key in pack.faq:
+            return pack.faq[faq_key]
     return None
 
-def match_faq(query):
-    query_norm = normalize_text(query)
-    best_match = None
-    best_score = 0.75
-    
-    for key, val in FAQ.items():
-        score = SequenceMatcher(None, query_norm, key).ratio()
-        if key in query_norm: score += 0.3
-        if score > best_score:
-            best_score = score
-            best_match = val
-            
-    return best_match
+def match_faq(query, query_norm=None, pack=None):
+    """FAQ más parecido (ratio > 0.75, +0.3 si la clave está contenida) vía índice de trigramas."""
+    pack = pack or get_knowledge_pack()
+    if query_norm is None:
+        query_norm = normalize_text(query)
+    key = pack.faq_matcher.best(query_norm)
+    return pack.faq[key] if key is not None else None
 
-def semantic_search(query, pdf_context, web_context):
-    keywords = [w for w in normalize_text(query).split() if len(w)>3 and w not in STOPWORDS]
+def semantic_search(query, pdf_context, web_context, analysis=None):
+    """
+    pdf_context: pasajes rankeados de search_in_documents (lista acotada, no el corpus).
+    web_context: PassageBuffer (o string) del sitio web; se puntúa por offsets sin partirlo.
+    """
+    words = analysis.words if analysis is not None else normalize_text(query).split()
+    keywords = [w for w in words if len(w)>3 and w not in STOPWORDS]
     if not keywords: return None
     
-    full = (pdf_context + "\n" + web_context).split('\n\n')
     best_para = None
     max_score = 0
     
-    for para in full:
-        score = sum(para.lower().count(kw) for kw in keywords)
+    for p in (pdf_context or []):
+        score = sum(p['text'].lower().count(kw) for kw in keywords)
         if score > max_score:
             max_score = score
-            best_para = para
+            best_para = p
+    
+    web = as_passage_buffer(web_context)
+    web_score, web_i = web.best(keywords) if web is not None else (0, None)
+    if web_score > max_score:
+        return web.passage(web_i) if web_score >= 2 else None
             
     if max_score >= 2:
-        return best_para
+        # Conservamos el marcador de página para que el filtro de "chunk feo" siga aplicando
+        return f"--- Página {best_para['page']} ---\n{best_para['text']}"
     return None
 
-def get_smart_response(user_message, pdf_context, web_context, ai_fallback_func):
+# ============================================================================
+# CONTEXTO DIFERIDO (PDF / WEB)
+# ============================================================================
+class LazyContext:
     """
-    Motor V7.1:
-    1. Check Universal Map (Prioridad Alta - Recuperado)
-    2. Check FAQ Fuzzy (Prioridad Media)
-    3. Check Complex Intent OR Generic Search (Inyección IA)
+    Contexto diferido: el proveedor solo se evalúa la primera vez que se pide.
+    Permite que las respuestas FAQ no paguen la búsqueda en PDFs ni el armado web.
+    """
+    _UNSET = object()
+
+    def __init__(self, provider):
+        self._provider = provider
+        self._value = self._UNSET
+
+    @property
+    def evaluated(self):
+        return self._value is not self._UNSET
+
+    def get(self):
+        if self._value is self._UNSET:
+            self._value = self._provider()
+        return self._value
+
+def resolve_context(ctx):
+    """Acepta LazyContext, callable o valor directo."""
+    if isinstance(ctx, LazyContext): return ctx.get()
+    if callable(ctx): return ctx()
+    return ctx
+
+def _route(user_message, pdf_context, web_context, analysis):
+    """
+    Fases 1 y 2 del motor: respuesta rápida (FAQ / búsqueda) o lo necesario para delegar a la IA.
+
+    Returns:
+        ((respuesta, fuente), None) si se resolvió sin IA, o
+        (None, (pdf_context, web_context, evidencia combinada o None, respaldo o None)) si hay que
+        delegar; el respaldo (texto, tipo) es la mejor evidencia FAQ/búsqueda para una respuesta
+        degradada si la IA no llega a responder.
     """
-    query_norm = normalize_text(user_message)
+    query_norm = analysis.normalized
+    hits = analysis.hits
+    pack = analysis.pack
     
     # 0. DETECTAR INTENCIÓN COMPLEJA
     # Si pide explicación, saltamos las respuestas rápidas y vamos directo a la IA inyectada
-    complex_triggers = ["explicar", "explica", "detalle", "detallado", "paso", "procedimiento", "como hago", "guia"]
-    is_complex = any(w in query_norm for w in complex_triggers)
+    is_complex = analysis.is_complex
     
     evidence = []
+    faq_hit = None
+    uni_match = None
     
     # --- FASE 1: RESPUESTAS RÁPIDAS (Solo si NO es una petición compleja) ---
     if not is_complex:
         # A. Mapeo Universal (Recuperado: "costos" -> FAQ)
-        uni_match = check_universal_map(query_norm)
+        uni_match = check_universal_map(query_norm, hits, pack)
         if uni_match:
             print("[SmartResponse] 🎯 Match Universal Map -> FAQ")
-            return (uni_match, "faq")
+            return (uni_match, "faq"), None
             
         # B. Match Fuzzy
-        faq_hit = match_faq(user_message)
+        faq_hit = match_faq(user_message, query_norm, pack)
         if faq_hit:
             print("[SmartResponse] ✅ Match FAQ Fuzzy")
-            return (faq_hit, "faq")
+            return (faq_hit, "faq"), None
 
     # --- FASE 2: RECOLECCIÓN DE EVIDENCIA (Para IA o Search Fallback) ---
     
     # Buscamos en FAQ igual (para dárselo a la IA si es compleja)
     if is_complex:
-        uni_match = check_universal_map(query_norm)
+        uni_match = check_universal_map(query_norm, hits, pack)
         if uni_match: evidence.append(f"DATOS FAQ: {uni_match}")
+        # En consultas simples el match fuzzy ya se calculó en la fase 1
+        faq_hit = match_faq(user_message, query_norm, pack)
         
-    faq_hit = match_faq(user_message)
     if faq_hit: evidence.append(f"DATOS FAQ FUZZY: {faq_hit}")
 
-    # Buscamos en Documentos
-    search_hit = semantic_search(user_message, pdf_context, web_context)
+    # Buscamos en Documentos (aquí recién se materializa el contexto diferido)
+    pdf_context = resolve_context(pdf_context)
+    web_context = resolve_context(web_context)
+    search_hit = semantic_search(user_message, pdf_context, web_context, analysis)
     if search_hit:
         # Si NO es compleja y no hubo FAQ antes, mostramos Search...
         # PERO filtro antipático: Si el search es "Página 46..." y no es compleja, 
@@ -294,23 +167,121 @@ def get_smart_response(user_message, pdf_context, web_context, ai_fallback_func)
                  evidence.append(f"FRAGMENTO CRUDO: {search_hit}")
              else:
                 print("[SmartResponse] 🔍 Match Semántico Directo")
-                return (f"Según documentación:\n{search_hit[:500]}...", "search")
+                return (f"Según documentación:\n{search_hit[:500]}...", "search"), None
         else:
             evidence.append(f"FRAGMENTO DOCS: {search_hit}")
 
+    # Respaldo por si la IA no responde a tiempo: FAQ exacto > FAQ difuso > fragmento de documentos
+    if uni_match or faq_hit:
+        fallback = (uni_match or faq_hit, "faq")
+    elif search_hit:
+        fallback = (f"Según documentación:\n{search_hit[:500]}...", "search")
+    else:
+        fallback = None
+
     # --- FASE 3: DELEGACIÓN A IA (Compleja o Fallback de Calidad) ---
     print(f"[SmartResponse] 🧠 Delegando a IA (Compleja={is_complex}). Evidencia: {len(evidence)}")
+    return None, (pdf_context, web_context, "\n\n".join(evidence) if evidence else None, fallback)
+
+def _degraded(fallback, reason):
+    """Respuesta degradada desde la evidencia ya encontrada: (texto, "degraded")."""
+    text, kind = fallback
+    print(f"[SmartResponse] ⏱️ {reason}: respuesta degradada ({kind})")
+    return text, "degraded"
+
+def _no_time(deadline):
+    return not deadline.allows(AI_MIN_MODEL_TIME)
+
+def get_smart_response(user_message, pdf_context, web_context, analysis=None, corpus_version=None, deadline=None):
+    """
+    Motor V7.1:
+    1. Check Universal Map (Prioridad Alta - Recuperado)
+    2. Check FAQ Fuzzy (Prioridad Media)
+    3. Check Complex Intent OR Generic Search (Inyección IA)
     
-    ai_manager = get_ai_manager()
-    combined_evidence = "\n\n".join(evidence) if evidence else None
+    pdf_context / web_context pueden ser LazyContext (o callables): solo se
+    evalúan si se llega a la fase 2 o 3.
+    analysis: QueryAnalysis del request (normalización + palabras clave, una sola vez).
+    corpus_version: versión del contenido para el cache IA (str, LazyContext o callable;
+    se evalúa después de materializar el contexto).
+    deadline: plazo del request (deadline.Deadline). Si no alcanza para la IA, o la IA no
+    responde, se devuelve la evidencia FAQ/búsqueda ya encontrada con fuente "degraded".
+    """
+    analysis = analysis or analyze_query(user_message)
+    deadline = deadline or Deadline()
+    answer, delegated = _route(user_message, pdf_context, web_context, analysis)
+    if answer: return answer
+    pdf_context, web_context, combined_evidence, fallback = delegated
+    if fallback and _no_time(deadline):
+        return _degraded(fallback, f"Plazo casi agotado ({deadline.remaining():.1f}s restantes)")
     
+    ai_manager = get_ai_manager()
     ai_resp = ai_manager.generate_response(
         user_message=user_message,
         pdf_context=pdf_context,
         web_context=web_context,
-        smart_context_injection=combined_evidence # Inyección V7
+        smart_context_injection=combined_evidence, # Inyección V7
+        analysis=analysis,
+        corpus_version=resolve_context(corpus_version) or "",
+        deadline=deadline
     )
     
     if ai_resp: return (ai_resp, "ai")
+    if fallback:
+        return _degraded(fallback, "Plazo agotado" if deadline.expired() else "La IA no respondió")
         
-    return ("Lo siento, no tengo información precisa sobre eso en este momento.", "error")
+    return (NO_INFO_RESPONSE, "error")
+
+class AnswerStream:
+    """Fragmentos de una respuesta y su fuente; la fuente puede cambiar mientras se consume."""
+
+    def __init__(self, chunks, source):
+        self.chunks = chunks
+        self.source = source
+
+    def __iter__(self):
+        return iter(self.chunks)
+
+def stream_smart_response(user_message, pdf_context, web_context, analysis=None, corpus_version=None, deadline=None):
+    """
+    Igual que get_smart_response, pero la respuesta es un AnswerStream: las respuestas
+    rápidas (FAQ / búsqueda) son un único fragmento y la IA emite los tokens a medida
+    que el modelo los genera. Si la IA no llega a empezar (plazo o fallas), se emite la
+    respuesta degradada y `source` pasa a "degraded" al consumir el stream.
+    """
+    analysis = analysis or analyze_query(user_message)
+    deadline = deadline or Deadline()
+    answer, delegated = _route(user_message, pdf_context, web_context, analysis)
+    if answer:
+        response, source = answer
+        return AnswerStream([response], source)
+    pdf_context, web_context, combined_evidence, fallback = delegated
+    if fallback and _no_time(deadline):
+        response, source = _degraded(fallback, f"Plazo casi agotado ({deadline.remaining():.1f}s restantes)")
+        return AnswerStream([response], source)
+
+    stream = AnswerStream(None, "ai")
+
+    def chunks():
+        produced = False
+        for chunk in get_ai_manager().stream_response(
+                user_message=user_message,
+                pdf_context=pdf_context,
+                web_context=web_context,
+                smart_context_injection=combined_evidence,
+                analysis=analysis,
+                corpus_version=resolve_context(corpus_version) or "",
+                deadline=deadline):
+            produced = True
+            yield chunk
+        if produced:
+            return
+        if fallback:
+            response, stream.source = _degraded(fallback, "Plazo agotado" if deadline.expired() else "La IA no respondió")
+            yield response
+        else:
+            stream.source = "error"
+            yield NO_INFO_RESPONSE
+
+    stream.chunks = chunks()
+    return stream
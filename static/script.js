@@ -36,28 +36,47 @@ async function sendMessage(){
     
     // [FIX] Mostrar indicador de carga inmediato
     const loadingId = 'loading-' + Date.now();
-    addMessage('assistant', '<i class="fas fa-spinner fa-spin"></i> Escribiendo...', null, null, loadingId);
+    const loading = addMessage('assistant', '<i class="fas fa-spinner fa-spin"></i> Escribiendo...', null, null, loadingId);
     
+    // Streaming (SSE): los tokens se pintan a medida que llegan, el mensaje final se reemplaza con sus IDs
+    let bubble=null, acc='', frame=false, done=null, failed=null;
+    const paint=()=>{ frame=false; if(bubble){ bubble.querySelector('.message-content').innerHTML=window.marked?marked.parse(acc):acc; scrollToBottom(); } };
     try{
-        const r=await fetch('/api/chat',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({message:txt,user_email:state.user.email,conversation_id:state.conversationId})});
-        const d=await r.json();
-        
-        // Eliminar indicador de carga
-        const loadMsg = document.querySelector(`[data-temp-id="${loadingId}"]`);
-        if(loadMsg) loadMsg.remove();
-
-        if(d.success){
-            if(d.conversation_id)state.conversationId=d.conversation_id;
-            addMessage('assistant',d.response,d.message_id,d.log_id);
-            if(d.conversation_id&&!document.querySelector(`[onclick*="${d.conversation_id}"]`))loadChatHistory();
-        }else addMessage('assistant','Error procesando solicitud.');
+        const r=await fetch('/api/chat/stream',{method:'POST',headers:{'Content-Type':'application/json'},body:JSON.stringify({message:txt,user_email:state.user.email,conversation_id:state.conversationId})});
+        if(!r.ok||!r.body) throw new Error(`HTTP ${r.status}`);
+        await readSSE(r,(ev,d)=>{
+            if(ev==='meta'){ if(d.conversation_id)state.conversationId=d.conversation_id; }
+            else if(ev==='token'){
+                if(!bubble){ loading.remove(); bubble=addMessage('assistant',''); }
+                acc+=d.text; if(!frame){ frame=true; requestAnimationFrame(paint); }
+            }
+            else if(ev==='done') done=d;
+            else if(ev==='error') failed=d.error||'Error procesando solicitud.';
+        });
+        loading.remove();
+        if(bubble&&done){ bubble.replaceWith(addMessage('assistant',acc,done.message_id,done.log_id)); }
+        else if(bubble) paint();
+        else addMessage('assistant',failed?`Error procesando solicitud: ${failed}`:'Error procesando solicitud.');
+        if(failed) showToast(failed,'error');
+        if(state.conversationId&&!document.querySelector(`[onclick*="${state.conversationId}"]`))loadChatHistory();
     }catch(e){
-        const loadMsg = document.querySelector(`[data-temp-id="${loadingId}"]`);
-        if(loadMsg) loadMsg.remove();
-        addMessage('assistant','Error de conexión.');
+        loading.remove();
+        if(bubble) paint(); else addMessage('assistant','Error de conexión.');
     }
     finally { state.isProcessing=false; if(els.sendBtn)els.sendBtn.disabled=false; scrollToBottom(); }
 }
+async function readSSE(r,onEvent){
+    const reader=r.body.getReader(), dec=new TextDecoder(); let buf='';
+    for(;;){
+        const {value,done}=await reader.read(); if(done)break;
+        buf+=dec.decode(value,{stream:true}); let i;
+        while((i=buf.indexOf('\n\n'))>=0){
+            const raw=buf.slice(0,i); buf=buf.slice(i+2); let ev='message',data='';
+            raw.split('\n').forEach(l=>{ if(l.startsWith('event:'))ev=l.slice(6).trim(); else if(l.startsWith('data:'))data+=l.slice(5).trim(); });
+            if(data) onEvent(ev,JSON.parse(data));
+        }
+    }
+}
 function addMessage(role,content,msgId=null,logId=null,tempId=null){
     const d=document.createElement('div'); d.className=`message ${role}`;
     if(msgId)d.dataset.messageId=msgId; if(logId)d.dataset.logId=logId; if(tempId)d.dataset.tempId=tempId;
@@ -72,6 +91,7 @@ function addMessage(role,content,msgId=null,logId=null,tempId=null){
         `<div class="msg-actions-row"><button class="action-btn" onclick="editMessage(this)"><i class="fas fa-edit"></i></button></div>`;
     d.innerHTML=`<div class="message-content">${parsed}</div><div class="message-actions">${actions}</div>`;
     els.messagesContainer?.appendChild(d);
+    return d;
 }
 
 // ============== HISTORIAL (Fix Restore Name) ==============
@@ -15,11 +15,14 @@ Para actualizar el cache estático (requiere Playwright instalado):
 import os
 import json
 import time
+import hashlib
 import requests
 from bs4 import BeautifulSoup
 from typing import Dict, List, Optional
 from datetime import datetime
 
+from passage_buffer import PassageBuffer
+
 from config import (
     INSTITUTO_WEB_PAGES,
     CACHE_FOLDER,
@@ -40,6 +43,20 @@ class WebScraper:
         self.static_cache_file = os.path.join(STATIC_CACHE_FOLDER, "static_web_cache.json")
         self.static_cache: Dict[str, dict] = {}
         
+        # Versión del contenido: solo avanza cuando el texto de alguna página cambia
+        self.content_version: int = 0
+        self._page_hashes: Dict[str, str] = {}
+        self._signature = ""
+        self._signature_version: int = -1
+        
+        # Corpus web ensamblado (enriquecido + unido) memoizado por versión
+        self._assembled_content: Optional[str] = None
+        self._assembled_version: int = -1
+        self._assembled_valid_until: float = 0
+        self.assembly_stats = {'rebuilds': 0, 'hits': 0}
+        # Offsets de pasajes + sombra en minúsculas del corpus ensamblado
+        self._buffer: Optional[PassageBuffer] = None
+        
         self._ensure_cache_folder()
         self._load_static_cache()
         self._load_cache()
@@ -64,8 +81,7 @@ class WebScraper:
                     loaded_count = 0
                     for url, page_data in self.static_cache.items():
                         if page_data.get('success') and page_data.get('content'):
-                            self.cache[url] = page_data['content']
-                            self.cache_timestamps[url] = time.time()
+                            self._set_page_content(url, page_data['content'], time.time())
                             loaded_count += 1
                     
                     metadata = data.get('metadata', {})
@@ -88,8 +104,7 @@ class WebScraper:
                     
                     for url, content in dynamic_cache.items():
                         if url not in self.cache:
-                            self.cache[url] = content
-                            self.cache_timestamps[url] = dynamic_timestamps.get(url, 0)
+                            self._set_page_content(url, content, dynamic_timestamps.get(url, 0))
                     
                 print(f"[WebScraper] Cache dinámico: {len(dynamic_cache)} páginas adicionales")
             except Exception as e:
@@ -106,6 +121,15 @@ class WebScraper:
         except Exception as e:
             print(f"[WebScraper] Error guardando cache: {e}")
     
+    def _set_page_content(self, url: str, content: str, timestamp: float):
+        """Guarda el texto de una página y avanza la versión solo si el texto cambió."""
+        digest = hashlib.sha1(content.encode('utf-8')).hexdigest()
+        if self._page_hashes.get(url) != digest:
+            self._page_hashes[url] = digest
+            self.content_version += 1
+        self.cache[url] = content
+        self.cache_timestamps[url] = timestamp
+    
     def _is_cache_valid(self, url: str) -> bool:
         """Verifica si el cache de una URL es válido."""
         if url in self.static_cache and self.static_cache[url].get('success'):
@@ -166,32 +190,99 @@ class WebScraper:
         
         content = self._extract_text_from_page(url)
         if content:
-            self.cache[url] = content
-            self.cache_timestamps[url] = time.time()
+            self._set_page_content(url, content, time.time())
             self._save_cache()
             print(f"[WebScraper] Extraído de {url}: {len(content)} caracteres")
         return content
 
     def get_all_website_content(self, force_refresh: bool = False) -> str:
-        """Obtiene el contenido de todas las páginas configuradas."""
-        all_content = []
-        print(f"[WebScraper] Procesando {len(INSTITUTO_WEB_PAGES)} páginas configuradas...")
+        """
+        Obtiene el contenido de todas las páginas configuradas.
+        
+        El corpus ensamblado se memoiza por `content_version`: mientras ninguna
+        página cambie de texto ni expire su cache, se devuelve el string ya armado.
+        """
+        if (not force_refresh and self._assembled_content is not None
+                and self._assembled_version == self.content_version
+                and time.time() < self._assembled_valid_until):
+            self.assembly_stats['hits'] += 1
+            return self._assembled_content
         
         import urllib3
         urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+        # Revalidar páginas (solo se descargan las expiradas o forzadas)
+        pages = []
         for url in INSTITUTO_WEB_PAGES:
             try:
                 content = self.get_page_content(url, force_refresh)
                 if content:
-                    # ENRIQUECIMIENTO DE CONTEXTO (Deep Fix para Docentes)
-                    # Inyectamos el contexto de la sección en cada línea para que RAG no pierda la referencia
-                    content = self._enrich_content_with_context(content, url)
-                    all_content.append(f"\n{'='*50}\nPÁGINA WEB: {url}\n{'='*50}\n{content}")
+                    pages.append((url, content))
             except Exception as e:
                 print(f"[WebScraper] Error procesando {url}: {e}")
         
-        return '\n\n'.join(all_content)
+        self._assembled_valid_until = self._compute_valid_until()
+        if self._assembled_content is not None and self._assembled_version == self.content_version:
+            # Páginas revalidadas sin cambios de texto: el ensamblado sigue vigente
+            self.assembly_stats['hits'] += 1
+            return self._assembled_content
+        
+        all_content = []
+        for url, content in pages:
+            # ENRIQUECIMIENTO DE CONTEXTO (Deep Fix para Docentes)
+            # Inyectamos el contexto de la sección en cada línea para que RAG no pierda la referencia
+            content = self._enrich_content_with_context(content, url)
+            all_content.append(f"\n{'='*50}\nPÁGINA WEB: {url}\n{'='*50}\n{content}")
+        
+        self._assembled_content = '\n\n'.join(all_content)
+        self._assembled_version = self.content_version
+        self.assembly_stats['rebuilds'] += 1
+        print(f"[WebScraper] Corpus web reconstruido (v{self.content_version}): "
+              f"{len(pages)} páginas, {len(self._assembled_content)} caracteres")
+        return self._assembled_content
+    
+    def get_website_buffer(self, force_refresh: bool = False) -> PassageBuffer:
+        """
+        Corpus web como PassageBuffer (offsets + minúsculas precalculadas).
+        Se reconstruye solo cuando cambia el string ensamblado.
+        """
+        content = self.get_all_website_content(force_refresh)
+        buffer = self._buffer
+        if buffer is None or buffer.text is not content:
+            buffer = PassageBuffer(content)
+            self._buffer = buffer
+        return buffer
+    
+    def _compute_valid_until(self) -> float:
+        """Momento en que expira la primera página no estática (inf si todas son estáticas)."""
+        valid_until = float('inf')
+        for url in INSTITUTO_WEB_PAGES:
+            if url in self.static_cache and self.static_cache[url].get('success'):
+                continue
+            # Páginas fallidas también se reintentan recién al vencer el intervalo
+            timestamp = self.cache_timestamps.get(url, time.time())
+            valid_until = min(valid_until, timestamp + CACHE_REFRESH_INTERVAL)
+        return valid_until
+    
+    def get_content_signature(self) -> str:
+        """Firma corta del texto de todas las páginas (memoizada por content_version)."""
+        if self._signature_version != self.content_version:
+            h = hashlib.sha1()
+            for url in sorted(self._page_hashes):
+                h.update(f"{url}|{self._page_hashes[url]}\n".encode('utf-8'))
+            self._signature = h.hexdigest()[:16]
+            self._signature_version = self.content_version
+        return self._signature
+    
+    def get_assembly_stats(self) -> Dict:
+        """Estadísticas del corpus web memoizado (cuántas veces se reconstruyó)."""
+        return {
+            'content_version': self.content_version,
+            'assembled_version': self._assembled_version,
+            'rebuilds': self.assembly_stats['rebuilds'],
+            'hits': self.assembly_stats['hits'],
+            'chars': len(self._assembled_content or ''),
+        }
 
     def _enrich_content_with_context(self, content: str, url: str) -> str:
         """